@@ -3,19 +3,30 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import os
 from flask_migrate import Migrate
+from .logging_setup import configure_logging
+from .profiling import init_profiling
+from .tracing import init_tracing
+from .serialization import init_json
+from .database import DB_PROFILE, engine_options, init_database
 
 
 db = SQLAlchemy()
 migrate = Migrate()
-def create_app():
+def create_app(profile=None):
+    configure_logging()
     app = Flask(__name__)
+    init_json(app)
     CORS(app)
+    profile = profile or DB_PROFILE
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'postgresql://postgres:postgres@db:5432/wds')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(profile, app.config['SQLALCHEMY_DATABASE_URI'])
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', str(1024 * 1024)))  # bytes, any request body
     
     db.init_app(app)
+    init_database(app, db, profile)
     migrate.init_app(app, db)
-    from .routes import ping_bp, subscriptions_bp, clients_bp, ingest_bp, swagger_bp, logs_bp
+    from .routes import ping_bp, subscriptions_bp, clients_bp, ingest_bp, swagger_bp, logs_bp, deadletters_bp, webhooks_bp, metrics_bp, profiling_bp
    
     
     app.register_blueprint(ping_bp)
@@ -24,7 +35,12 @@ def create_app():
     app.register_blueprint(ingest_bp)
     app.register_blueprint(swagger_bp)
     app.register_blueprint(logs_bp)
-    with app.app_context():
-        db.create_all()
+    app.register_blueprint(deadletters_bp)
+    app.register_blueprint(webhooks_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(profiling_bp)
+    init_profiling(app)
+    init_tracing(app)
+    # The schema is created and upgraded by the migrations: flask db upgrade
     
     return app
@@ -0,0 +1,329 @@
+from . import db
+from .models import DeliveryAttempt
+from .redis_client import get_redis
+from .status import status_values, upsert_statuses, invalidate_statuses
+from .rollups import apply_rollups
+from .metrics import DELIVERY_ATTEMPTS, DELIVERY_HTTP_LATENCY, DB_COMMIT_LATENCY, ATTEMPT_ROWS_LOST
+from .backpressure import release_backlog
+from flask import current_app
+from celery.signals import worker_process_shutdown, worker_shutdown
+from datetime import datetime
+import os
+import json
+import time
+import queue
+import socket
+import atexit
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 'final' writes one row per attempt once the outcome is known, with its status and
+# rollup upserts, in one commit per attempt.
+# 'batched' hands those writes to a per-process writer that flushes many attempts at once.
+# 'in_progress' is the old behaviour: insert a running row, then update it.
+ATTEMPT_MODE = os.getenv('DELIVERY_ATTEMPT_MODE', 'final')
+
+# Batched writer tuning
+WRITER_FLUSH_INTERVAL = float(os.getenv('ATTEMPT_WRITER_FLUSH_INTERVAL', '0.25'))  # seconds
+WRITER_BATCH_SIZE = int(os.getenv('ATTEMPT_WRITER_BATCH_SIZE', '500'))
+WRITER_QUEUE_SIZE = int(os.getenv('ATTEMPT_WRITER_QUEUE_SIZE', '10000'))
+WRITER_PUT_TIMEOUT = float(os.getenv('ATTEMPT_WRITER_PUT_TIMEOUT', '5'))  # seconds a task may block when the queue is full
+WRITER_RETRIES = int(os.getenv('ATTEMPT_WRITER_RETRIES', '3'))  # further tries of a failed batch before splitting it
+WRITER_RETRY_BACKOFF = float(os.getenv('ATTEMPT_WRITER_RETRY_BACKOFF', '0.5'))  # seconds, doubled per try
+
+# Optional Redis marker so running attempts stay visible in 'final' mode
+INFLIGHT_MARKERS = os.getenv('DELIVERY_INFLIGHT_MARKERS', '0') == '1'
+INFLIGHT_PREFIX = 'inflight:'
+
+
+def elapsed_ms(since, until):
+    if since is None:
+        return None
+    return max(int((until - since).total_seconds() * 1000), 0)
+
+
+def start_attempt(webhook_id, subscription_id, attempt_number, ttl_seconds, queued_since=None, received_at=None):
+    """
+    Begin recording an attempt. `queued_since` is when the task became due (enqueue
+    time or retry ETA) and `received_at` when the webhook was ingested; they are used
+    for the queue and end-to-end latencies. Returns a dict with the attempt's fields
+    plus, in 'in_progress' mode, the row that was inserted up-front.
+    """
+    now = datetime.utcnow()
+    attempt = {
+        'webhook_id': webhook_id,
+        'subscription_id': subscription_id,
+        'attempt_number': attempt_number,
+        'timestamp': now,
+        'queue_ms': elapsed_ms(queued_since, now),
+        'received_at': received_at,
+        'row': None,
+    }
+
+    if ATTEMPT_MODE == 'in_progress':
+        row = DeliveryAttempt(
+            webhook_id=webhook_id,
+            subscription_id=subscription_id,
+            attempt_number=attempt_number,
+            timestamp=attempt['timestamp'],
+            status='in_progress'
+        )
+        db.session.add(row)
+        db.session.commit()
+        attempt['row'] = row
+
+    if INFLIGHT_MARKERS:
+        try:
+            get_redis().set(
+                INFLIGHT_PREFIX + webhook_id,
+                json.dumps({
+                    'webhook_id': webhook_id,
+                    'subscription_id': subscription_id,
+                    'attempt_number': attempt_number,
+                    'started_at': attempt['timestamp'].isoformat(),
+                    'worker': socket.gethostname(),
+                }),
+                px=int(ttl_seconds * 1000),
+            )
+        except Exception as e:
+            logger.warning('Could not set in-flight marker for webhook %s: %s', webhook_id, e)
+
+    return attempt
+
+
+def finish_attempt(attempt, status, state, next_retry_at=None, status_code=None, error_message=None,
+                   response_body=None, duration_ms=None):
+    """
+    Persist the final outcome of an attempt, together with the webhook's new
+    summary `state` (retrying, delivered, dead) and the minute rollups, and clear
+    its in-flight marker.
+
+    Outside 'batched' mode this is one transaction and one commit per attempt,
+    but not one write: the attempt INSERT, the webhook_status upsert, one
+    delivery rollup upsert and up to three latency rollup upserts (http, queue,
+    e2e), so up to six rows. 'batched' mode spreads the commit and the rollup
+    upserts over many attempts.
+    """
+    e2e_ms = elapsed_ms(attempt['received_at'], datetime.utcnow())
+    DELIVERY_ATTEMPTS.labels(state).inc()
+    if state in ('delivered', 'dead'):
+        release_backlog(attempt['subscription_id'])
+    if duration_ms is not None:
+        DELIVERY_HTTP_LATENCY.observe(duration_ms / 1000)
+    record = {
+        'attempt': {
+            'webhook_id': attempt['webhook_id'],
+            'subscription_id': attempt['subscription_id'],
+            'attempt_number': attempt['attempt_number'],
+            'timestamp': attempt['timestamp'],
+            'status': status,
+            'status_code': status_code,
+            'error_message': error_message[:500] if error_message else None,
+            'response_body': response_body[:500] if response_body else None,
+            'duration_ms': duration_ms,
+            'queue_ms': attempt['queue_ms'],
+            'e2e_ms': e2e_ms,
+        },
+        'status': status_values(
+            attempt['webhook_id'],
+            attempt['subscription_id'],
+            state,
+            attempt['attempt_number'],
+            last_status_code=status_code,
+            last_attempt_at=attempt['timestamp'],
+            next_retry_at=next_retry_at,
+        ),
+        'latency': {'http': duration_ms, 'queue': attempt['queue_ms'], 'e2e': e2e_ms},
+    }
+
+    if ATTEMPT_MODE == 'batched':
+        get_writer().submit(record)
+        clear_in_flight(attempt['webhook_id'])
+        return
+
+    row = attempt['row']
+    if row is None:
+        db.session.add(DeliveryAttempt(**record['attempt']))
+    else:
+        for key, value in record['attempt'].items():
+            setattr(row, key, value)
+    try:
+        upsert_statuses([record['status']])
+        apply_rollups(rollup_inputs([record]))
+        with DB_COMMIT_LATENCY.labels('attempt').time():
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    invalidate_statuses([attempt['webhook_id']])
+    clear_in_flight(attempt['webhook_id'])
+
+
+def rollup_inputs(records):
+    return [dict(record['attempt'], latency=record['latency']) for record in records]
+
+
+def clear_in_flight(webhook_id):
+    if INFLIGHT_MARKERS:
+        try:
+            get_redis().delete(INFLIGHT_PREFIX + webhook_id)
+        except Exception as e:
+            logger.warning('Could not clear in-flight marker for webhook %s: %s', webhook_id, e)
+
+
+def get_in_flight(limit=1000):
+    """
+    Attempts currently running, read from the Redis markers.
+    """
+    client = get_redis()
+    keys = []
+    for key in client.scan_iter(match=INFLIGHT_PREFIX + '*', count=500):
+        keys.append(key)
+        if len(keys) >= limit:
+            break
+    if not keys:
+        return []
+    return [json.loads(value) for value in client.mget(keys) if value]
+
+
+class AttemptWriter:
+    """
+    Per-process buffer for DeliveryAttempt rows and their webhook status updates.
+    A background thread drains the queue and writes up to WRITER_BATCH_SIZE rows
+    per multi-row INSERT (plus one batched status and rollup upsert), at least
+    every WRITER_FLUSH_INTERVAL seconds. The queue is bounded: when the database
+    falls behind, submit() blocks the calling task (backpressure) and, past
+    WRITER_PUT_TIMEOUT, writes the row itself rather than dropping it.
+
+    A batch that fails to write is retried WRITER_RETRIES times with backoff,
+    then written row by row, so only a row that cannot be written on its own is
+    lost; those are logged and counted in wds_attempt_rows_lost_total.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.queue = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='attempt-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, record):
+        try:
+            self.queue.put(record, timeout=WRITER_PUT_TIMEOUT)
+        except queue.Full:
+            logger.warning('Attempt writer queue is full, writing attempt synchronously')
+            self._write([record])
+
+    def _run(self):
+        while not self.stopping.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+
+    def _collect(self):
+        """Wait for the first row, then gather more until the batch is full or the interval is up."""
+        try:
+            batch = [self.queue.get(timeout=WRITER_FLUSH_INTERVAL)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + WRITER_FLUSH_INTERVAL
+        while len(batch) < WRITER_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, records):
+        delay = WRITER_RETRY_BACKOFF
+        for attempt in range(WRITER_RETRIES + 1):
+            error = self._write_batch(records)
+            if error is None:
+                return
+            logger.warning('Failed to write %s delivery attempts (try %s of %s): %s',
+                           len(records), attempt + 1, WRITER_RETRIES + 1, error)
+            if attempt < WRITER_RETRIES:
+                time.sleep(delay)
+                delay *= 2
+        if len(records) == 1:
+            self._lost(records[0], error)
+            return
+        # Isolate the rows that cannot be written
+        for record in records:
+            error = self._write_batch([record])
+            if error is not None:
+                self._lost(record, error)
+
+    def _write_batch(self, records):
+        """Write the rows in one transaction. Returns the error, or None once committed."""
+        # Only the latest status per webhook in a batch matters
+        statuses = {record['status']['webhook_id']: record['status'] for record in records}
+        with self.app.app_context():
+            try:
+                db.session.execute(DeliveryAttempt.__table__.insert(), [record['attempt'] for record in records])
+                upsert_statuses(list(statuses.values()))
+                apply_rollups(rollup_inputs(records))
+                with DB_COMMIT_LATENCY.labels('attempt_batch').time():
+                    db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                return e
+            finally:
+                db.session.remove()
+        invalidate_statuses(list(statuses.keys()))
+        return None
+
+    def _lost(self, record, error):
+        ATTEMPT_ROWS_LOST.inc()
+        logger.error('Dropped delivery attempt %s for webhook %s: %s',
+                     record['attempt'].get('attempt_number'), record['status']['webhook_id'], error)
+
+    def close(self, timeout=10):
+        """Stop the background thread and flush whatever is still queued."""
+        self.stopping.set()
+        self.thread.join(timeout)
+        rows = []
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(rows), WRITER_BATCH_SIZE):
+            self._write(rows[i:i + WRITER_BATCH_SIZE])
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """
+    The writer for this process. Prefork children do not inherit the parent's
+    thread, so a new writer is started the first time it is used after a fork.
+    """
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer_pid != os.getpid():
+                _writer = AttemptWriter(current_app._get_current_object())
+                _writer_pid = os.getpid()
+    return _writer
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_writer(**kwargs):
+    global _writer
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.close()
+        _writer = None
+
+
+atexit.register(close_writer)
@@ -0,0 +1,224 @@
+"""
+Ingest admission control.
+
+When workers fall behind, accepting everything only moves the overload into the
+broker until Redis runs out of memory. Ingest therefore checks two watermarks
+and answers 429 with Retry-After above them:
+
+ - broker depth: messages waiting in the delivery lanes (all priorities). Ingest
+   is refused once it reaches INGEST_MAX_QUEUE_DEPTH and admitted again once it
+   drops to INGEST_QUEUE_LOW_WATERMARK, so the gate does not flap at the limit.
+ - subscription backlog: deliveries for one subscription that are neither
+   delivered nor dead, limited by INGEST_MAX_SUBSCRIPTION_BACKLOG, so one slow
+   subscriber cannot take the whole queue. Events skip the subscriptions over
+   their backlog and are still delivered to the others.
+
+Nothing here costs a Redis call per request. Each process samples the lane
+depths and the backlogs of the subscriptions it has seen at most every
+INGEST_BACKPRESSURE_INTERVAL seconds, in one pipeline. That pipeline also
+flushes the backlog increments for webhooks accepted since the last sample.
+Workers decrement a subscription's backlog when a delivery finishes
+(finish_attempt), and reconcile_backlog() periodically corrects drift against
+webhook_status, applying the difference so concurrent updates are kept. If
+Redis is unavailable, ingest is admitted.
+"""
+from .redis_client import get_redis
+from .queues import DELIVERY_QUEUE, RETRY_QUEUE, REPLAY_QUEUE, queue_keys
+from collections import Counter
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+INGEST_MAX_QUEUE_DEPTH = int(os.getenv('INGEST_MAX_QUEUE_DEPTH', '0'))  # 0 disables the broker watermark
+INGEST_QUEUE_LOW_WATERMARK = int(os.getenv('INGEST_QUEUE_LOW_WATERMARK', str(int(INGEST_MAX_QUEUE_DEPTH * 0.8))))
+INGEST_MAX_SUBSCRIPTION_BACKLOG = int(os.getenv('INGEST_MAX_SUBSCRIPTION_BACKLOG', '0'))  # 0 disables
+INGEST_BACKPRESSURE_INTERVAL = float(os.getenv('INGEST_BACKPRESSURE_INTERVAL', '1.0'))  # seconds between samples
+INGEST_RETRY_AFTER = int(os.getenv('INGEST_RETRY_AFTER', '5'))  # seconds, sent in Retry-After
+
+BACKLOG_KEY = 'backlog:subscriptions'
+BACKLOG_TRACKING = INGEST_MAX_SUBSCRIPTION_BACKLOG > 0
+LANES = (DELIVERY_QUEUE, RETRY_QUEUE, REPLAY_QUEUE)
+MAX_WATCHED = 10000  # subscriptions whose backlog one sample reads
+
+# KEYS[1] backlog hash; ARGV subscription id and correction in turn. Entries that reach 0 are removed.
+_RECONCILE = """
+for i = 1, #ARGV, 2 do
+    if redis.call('hincrby', KEYS[1], ARGV[i], ARGV[i + 1]) == 0 then
+        redis.call('hdel', KEYS[1], ARGV[i])
+    end
+end
+return #ARGV / 2
+"""
+
+_scripts = {'client': None}
+
+
+def reconcile_script():
+    client = get_redis()
+    if _scripts['client'] is not client:
+        _scripts.update(client=client, reconcile=client.register_script(_RECONCILE))
+    return _scripts['reconcile']
+
+
+class Sampler:
+    """
+    Per-process view of broker depth and subscription backlogs. The first
+    request to find it stale refreshes it; concurrent requests use the last sample.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.available = True  # False after a failed sample: admit everything until Redis is back
+        self.overloaded = False
+        self.backlogs = {}
+        self.sampled_at = 0
+        self._watched = set()
+        self._pending = Counter()
+        self._pending_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return INGEST_MAX_QUEUE_DEPTH > 0 or BACKLOG_TRACKING
+
+    def check(self, sub_id=None):
+        """Why ingest for `sub_id` should be refused right now ('queue_depth', 'subscription_backlog'), or None."""
+        if not self.enabled:
+            return None
+        if time.monotonic() - self.sampled_at >= INGEST_BACKPRESSURE_INTERVAL:
+            self.refresh()
+        if not self.available:
+            return None
+        if self.overloaded:
+            return 'queue_depth'
+        if BACKLOG_TRACKING and sub_id is not None and self._over_backlog(str(sub_id)):
+            return 'subscription_backlog'
+        return None
+
+    def backlogged(self, sub_ids):
+        """The subscriptions among `sub_ids` that are at INGEST_MAX_SUBSCRIPTION_BACKLOG."""
+        if not BACKLOG_TRACKING:
+            return set()
+        if time.monotonic() - self.sampled_at >= INGEST_BACKPRESSURE_INTERVAL:
+            self.refresh()
+        if not self.available:
+            return set()
+        return {sub_id for sub_id in sub_ids if self._over_backlog(str(sub_id))}
+
+    def _over_backlog(self, sub_id):
+        self._watched.add(sub_id)
+        return self.backlogs.get(sub_id, 0) + self._pending.get(sub_id, 0) >= INGEST_MAX_SUBSCRIPTION_BACKLOG
+
+    def accepted(self, sub_ids):
+        """Count webhooks queued for these subscriptions; written to Redis with the next sample."""
+        if not BACKLOG_TRACKING:
+            return
+        with self._pending_lock:
+            self._pending.update(str(sub_id) for sub_id in sub_ids)
+
+    def refresh(self):
+        # One thread samples; the others keep using the previous sample meanwhile
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._sample()
+        finally:
+            self.sampled_at = time.monotonic()
+            self._refresh_lock.release()
+
+    def _sample(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, Counter()
+        watched = list(self._watched)[:MAX_WATCHED]
+        self._watched = set()
+
+        lane_keys = [key for lane in LANES for key in queue_keys(lane)] if INGEST_MAX_QUEUE_DEPTH > 0 else []
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for key in lane_keys:
+                pipe.llen(key)
+            for sub_id, count in pending.items():
+                pipe.hincrby(BACKLOG_KEY, sub_id, count)
+            if watched:
+                pipe.hmget(BACKLOG_KEY, watched)
+            results = pipe.execute()
+        except Exception as e:
+            logger.warning('Could not sample ingest backpressure, admitting all ingest: %s', e)
+            with self._pending_lock:
+                self._pending.update(pending)
+            self.available = False
+            return
+        self.available = True
+
+        if lane_keys:
+            self.depth = sum(results[:len(lane_keys)])
+            if self.overloaded and self.depth <= INGEST_QUEUE_LOW_WATERMARK:
+                self.overloaded = False
+                logger.info('Broker depth down to %s; admitting ingest again', self.depth)
+            elif not self.overloaded and self.depth >= INGEST_MAX_QUEUE_DEPTH:
+                self.overloaded = True
+                logger.warning('Broker depth %s reached INGEST_MAX_QUEUE_DEPTH; refusing ingest', self.depth)
+        if watched:
+            self.backlogs = {
+                sub_id: int(value) for sub_id, value in zip(watched, results[-1]) if value is not None
+            }
+
+
+sampler = Sampler()
+
+
+def release_backlog(subscription_id):
+    """A delivery for the subscription finished (delivered or dead)."""
+    if not BACKLOG_TRACKING:
+        return
+    try:
+        get_redis().hincrby(BACKLOG_KEY, str(subscription_id), -1)
+    except Exception as e:
+        logger.warning('Could not release backlog for subscription %s: %s', subscription_id, e)
+
+
+def add_backlog(counts):
+    """Add {subscription_id: deliveries} queued outside ingest, e.g. by a dead-letter replay."""
+    if not BACKLOG_TRACKING or not counts:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for subscription_id, count in counts.items():
+            pipe.hincrby(BACKLOG_KEY, str(subscription_id), count)
+        pipe.execute()
+    except Exception as e:
+        logger.warning('Could not add replayed deliveries to subscription backlogs: %s', e)
+
+
+def reconcile_backlog():
+    """
+    Correct the backlog counters towards the pending/retrying counts in
+    webhook_status. The counters are read before the query and only the
+    difference is applied, by HINCRBY in one script, so increments and releases
+    made meanwhile are kept rather than overwritten. One that lands between the
+    read and the query is counted twice until the next run corrects it.
+    """
+    if not BACKLOG_TRACKING:
+        return
+    from . import db
+    from .models import WebhookStatus
+    from sqlalchemy import select, func
+
+    counters = {key.decode(): int(value) for key, value in get_redis().hgetall(BACKLOG_KEY).items()}
+    rows = db.session.execute(
+        select(WebhookStatus.subscription_id, func.count())
+        .where(WebhookStatus.state.in_(('pending', 'retrying')))
+        .group_by(WebhookStatus.subscription_id)
+    ).all()
+    expected = {str(subscription_id): count for subscription_id, count in rows}
+    args = []
+    for sub_id in expected.keys() | counters.keys():
+        correction = expected.get(sub_id, 0) - counters.get(sub_id, 0)
+        if correction:
+            args += [sub_id, correction]
+    if args:
+        reconcile_script()(keys=[BACKLOG_KEY], args=args)
+    logger.info('Reconciled backlog counters for %s subscriptions (%s corrected)', len(expected), len(args) // 2)
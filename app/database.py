@@ -0,0 +1,142 @@
+"""
+SQLAlchemy engine profiles for web and worker processes.
+
+create_app(profile) sizes the connection pool for the kind of process it runs
+in. Web processes serve many concurrent requests and should fail fast when the
+pool is exhausted. A prefork worker child runs one task at a time, plus the
+attempt writer thread, but there are many of them. Each profile reads its
+settings from DB_<PROFILE>_* variables, with the defaults in PROFILES:
+
+    POOL_SIZE, MAX_OVERFLOW   connections kept open / allowed on top under load
+    POOL_TIMEOUT              seconds to wait for a free connection
+    POOL_RECYCLE              seconds before a connection is replaced
+    POOL_PRE_PING             1 to test connections when they are checked out
+    STATEMENT_TIMEOUT_MS      server-side statement timeout; 0 disables
+
+A process's total is POOL_SIZE + MAX_OVERFLOW, so a deployment needs about
+(web processes x web total) + (worker children x worker total) + relays
+connections. Postgres' max_connections, or PgBouncer's pool, must allow that.
+
+Pools are emptied in the child after every fork (Celery prefork children,
+pre-loading web servers). Connections opened by the parent are left to the
+parent instead of being shared between processes.
+
+DB_PGBOUNCER=1 adapts the engine to PgBouncer in transaction pooling mode.
+Startup options are not sent, because PgBouncer rejects them. The statement
+timeout is therefore set with SET LOCAL at the start of each transaction,
+which costs one extra round trip per transaction; setting it on the database
+role instead and the variable to 0 avoids that. psycopg2 does not use
+server-side prepared statements and the app keeps no session state, so
+nothing else depends on keeping the same server connection.
+"""
+from .metrics import DB_POOL_CHECKOUT_WAIT, DB_POOL_TIMEOUTS
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+import os
+import time
+import logging
+import weakref
+
+logger = logging.getLogger(__name__)
+
+DB_PROFILE = os.getenv('DB_PROFILE', 'web')  # used when create_app() is not given a profile
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', '0') == '1'
+
+PROFILES = {
+    'web': {
+        'POOL_SIZE': 10,
+        'MAX_OVERFLOW': 10,
+        'POOL_TIMEOUT': 5,
+        'POOL_RECYCLE': 1800,
+        'POOL_PRE_PING': 1,
+        'STATEMENT_TIMEOUT_MS': 10000,
+    },
+    'worker': {
+        'POOL_SIZE': 2,
+        'MAX_OVERFLOW': 2,
+        'POOL_TIMEOUT': 30,
+        'POOL_RECYCLE': 1800,
+        'POOL_PRE_PING': 1,
+        'STATEMENT_TIMEOUT_MS': 60000,  # retention and replay batches
+    },
+}
+
+_engines = weakref.WeakSet()
+
+
+def profile_settings(profile):
+    """The profile's settings, each overridable with DB_<PROFILE>_<NAME>."""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile {profile!r}; expected one of {', '.join(PROFILES)}")
+    return {
+        name: type(default)(float(os.getenv(f'DB_{profile.upper()}_{name}', default)))
+        for name, default in PROFILES[profile].items()
+    }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, creator, pool_profile='web', **kwargs):
+        super().__init__(creator, **kwargs)
+        self.profile = pool_profile
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            DB_POOL_TIMEOUTS.labels(self.profile).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(self.profile).observe(time.perf_counter() - started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.profile = self.profile
+        return pool
+
+
+def engine_options(profile, url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the profile. SQLite keeps Flask-SQLAlchemy's defaults."""
+    if url.startswith('sqlite'):
+        return {}
+    settings = profile_settings(profile)
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_profile': profile,
+        'pool_size': settings['POOL_SIZE'],
+        'max_overflow': settings['MAX_OVERFLOW'],
+        'pool_timeout': settings['POOL_TIMEOUT'],
+        'pool_recycle': settings['POOL_RECYCLE'],
+        'pool_pre_ping': bool(settings['POOL_PRE_PING']),
+    }
+    if url.startswith('postgresql'):
+        connect_args = {'application_name': f'wds-{profile}'}
+        if settings['STATEMENT_TIMEOUT_MS'] and not DB_PGBOUNCER:
+            connect_args['options'] = f"-c statement_timeout={settings['STATEMENT_TIMEOUT_MS']}"
+        options['connect_args'] = connect_args
+    return options
+
+
+def init_database(app, db, profile):
+    """Hook up the engine created by db.init_app(): PgBouncer timeouts and reset after fork."""
+    with app.app_context():
+        engine = db.engine
+    _engines.add(engine)
+    timeout = profile_settings(profile)['STATEMENT_TIMEOUT_MS']
+    if DB_PGBOUNCER and timeout and engine.dialect.name == 'postgresql':
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(conn):
+            conn.exec_driver_sql(f'SET LOCAL statement_timeout = {timeout}')
+    logger.info('Database engine for the %s profile: %s', profile, engine.pool.status())
+
+
+def reset_after_fork():
+    # Drop the parent's pooled connections without closing them; the parent still owns them
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
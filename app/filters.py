@@ -0,0 +1,226 @@
+"""
+Per-subscription payload filters.
+
+A filter is a JSON object mapping paths in the payload to conditions; every
+condition must hold for the payload to be delivered:
+
+    {"event": "user.created"}
+    {"$.event": {"in": ["user.created", "user.deleted"]}, "data.amount": {"gte": 100}}
+    {"$any": [{"event": "order.paid"}, {"data.priority": "high"}]}
+
+Paths are dot-separated (an optional leading "$." is ignored) and integer
+segments index into lists. A bare value means equality; an object of operators
+(eq, ne, in, nin, gt, gte, lt, lte, exists, prefix) applies all of them. "$any"
+takes a list of filters and holds if one of them does. true and false only
+equal themselves, not 1 and 0 as in Python.
+
+Filters are compiled once into nested closures and cached by their canonical
+JSON, so evaluating one is a handful of dict lookups and comparisons. Ingest
+looks a subscription's compiled filter up by subscription id instead, without
+serializing the filter again. Those entries live for FILTER_CACHE_TTL seconds
+and are dropped at once in the process that updates or deletes the
+subscription; other processes pick the change up when theirs expire.
+"""
+from functools import lru_cache
+import os
+import json
+import time
+import logging
+import operator
+
+logger = logging.getLogger(__name__)
+
+FILTER_CACHE_SIZE = int(os.getenv('FILTER_CACHE_SIZE', '4096'))
+FILTER_CACHE_TTL = float(os.getenv('FILTER_CACHE_TTL', '30'))  # seconds a subscription's compiled filter is reused
+MAX_FILTER_LENGTH = 4096  # characters of canonical JSON
+
+ANY = '$any'
+_MISSING = object()
+
+_COMPARISONS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+
+def _path(path):
+    if path.startswith('$.'):
+        path = path[2:]
+    if not path:
+        raise ValueError('Filter paths must not be empty')
+    return tuple(int(part) if part.isdigit() else part for part in path.split('.'))
+
+
+def _getter(path):
+    parts = _path(path)
+
+    def get(payload):
+        value = payload
+        for part in parts:
+            if isinstance(value, dict):
+                value = value.get(part if isinstance(part, str) else str(part), _MISSING)
+            elif isinstance(value, list) and isinstance(part, int):
+                value = value[part] if part < len(value) else _MISSING
+            else:
+                return _MISSING
+            if value is _MISSING:
+                return _MISSING
+        return value
+    return get
+
+
+def _same(value, expected):
+    # Python has True == 1 and False == 0; JSON booleans are not numbers
+    return value == expected and isinstance(value, bool) == isinstance(expected, bool)
+
+
+def _member(value):
+    """Set element for a scalar, keeping booleans apart from 0 and 1."""
+    return isinstance(value, bool), value
+
+
+def _test(op, expected):
+    """Predicate on a single value for one operator."""
+    if op == 'eq':
+        return lambda value: _same(value, expected)
+    if op == 'ne':
+        return lambda value: not _same(value, expected)
+    if op in ('in', 'nin'):
+        if not isinstance(expected, list):
+            raise ValueError(f"'{op}' takes a list")
+        try:
+            options = frozenset(_member(option) for option in expected)
+
+            def contains(value):
+                try:
+                    return _member(value) in options
+                except TypeError:  # an object or list in the payload, checked against a set
+                    return False
+        except TypeError:
+            def contains(value):
+                return any(_same(value, option) for option in expected)
+        if op == 'in':
+            return lambda value: value is not _MISSING and contains(value)
+        return lambda value: value is _MISSING or not contains(value)
+    if op == 'exists':
+        if not isinstance(expected, bool):
+            raise ValueError("'exists' takes true or false")
+        return lambda value: (value is not _MISSING) == expected
+    if op == 'prefix':
+        if not isinstance(expected, str):
+            raise ValueError("'prefix' takes a string")
+        return lambda value: isinstance(value, str) and value.startswith(expected)
+    if op in _COMPARISONS:
+        if isinstance(expected, bool) or not isinstance(expected, (int, float, str)):
+            raise ValueError(f"'{op}' takes a number or a string")
+        compare = _COMPARISONS[op]
+        numeric = not isinstance(expected, str)
+
+        def test(value):
+            if numeric != (isinstance(value, (int, float)) and not isinstance(value, bool)):
+                return False
+            if not numeric and not isinstance(value, str):
+                return False
+            return compare(value, expected)
+        return test
+    raise ValueError(f"Unknown filter operator '{op}'")
+
+
+def _condition(path, condition):
+    get = _getter(path)
+    if isinstance(condition, dict):
+        if not condition:
+            raise ValueError(f"Empty condition for '{path}'")
+        tests = [_test(op, expected) for op, expected in condition.items()]
+    else:
+        tests = [_test('eq', condition)]
+    if len(tests) == 1:
+        test = tests[0]
+        return lambda payload: test(get(payload))
+
+    def check(payload):
+        value = get(payload)
+        return all(test(value) for test in tests)
+    return check
+
+
+def _compile(spec):
+    if not isinstance(spec, dict):
+        raise ValueError('A filter must be a JSON object')
+    checks = []
+    for key, condition in spec.items():
+        if key == ANY:
+            if not isinstance(condition, list) or not condition:
+                raise ValueError(f"'{ANY}' takes a non-empty list of filters")
+            options = [_compile(option) for option in condition]
+            checks.append(lambda payload, options=options: any(option(payload) for option in options))
+        else:
+            checks.append(_condition(key, condition))
+    if len(checks) == 1:
+        return checks[0]
+    return lambda payload: all(check(payload) for check in checks)
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _compile_canonical(canonical):
+    return _compile(json.loads(canonical))
+
+
+def _canonical(spec):
+    return json.dumps(spec, sort_keys=True, separators=(',', ':'))
+
+
+def compile_filter(spec):
+    """Callable(payload) -> bool for a filter; None (no filter) accepts everything."""
+    if spec is None:
+        return None
+    return _compile_canonical(_canonical(spec))
+
+
+def validate_filter(spec):
+    """The filter unchanged if it compiles; raises ValueError otherwise."""
+    if spec is None:
+        return None
+    if len(_canonical(spec)) > MAX_FILTER_LENGTH:
+        raise ValueError(f'filter must be at most {MAX_FILTER_LENGTH} characters of JSON')
+    compile_filter(spec)
+    return spec
+
+
+_subscription_filters = {}  # sub_id -> (compiled filter or None, expires_at)
+
+
+def subscription_filter(sub_id, spec):
+    """
+    The compiled filter of subscription `sub_id`, whose stored filter is `spec`.
+    An invalid stored filter is logged and ignored, as the routing index does.
+    """
+    now = time.monotonic()
+    cached = _subscription_filters.get(sub_id)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    try:
+        check = compile_filter(spec)
+    except ValueError as e:
+        logger.error('Ignoring invalid filter on subscription %s: %s', sub_id, e)
+        check = None
+    if len(_subscription_filters) >= FILTER_CACHE_SIZE:
+        _subscription_filters.clear()
+    _subscription_filters[sub_id] = (check, now + FILTER_CACHE_TTL)
+    return check
+
+
+def forget_filter(sub_id):
+    """Drop this process's compiled filter after the subscription changed."""
+    _subscription_filters.pop(str(sub_id), None)
+
+
+def matches(spec, payload, sub_id=None):
+    """
+    Whether a payload passes a filter. With `sub_id` the filter is the
+    subscription's and its compiled form is looked up by id.
+    """
+    check = compile_filter(spec) if sub_id is None else subscription_filter(str(sub_id), spec)
+    return check is None or check(payload)
@@ -0,0 +1,119 @@
+from . import db
+from .redis_client import get_redis
+from .tasks import celery
+from .outbox import OUTBOX_ENABLED, OUTBOX_MAX_AGE, oldest_age
+from kombu import Connection
+from flask import current_app
+from sqlalchemy import text
+import os
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+READINESS_INTERVAL = float(os.getenv('READINESS_INTERVAL', '2'))  # seconds between background checks
+HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', '1'))  # seconds per dependency
+# A result older than this means the checker itself is stuck (e.g. a hung connection)
+READINESS_MAX_AGE = READINESS_INTERVAL * 3 + HEALTH_CHECK_TIMEOUT * 3
+
+
+def check_database():
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            # LOCAL so the timeout does not stick to the pooled connection
+            conn.exec_driver_sql(f'SET LOCAL statement_timeout = {int(HEALTH_CHECK_TIMEOUT * 1000)}')
+        conn.execute(text('SELECT 1'))
+
+
+def check_redis():
+    get_redis().ping()
+
+
+def check_broker():
+    with Connection(celery.conf.broker_url, connect_timeout=HEALTH_CHECK_TIMEOUT) as conn:
+        conn.ensure_connection(max_retries=1, timeout=HEALTH_CHECK_TIMEOUT)
+
+
+def check_outbox():
+    try:
+        age = oldest_age()
+    finally:
+        db.session.remove()
+    if age > OUTBOX_MAX_AGE:
+        raise RuntimeError(f'Oldest outbox row has waited {age:.0f}s; is the relay running?')
+
+
+CHECKS = {
+    'database': check_database,
+    'redis': check_redis,
+    'broker': check_broker,
+}
+if OUTBOX_ENABLED:
+    CHECKS['outbox'] = check_outbox
+
+
+class ReadinessProbe:
+    """
+    Runs the dependency checks on a background thread every READINESS_INTERVAL
+    seconds and keeps the latest result, so a readiness request only reads memory.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.result = None
+        self.checked_at = None
+        self.first_result = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='readiness-probe', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(READINESS_INTERVAL)
+
+    def refresh(self):
+        results = {}
+        with self.app.app_context():
+            for name, check in CHECKS.items():
+                started = time.perf_counter()
+                try:
+                    check()
+                    results[name] = {'ok': True}
+                except Exception as e:
+                    logger.warning('Readiness check %s failed: %s', name, e)
+                    results[name] = {'ok': False, 'error': str(e)[:200]}
+                results[name]['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        self.result = results
+        self.checked_at = time.time()
+        self.first_result.set()
+
+    def status(self):
+        """(ready, body) from the last completed round of checks."""
+        # Only the first request after startup waits, and never longer than one round of checks
+        self.first_result.wait(HEALTH_CHECK_TIMEOUT * len(CHECKS))
+        if self.result is None:
+            return False, {'status': 'starting', 'checks': {}}
+        age = time.time() - self.checked_at
+        ready = age <= READINESS_MAX_AGE and all(check['ok'] for check in self.result.values())
+        return ready, {
+            'status': 'ready' if ready else 'not_ready',
+            'checks': self.result,
+            'age_seconds': round(age, 3),
+        }
+
+
+_probe = None
+_probe_pid = None
+_probe_lock = threading.Lock()
+
+
+def get_probe():
+    """The probe for this process, restarted after a fork."""
+    global _probe, _probe_pid
+    if _probe is None or _probe_pid != os.getpid():
+        with _probe_lock:
+            if _probe is None or _probe_pid != os.getpid():
+                _probe = ReadinessProbe(current_app._get_current_object())
+                _probe_pid = os.getpid()
+    return _probe
@@ -0,0 +1,51 @@
+"""
+Log-linear latency buckets in the style of HDR histograms.
+
+Values below 2**SUB_BUCKET_BITS milliseconds get one bucket each; above that every
+power of two is split into 2**SUB_BUCKET_BITS equal buckets, so any recorded value
+is reported within ~6% of its true value while the number of buckets grows only
+logarithmically (latencies up to an hour fit in about 300 buckets).
+"""
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+def bucket_index(value_ms):
+    value = max(int(value_ms), 0)
+    if value < SUB_BUCKETS:
+        return value
+    magnitude = value.bit_length() - SUB_BUCKET_BITS - 1
+    return (magnitude + 1) * SUB_BUCKETS + (value >> magnitude) - SUB_BUCKETS
+
+
+def bucket_upper_bound(index):
+    """Highest value (ms) that lands in bucket `index`."""
+    if index < SUB_BUCKETS:
+        return index
+    magnitude = index // SUB_BUCKETS - 1
+    sub_bucket = index % SUB_BUCKETS
+    return ((SUB_BUCKETS + sub_bucket + 1) << magnitude) - 1
+
+
+def percentiles(counts, quantiles=(50, 90, 95, 99)):
+    """
+    Percentiles from a {bucket_index: count} mapping, reported as each
+    bucket's upper bound in milliseconds.
+    """
+    total = sum(counts.values())
+    if not total:
+        return {'count': 0}
+
+    ordered = sorted(counts.items())
+    result = {'count': total}
+    for q in quantiles:
+        target = total * q / 100.0
+        running = 0
+        for index, count in ordered:
+            running += count
+            if running >= target:
+                result[f'p{q}'] = bucket_upper_bound(index)
+                break
+    result['max'] = bucket_upper_bound(ordered[-1][0])
+    return result
@@ -0,0 +1,115 @@
+"""
+Ingest deduplication.
+
+A producer that retries an ingest request sends the same `Idempotency-Key`
+header (or, with INGEST_DEDUP_PAYLOAD_HASH=1, simply the same body). Once the
+request is authenticated (its subscription found and its signature verified),
+the first one reserves the key in Redis with SET NX, before the webhook is
+stored. Once the webhook has been stored and queued, the reservation is
+replaced by the webhook id for INGEST_IDEMPOTENCY_TTL seconds. Retries inside
+that window are answered from Redis with the original webhook id, without
+writing to Postgres.
+
+Stored entries also keep the body hash and the signature header:
+ - a key reused with a different body is rejected;
+ - a retry is only recognised if it carries the same signature, which for signed
+   subscriptions means whoever sends it already holds a valid signature for that
+   exact body.
+If Redis is unavailable, requests are ingested normally without deduplication.
+"""
+from .redis_client import get_redis
+import os
+import json
+import uuid
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+INGEST_IDEMPOTENCY_TTL = int(os.getenv('INGEST_IDEMPOTENCY_TTL', '86400'))  # seconds a key is remembered
+INGEST_IDEMPOTENCY_PENDING_TTL = int(os.getenv('INGEST_IDEMPOTENCY_PENDING_TTL', '30'))  # seconds a reservation lives
+INGEST_DEDUP_PAYLOAD_HASH = os.getenv('INGEST_DEDUP_PAYLOAD_HASH', '0') == '1'
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+IDEMPOTENCY_PREFIX = 'idempotency:'
+
+# Deletes the reservation only if it is still ours
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class Reservation:
+    """
+    Outcome of checking a request against the dedup window:
+      new         - this request owns the key; call complete() once the webhook is queued
+      skip        - no key, or Redis unavailable; ingest normally
+      duplicate   - already ingested as `webhook_id`
+      in_progress - a request with the same key is still being ingested
+      mismatch    - the key was used before with a different body
+    """
+    __slots__ = ('outcome', 'key', 'value', 'webhook_id')
+
+    def __init__(self, outcome, key=None, value=None, webhook_id=None):
+        self.outcome = outcome
+        self.key = key
+        self.value = value
+        self.webhook_id = webhook_id
+
+    def complete(self, webhook_id):
+        if self.outcome != 'new':
+            return
+        entry = dict(json.loads(self.value), state='done', webhook_id=webhook_id)
+        del entry['token']
+        try:
+            get_redis().set(self.key, json.dumps(entry), ex=INGEST_IDEMPOTENCY_TTL)
+        except Exception as e:
+            logger.warning('Could not record idempotency key for webhook %s: %s', webhook_id, e)
+        self.outcome = 'completed'
+
+    def release(self):
+        """Give the key back, e.g. because the request failed; a retry may then try again."""
+        if self.outcome != 'new':
+            return
+        try:
+            get_redis().eval(_RELEASE, 1, self.key, self.value)
+        except Exception as e:
+            logger.warning('Could not release idempotency key: %s', e)
+        self.outcome = 'released'
+
+
+def reserve(sub_id, idempotency_key, body, signature=None):
+    """Check a request against the subscription's dedup window and reserve its key if it is new."""
+    body_hash = hashlib.sha256(body).hexdigest()
+    if idempotency_key:
+        key = f'{IDEMPOTENCY_PREFIX}{sub_id}:key:{idempotency_key[:MAX_IDEMPOTENCY_KEY_LENGTH]}'
+    elif INGEST_DEDUP_PAYLOAD_HASH:
+        key = f'{IDEMPOTENCY_PREFIX}{sub_id}:sha256:{body_hash}'
+    else:
+        return Reservation('skip')
+
+    value = json.dumps({'state': 'pending', 'hash': body_hash, 'signature': signature, 'token': uuid.uuid4().hex})
+    try:
+        client = get_redis()
+        if client.set(key, value, nx=True, ex=INGEST_IDEMPOTENCY_PENDING_TTL):
+            return Reservation('new', key, value)
+        existing = client.get(key)
+    except Exception as e:
+        logger.warning('Idempotency check skipped for subscription %s: %s', sub_id, e)
+        return Reservation('skip')
+
+    if existing is None:
+        # Expired between SET and GET; not worth a second round trip
+        return Reservation('skip')
+    existing = json.loads(existing)
+    if existing['hash'] != body_hash:
+        return Reservation('mismatch')
+    if existing['signature'] != signature:
+        # Not provably the same sender; let signature verification decide
+        return Reservation('skip')
+    if existing['state'] == 'pending':
+        return Reservation('in_progress')
+    return Reservation('duplicate', webhook_id=existing['webhook_id'])
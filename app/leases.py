@@ -0,0 +1,198 @@
+"""
+Per-webhook delivery leases.
+
+A message can reach two workers at once (a Redis visibility timeout expiring
+under a slow delivery, an ETA retry redelivered after a worker restart). Before
+delivering, a task takes a short lease on its webhook. A copy that finds the
+lease held, or finds the webhook already delivered, skips without touching
+Postgres or the subscriber.
+
+Acquiring is one Lua script, so one round trip: it checks the delivered guard
+and does SET NX PX on the lease. Releasing is another: it deletes the lease only
+if this task still holds it and, after a successful delivery, sets the
+delivered guard for DELIVERY_DELIVERED_TTL seconds. If Redis is unavailable the
+task delivers anyway; at-least-once delivery is kept over exactly-once.
+
+A copy can only arrive while the broker may still hand the message out again:
+its visibility timeout plus the longest retry delay (app.queues), which is the
+guard's default TTL. Each guard costs roughly 150 bytes of Redis memory, so the
+guards take about that times the webhooks delivered in one TTL. A copy arriving
+after its guard expired is still skipped: the task falls back to the webhook's
+status row (app.rows.load_delivery) before calling the subscriber.
+
+The requests timeout bounds each connect and read, not the whole call, so a
+slow subscriber can hold a delivery past any fixed TTL. While a lease is held,
+a per-process keeper thread renews it every DELIVERY_LEASE_RENEW_INTERVAL
+seconds, with one script call for all of the process's leases. A lease only
+lapses once its worker stops renewing it: the process died, or Redis was
+unreachable for a whole TTL.
+"""
+from .redis_client import get_redis
+from .metrics import DELIVERY_LEASES, DELIVERY_LEASE_LATENCY
+from .queues import BROKER_VISIBILITY_TIMEOUT, RETRY_DELAYS
+import os
+import time
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_LEASES_ENABLED = os.getenv('DELIVERY_LEASES', '1') == '1'
+DELIVERED_TTL = int(os.getenv(
+    'DELIVERY_DELIVERED_TTL', str(BROKER_VISIBILITY_TIMEOUT + max(RETRY_DELAYS))
+))  # seconds a delivered webhook is refused
+LEASE_RENEW_INTERVAL = float(os.getenv('DELIVERY_LEASE_RENEW_INTERVAL', '5'))  # seconds; well under the lease TTL
+
+LEASE_PREFIX = 'lease:'
+DELIVERED_PREFIX = 'delivered:'
+
+_ACQUIRE = """
+if redis.call('exists', KEYS[2]) == 1 then
+    return 'delivered'
+end
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 'acquired'
+end
+return 'held'
+"""
+
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+end
+if ARGV[2] ~= '0' then
+    redis.call('set', KEYS[2], '1', 'EX', ARGV[2])
+end
+return 1
+"""
+
+# KEYS lease keys; ARGV token and TTL (ms) for each key in turn. Returns how many were still held.
+_RENEW = """
+local renewed = 0
+for i, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[2 * i - 1] then
+        redis.call('pexpire', key, ARGV[2 * i])
+        renewed = renewed + 1
+    end
+end
+return renewed
+"""
+
+_scripts = {'client': None}
+
+
+def scripts():
+    """The registered scripts for the current client; redis-py runs them with EVALSHA."""
+    client = get_redis()
+    if _scripts['client'] is not client:
+        _scripts.update(client=client, acquire=client.register_script(_ACQUIRE), release=client.register_script(_RELEASE),
+                        renew=client.register_script(_RENEW))
+    return _scripts
+
+
+class Lease:
+    """
+    outcome is one of:
+      acquired    - this task may deliver; call release() when done
+      held        - another task is delivering this webhook right now
+      delivered   - the webhook was already delivered
+      unavailable - leases are disabled or Redis could not be reached; deliver anyway
+    """
+    __slots__ = ('webhook_id', 'token', 'outcome', 'ttl_ms')
+
+    def __init__(self, webhook_id, token, outcome, ttl_ms=0):
+        self.webhook_id = webhook_id
+        self.token = token
+        self.outcome = outcome
+        self.ttl_ms = ttl_ms
+
+    def release(self, delivered=False):
+        if self.outcome != 'acquired':
+            return
+        get_keeper().discard(self)
+        try:
+            scripts()['release'](
+                keys=[LEASE_PREFIX + self.webhook_id, DELIVERED_PREFIX + self.webhook_id],
+                args=[self.token, DELIVERED_TTL if delivered else 0],
+            )
+        except Exception as e:
+            logger.warning('Could not release delivery lease for webhook %s: %s', self.webhook_id, e)
+        self.outcome = 'released'
+
+
+class LeaseKeeper:
+    """Renews the leases this process holds until they are released."""
+
+    def __init__(self):
+        self.leases = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+        self.thread.start()
+
+    def add(self, lease):
+        with self.lock:
+            self.leases.add(lease)
+
+    def discard(self, lease):
+        with self.lock:
+            self.leases.discard(lease)
+
+    def _run(self):
+        while True:
+            time.sleep(LEASE_RENEW_INTERVAL)
+            with self.lock:
+                held = list(self.leases)
+            if held:
+                self.renew(held)
+
+    def renew(self, leases):
+        args = []
+        for lease in leases:
+            args += [lease.token, lease.ttl_ms]
+        try:
+            renewed = scripts()['renew'](keys=[LEASE_PREFIX + lease.webhook_id for lease in leases], args=args)
+        except Exception as e:
+            logger.warning('Could not renew %s delivery leases: %s', len(leases), e)
+            return
+        if renewed < len(leases):
+            logger.warning('%s of %s delivery leases had expired before renewal', len(leases) - renewed, len(leases))
+
+
+_keeper = None
+_keeper_pid = None
+_keeper_lock = threading.Lock()
+
+
+def get_keeper():
+    """The keeper for this process, started again after a fork (prefork children do not inherit threads)."""
+    global _keeper, _keeper_pid
+    if _keeper is None or _keeper_pid != os.getpid():
+        with _keeper_lock:
+            if _keeper is None or _keeper_pid != os.getpid():
+                _keeper = LeaseKeeper()
+                _keeper_pid = os.getpid()
+    return _keeper
+
+
+def acquire_lease(webhook_id, ttl_seconds):
+    """Try to take the delivery lease for a webhook for up to ttl_seconds."""
+    if not DELIVERY_LEASES_ENABLED:
+        return Lease(webhook_id, None, 'unavailable')
+    token = uuid.uuid4().hex
+    ttl_ms = int(ttl_seconds * 1000)
+    try:
+        with DELIVERY_LEASE_LATENCY.time():
+            outcome = scripts()['acquire'](
+                keys=[LEASE_PREFIX + webhook_id, DELIVERED_PREFIX + webhook_id],
+                args=[token, ttl_ms],
+            )
+        outcome = outcome.decode() if isinstance(outcome, bytes) else outcome
+    except Exception as e:
+        logger.warning('Could not acquire delivery lease for webhook %s: %s', webhook_id, e)
+        outcome = 'unavailable'
+    DELIVERY_LEASES.labels(outcome).inc()
+    lease = Lease(webhook_id, token, outcome, ttl_ms)
+    if outcome == 'acquired':
+        get_keeper().add(lease)
+    return lease
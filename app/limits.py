@@ -0,0 +1,74 @@
+"""
+Request body size limits for ingest.
+
+MAX_CONTENT_LENGTH (app config, from the environment) caps every request
+body. A subscription can lower it for its own ingest with `max_body_bytes`.
+Ingest applies the effective limit before the body is read:
+
+ - a declared Content-Length above the limit is refused without reading;
+ - a chunked body is read at most one byte past the limit, and refused with
+   413 if it got that far.
+
+Ingest must know a subscription's limit before anything else touches the
+database (duplicates are answered from Redis alone), so limits are cached per
+process for SUBSCRIPTION_LIMITS_TTL seconds.
+"""
+from . import db
+from .models import Subscription
+from flask import current_app
+from sqlalchemy import select
+import os
+import time
+
+DEFAULT_MAX_CONTENT_LENGTH = 1024 * 1024
+SUBSCRIPTION_LIMITS_TTL = float(os.getenv('SUBSCRIPTION_LIMITS_TTL', '30'))  # seconds
+MAX_CACHED_LIMITS = 100000
+
+_limits = {}  # sub_id -> (max_body_bytes, expires_at)
+
+
+def max_content_length():
+    return current_app.config.get('MAX_CONTENT_LENGTH') or DEFAULT_MAX_CONTENT_LENGTH
+
+
+def subscription_body_limit(sub_id):
+    """The subscription's own max_body_bytes, or None (no limit of its own, or no such subscription)."""
+    now = time.monotonic()
+    cached = _limits.get(sub_id)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    try:
+        limit = db.session.execute(
+            select(Subscription.max_body_bytes).where(Subscription.id == int(sub_id))
+        ).scalar_one_or_none()
+    except ValueError:
+        return None
+    if len(_limits) >= MAX_CACHED_LIMITS:
+        _limits.clear()
+    _limits[sub_id] = (limit, now + SUBSCRIPTION_LIMITS_TTL)
+    return limit
+
+
+def body_limit(sub_id=None):
+    """Bytes an ingest request for `sub_id` (or an event, without one) may send."""
+    limit = max_content_length()
+    if sub_id is not None:
+        own = subscription_body_limit(str(sub_id))
+        if own:
+            limit = min(limit, own)
+    return limit
+
+
+def forget_body_limit(sub_id):
+    """Drop this process's cached limit after the subscription changed."""
+    _limits.pop(str(sub_id), None)
+
+
+def validate_body_limit(value):
+    """max_body_bytes as given if valid (None clears it); raises ValueError otherwise."""
+    if value is None:
+        return None
+    limit = max_content_length()
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 < value <= limit:
+        raise ValueError(f'max_body_bytes must be an integer between 1 and {limit}')
+    return value
@@ -0,0 +1,196 @@
+"""
+Process-wide logging configuration.
+
+Handlers never run on the request or task thread: records go through a bounded
+in-memory queue to a listener thread that formats and writes them. As with the
+stdlib QueueHandler, the caller merges the message arguments into the message
+before enqueueing, so the queued record holds only text and never objects the
+caller may still change. That happens only for records that pass the level
+check and LOG_SAMPLE_RATE sampling (INFO and below). Messages are cut to
+LOG_MAX_MESSAGE_CHARS, and payloads should be wrapped in capped() so huge
+bodies are truncated before they are turned into text.
+"""
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from .metrics import LOG_RECORDS, LOG_BYTES, LOG_DROPPED, LOG_SAMPLED_OUT
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text or json
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))  # fraction of INFO/DEBUG records kept
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_MAX_PAYLOAD_CHARS = int(os.getenv('LOG_MAX_PAYLOAD_CHARS', '512'))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv('LOG_MAX_MESSAGE_CHARS', '8192'))
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_exception_formatter = logging.Formatter()
+_payload_encoder = json.JSONEncoder(default=str)
+
+
+class capped:
+    """
+    Wraps a value for logging. It is only converted to text when the record is
+    kept, and the text is cut to LOG_MAX_PAYLOAD_CHARS. Other values than text
+    are encoded as JSON only up to the limit, so a large body costs the caller
+    no more than a small one.
+    """
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit or LOG_MAX_PAYLOAD_CHARS
+
+    def __str__(self):
+        if isinstance(self.value, (bytes, bytearray)):
+            text = self.value[:self.limit].decode('utf-8', 'replace')
+            size = len(self.value)
+        elif isinstance(self.value, str):
+            text = self.value
+            size = len(text)
+        else:
+            chunks = []
+            size = 0
+            for chunk in _payload_encoder.iterencode(self.value):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > self.limit:
+                    return f"{''.join(chunks)[:self.limit]}... (truncated)"
+            text = ''.join(chunks)
+        if size > self.limit:
+            return f'{text[:self.limit]}... ({size} chars)'
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps every WARNING and above, and a LOG_SAMPLE_RATE fraction of the rest."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        if random.random() < self.rate:
+            return True
+        LOG_SAMPLED_OUT.inc()
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues a copy of each record with its message merged and capped, and
+    drops it (counting the drop) instead of blocking when the listener cannot
+    keep up.
+    """
+
+    def prepare(self, record):
+        message = record.getMessage()
+        if len(message) > LOG_MAX_MESSAGE_CHARS:
+            message = f'{message[:LOG_MAX_MESSAGE_CHARS]}... ({len(message)} chars)'
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        # The listener's formatter finds the traceback in exc_text
+        record.message = record.msg = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class CountingStreamHandler(logging.StreamHandler):
+    def emit(self, record):
+        # StreamHandler.emit, keeping the formatted line to count it
+        try:
+            line = self.format(record) + self.terminator
+            self.stream.write(line)
+            self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+            return
+        LOG_RECORDS.labels(record.levelname).inc()
+        LOG_BYTES.inc(len(line))
+
+
+_listener = None
+_lock = threading.Lock()
+
+
+def _start_listener(queue_handler, handler):
+    global _listener
+    # A fresh queue each time: after a fork the inherited one may have been locked by the parent's listener
+    queue_handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def configure_logging():
+    """
+    Install the queued handler on the root logger. Safe to call more than once;
+    only the first call in a process has an effect.
+    """
+    with _lock:
+        if _listener is not None:
+            return
+
+        handler = CountingStreamHandler(sys.stderr)
+        if LOG_FORMAT == 'json':
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+        queue_handler = NonBlockingQueueHandler(None)
+        queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(queue_handler)
+        root.setLevel(LOG_LEVEL)
+
+        _start_listener(queue_handler, handler)
+
+        # Forked children (prefork workers) inherit the handler but not the listener thread
+        os.register_at_fork(after_in_child=lambda: _start_listener(queue_handler, handler))
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records; used at shutdown."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
@@ -3,10 +3,10 @@ from . import db
 from sqlalchemy import inspect
 from sqlalchemy.exc import SQLAlchemyError
 import logging
-from .models import DeliveryAttempt
+from .rows import delivery_log_rows
+from .serialization import json_response
+from .attempts import get_in_flight, INFLIGHT_MARKERS
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Create a blueprint for the logs route
@@ -19,18 +19,30 @@ def get_delivery_logs():
     """
     try:
         logger.info('Fetching all delivery logs')
-        # Assuming you have a DeliveryLog model 
-        # order by timestamp
-        delivery_logs = db.session.query(DeliveryAttempt).order_by(DeliveryAttempt.timestamp.desc()).all()
-        if not delivery_logs:
+        # Newest first, built from the columns without loading ORM objects (app.rows)
+        log_list = delivery_log_rows()
+        if not log_list:
             logger.warning('No delivery logs found')
             return jsonify({'message': 'No delivery logs found'}), 404
         
-        logger.info(f'Found {len(delivery_logs)} delivery logs')
-        log_list = [log.to_dict() for log in delivery_logs]
-        logger.info(f'Delivery log list: {log_list}')
-        return jsonify({'delivery_logs': log_list}), 200
+        logger.info('Found %s delivery logs', len(log_list))
+        return json_response({'delivery_logs': log_list})
     except SQLAlchemyError as e:
         db.session.rollback()
-        logger.error(f'Error fetching delivery logs: {str(e)}')
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        logger.error('Error fetching delivery logs: %s', e)
+        return jsonify({'error': str(e)}), 500
+
+
+@logs_bp.route('/logs/inflight', methods=['GET'])
+def get_in_flight_attempts():
+    """
+    List delivery attempts that are currently running, from the Redis in-flight markers.
+    """
+    if not INFLIGHT_MARKERS:
+        return jsonify({'error': 'In-flight markers are disabled (set DELIVERY_INFLIGHT_MARKERS=1)'}), 404
+    try:
+        in_flight = get_in_flight()
+        return jsonify({'in_flight': in_flight, 'count': len(in_flight)}), 200
+    except Exception as e:
+        logger.error('Error fetching in-flight attempts: %s', e)
+        return jsonify({'error': str(e)}), 503
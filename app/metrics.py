@@ -0,0 +1,200 @@
+"""
+Prometheus metrics for the ingest and delivery hot paths.
+
+Metric updates are plain in-memory increments. When PROMETHEUS_MULTIPROC_DIR is
+set (prefork Celery workers, multi-process web servers) prometheus_client keeps
+each process's values in its own mmap'd file and the exposition endpoints merge
+them at scrape time, so no process ever waits on another.
+"""
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+from .redis_client import get_redis
+from .queues import DELIVERY_QUEUE, RETRY_QUEUE, REPLAY_QUEUE, DEFAULT_QUEUE, queue_keys
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# Broker queues whose depth is reported at scrape time
+BROKER_QUEUES = [
+    queue for queue in os.getenv(
+        'METRICS_BROKER_QUEUES', ','.join((DELIVERY_QUEUE, RETRY_QUEUE, REPLAY_QUEUE, DEFAULT_QUEUE))
+    ).split(',') if queue
+]
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+INGEST_REQUESTS = Counter(
+    'wds_ingest_requests_total', 'Ingest requests by endpoint and HTTP status', ['endpoint', 'status']
+)
+INGEST_LATENCY = Histogram(
+    'wds_ingest_request_seconds', 'Ingest request latency', ['endpoint'], buckets=LATENCY_BUCKETS
+)
+SIGNATURE_FAILURES = Counter(
+    'wds_signature_failures_total', 'Ingest requests rejected by signature verification', ['reason']
+)
+INGEST_REJECTED = Counter(
+    'wds_ingest_rejected_total', 'Ingest requests refused by admission control', ['reason']
+)
+INGEST_REJECTED_BYTES = Counter(
+    'wds_ingest_rejected_bytes_total', 'Body bytes of ingest requests refused as too large', ['stage']
+)
+RATE_LIMIT_SYNCS = Counter(
+    'wds_rate_limit_syncs_total', 'Token blocks leased from the shared Redis buckets', ['limiter', 'result']
+)
+INGEST_DEDUPLICATED = Counter(
+    'wds_ingest_deduplicated_total', 'Ingest requests answered from the dedup window instead of being ingested', ['outcome']
+)
+DB_COMMIT_LATENCY = Histogram(
+    'wds_db_commit_seconds', 'Database commit latency by call site', ['site'], buckets=LATENCY_BUCKETS
+)
+ATTEMPT_ROWS_LOST = Counter(
+    'wds_attempt_rows_lost_total', 'Delivery attempt rows the batched writer could not write, even on their own'
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'wds_db_pool_checkout_seconds', 'Time to get a connection from the pool, including opening one',
+    ['profile'], buckets=LATENCY_BUCKETS
+)
+DB_POOL_TIMEOUTS = Counter(
+    'wds_db_pool_timeouts_total', 'Checkouts that gave up after the pool timeout', ['profile']
+)
+CELERY_PUBLISH_LATENCY = Histogram(
+    'wds_celery_publish_seconds', 'Time to publish a task to the broker', ['task'], buckets=LATENCY_BUCKETS
+)
+INGEST_FILTERED = Counter(
+    'wds_ingest_filtered_total', 'Deliveries dropped at ingest by subscription filters', ['source']
+)
+EVENT_BACKLOG_SKIPPED = Counter(
+    'wds_event_backlog_skipped_total', 'Event deliveries not created because the subscription was over its backlog'
+)
+EVENT_FANOUT = Histogram(
+    'wds_event_fanout', 'Deliveries created per event published to a topic',
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+)
+OUTBOX_RELAYED = Counter(
+    'wds_outbox_relayed_total', 'Outbox rows published to the broker by the relay'
+)
+OUTBOX_RELAY_LATENCY = Histogram(
+    'wds_outbox_relay_batch_seconds', 'Time to claim, publish and delete one outbox batch', buckets=LATENCY_BUCKETS
+)
+OUTBOX_LAG = Histogram(
+    'wds_outbox_lag_seconds', 'Time from ingest commit to broker publish', buckets=LATENCY_BUCKETS
+)
+DELIVERY_ATTEMPTS = Counter(
+    'wds_delivery_attempts_total', 'Delivery attempts by outcome', ['outcome']
+)
+DELIVERY_HTTP_LATENCY = Histogram(
+    'wds_delivery_http_seconds', 'HTTP latency of deliveries to subscribers', buckets=LATENCY_BUCKETS
+)
+DELIVERY_LEASES = Counter(
+    'wds_delivery_leases_total', 'Delivery lease requests by outcome', ['outcome']
+)
+DELIVERY_LEASE_LATENCY = Histogram(
+    'wds_delivery_lease_seconds', 'Round trip to acquire a delivery lease', buckets=LATENCY_BUCKETS
+)
+RETENTION_PURGED = Counter(
+    'wds_retention_purged_total', 'Rows deleted by retention', ['kind']
+)
+LOG_RECORDS = Counter(
+    'wds_log_records_total', 'Log records written, by level', ['level']
+)
+LOG_BYTES = Counter(
+    'wds_log_message_bytes_total', 'Characters of log lines written'
+)
+LOG_DROPPED = Counter(
+    'wds_log_dropped_total', 'Log records dropped because the log queue was full'
+)
+LOG_SAMPLED_OUT = Counter(
+    'wds_log_sampled_out_total', 'INFO/DEBUG log records skipped by sampling'
+)
+TRACE_SPANS_DROPPED = Counter(
+    'wds_trace_spans_dropped_total', 'Finished spans dropped because the export queue was full or the export failed'
+)
+
+
+class BrokerCollector:
+    """
+    Queue depths read from Redis when scraped (cached briefly so frequent scrapes
+    stay cheap). Each delivery lane is its own queue (app.queues); the retry
+    depth is the length of the retries lane across its priority lists. Messages
+    workers have fetched but not acknowledged, including ETA retries waiting to
+    run, sit in the Redis transport's unacked set instead and are reported
+    separately.
+    """
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self.sampled_at = 0
+        self.sample = None
+
+    def collect(self):
+        if self.sample is None or time.monotonic() - self.sampled_at > self.ttl:
+            try:
+                client = get_redis()
+                pipe = client.pipeline(transaction=False)
+                queues = list(dict.fromkeys(BROKER_QUEUES + [RETRY_QUEUE]))
+                for queue in queues:
+                    for key in queue_keys(queue):
+                        pipe.llen(key)
+                pipe.zcard('unacked_index')
+                *lengths, unacked = pipe.execute()
+                # One list per priority step; a queue's depth is their sum
+                lengths = iter(lengths)
+                depths = {queue: sum(next(lengths) for _ in queue_keys(queue)) for queue in queues}
+                self.sample = (depths, unacked)
+                self.sampled_at = time.monotonic()
+            except Exception as e:
+                logger.warning('Could not sample broker queue depth: %s', e)
+                return
+
+        depths, unacked = self.sample
+        queue_depth = GaugeMetricFamily('wds_broker_queue_depth', 'Messages waiting in each broker queue', labels=['queue'])
+        for queue in BROKER_QUEUES:
+            queue_depth.add_metric([queue], depths[queue])
+        yield queue_depth
+        yield GaugeMetricFamily(
+            'wds_retry_queue_depth', 'Messages waiting in the retries lane, all priorities', value=depths[RETRY_QUEUE]
+        )
+        yield GaugeMetricFamily(
+            'wds_broker_unacked_messages', 'Messages fetched by workers and not yet acknowledged, including ETA retries',
+            value=unacked
+        )
+
+
+# Kept out of the process registries so it is never written to the multiprocess files
+broker_registry = CollectorRegistry()
+broker_registry.register(BrokerCollector())
+
+
+def exposition_registry():
+    """
+    Registry to serve: merged per-process files in multiprocess mode, otherwise
+    this process's default registry.
+    """
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render(include_broker=True):
+    """
+    Current metrics in the Prometheus text format, as (body, content type).
+    """
+    body = generate_latest(exposition_registry())
+    if include_broker:
+        body += generate_latest(broker_registry)
+    return body, CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
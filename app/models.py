@@ -17,6 +17,9 @@ class Subscription(db.Model):
     secret = Column(String(128), nullable=True)  # For HMAC verification
     secret_hash = Column(String(128), nullable=True)  # For secure storage
     salt = Column(String(64), nullable=True)  # Random salt for each subscription
+    topics = Column(db.JSON(none_as_null=True), nullable=True)  # Event topics delivered via POST /events/<topic>
+    filter = Column(db.JSON, nullable=True)  # Payload filter (app.filters); non-matching payloads are dropped at ingest
+    max_body_bytes = Column(Integer, nullable=True)  # Ingest body limit below MAX_CONTENT_LENGTH (app.limits)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     @staticmethod
@@ -77,6 +80,9 @@ class Subscription(db.Model):
             'url': self.url,
             'secret_hash': self.secret_hash,
             'salt': self.salt,
+            'topics': self.topics or [],
+            'filter': self.filter,
+            'max_body_bytes': self.max_body_bytes,
             'created_at': self.created_at.isoformat() if self.created_at else None
             
         }
@@ -85,16 +91,68 @@ class Subscription(db.Model):
 
 
 
+class PayloadBlob(db.Model):
+    __tablename__ = 'payload_blobs'
+    
+    # Payload bodies keyed by the SHA-256 of their canonical JSON (app.payloads).
+    # Kept while webhooks or events reference them; last_seen_at is refreshed by
+    # ingest about once per PAYLOAD_TOUCH_INTERVAL.
+    hash = Column(String(64), primary_key=True)
+    body = Column(db.JSON, nullable=False)
+    size = Column(Integer, nullable=False)  # bytes of canonical JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_seen_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<PayloadBlob {self.hash}>'
+
+
+class Event(db.Model):
+    __tablename__ = 'events'
+    
+    # A payload published to a topic; its blob is shared by the webhooks it fans out to
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    topic = Column(String(255), nullable=False, index=True)
+    payload_hash = Column(String(64), ForeignKey('payload_blobs.hash'), nullable=False, index=True)
+    received_at = Column(DateTime, default=datetime.utcnow)
+    
+    blob = db.relationship(PayloadBlob)
+    
+    @property
+    def body(self):
+        return self.blob.body
+    
+    def __repr__(self):
+        return f'<Event {self.id} {self.topic}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'topic': self.topic,
+            'payload': self.body,
+            'payload_hash': self.payload_hash,
+            'received_at': self.received_at
+        }
+
+
 class WebhookPayload(db.Model):
     __tablename__ = 'webhook_payloads'
     
     id = Column(String(36), primary_key=True, default =  lambda: str(uuid.uuid4()))  # UUID as string
     subscription_id = Column(Integer, ForeignKey('subscriptions.id'), nullable=False)
-    payload = Column(db.JSON, nullable=False)
+    payload_hash = Column(String(64), ForeignKey('payload_blobs.hash'), nullable=False, index=True)
+    event_id = Column(String(36), ForeignKey('events.id'), nullable=True, index=True)
     received_at = Column(DateTime, default=datetime.utcnow)  # Unix timestamp
     
     # Relationships
     subscription = db.relationship(Subscription, backref='webhook_payloads')
+    event = db.relationship(Event)
+    blob = db.relationship(PayloadBlob)
+    
+    @property
+    def body(self):
+        """The payload to deliver."""
+        return self.blob.body
     
     def __repr__(self):
         return f'<WebhookPayload {self.id}>'
@@ -103,7 +161,9 @@ class WebhookPayload(db.Model):
         return {
             'id': self.id,
             'subscription_id': self.subscription_id,
-            'payload': self.payload,
+            'payload': self.body,
+            'payload_hash': self.payload_hash,
+            'event_id': self.event_id,
             'received_at': self.received_at
         }
 
@@ -142,6 +202,9 @@ class DeliveryAttempt(db.Model):
     status_code = Column(Integer, nullable=True)
     error_message = Column(String(500), nullable=True)
     response_body = Column(String(500), nullable=True)
+    duration_ms = Column(Integer, nullable=True)  # HTTP call to the subscriber
+    queue_ms = Column(Integer, nullable=True)  # Waiting in the broker since enqueue / retry ETA
+    e2e_ms = Column(Integer, nullable=True)  # From WebhookPayload.received_at to the end of this attempt
     
     # Create indexes for frequent queries
     __table_args__ = (
@@ -162,5 +225,137 @@ class DeliveryAttempt(db.Model):
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
             'status_code': self.status_code,
             'error_message': self.error_message,
-            'response_body': self.response_body
-        }
\ No newline at end of file
+            'response_body': self.response_body,
+            'duration_ms': self.duration_ms,
+            'queue_ms': self.queue_ms,
+            'e2e_ms': self.e2e_ms
+        }
+
+
+class DeadLetter(db.Model):
+    __tablename__ = 'dead_letters'
+    
+    id = Column(Integer, primary_key=True)
+    webhook_id = Column(String(36), ForeignKey('webhook_payloads.id'), nullable=False, unique=True)
+    subscription_id = Column(Integer, ForeignKey('subscriptions.id'), nullable=False)
+    attempts = Column(Integer, nullable=False)
+    reason = Column(String(500), nullable=True)
+    last_status_code = Column(Integer, nullable=True)
+    dead_at = Column(DateTime, default=datetime.utcnow)
+    replayed_at = Column(DateTime, nullable=True)  # Set when re-enqueued, cleared if it dies again
+    replay_count = Column(Integer, default=0)
+    
+    # Replay filters by subscription and time range, so index on both
+    __table_args__ = (
+        db.Index('idx_dead_letter_subscription_dead_at', subscription_id, dead_at),
+        db.Index('idx_dead_letter_dead_at', dead_at),
+    )
+    
+    def __repr__(self):
+        return f'<DeadLetter {self.id} for webhook {self.webhook_id}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'webhook_id': self.webhook_id,
+            'subscription_id': self.subscription_id,
+            'attempts': self.attempts,
+            'reason': self.reason,
+            'last_status_code': self.last_status_code,
+            'dead_at': self.dead_at.isoformat() if self.dead_at else None,
+            'replayed_at': self.replayed_at.isoformat() if self.replayed_at else None,
+            'replay_count': self.replay_count
+        }
+
+
+class WebhookStatus(db.Model):
+    __tablename__ = 'webhook_status'
+    
+    # One row per webhook, kept current on every attempt so status reads are a primary key lookup
+    webhook_id = Column(String(36), ForeignKey('webhook_payloads.id'), primary_key=True)
+    subscription_id = Column(Integer, ForeignKey('subscriptions.id'), nullable=False)
+    state = Column(String(20), nullable=False, default='pending')  # pending, retrying, delivered, dead
+    attempt_count = Column(Integer, nullable=False, default=0)
+    last_status_code = Column(Integer, nullable=True)
+    last_attempt_at = Column(DateTime, nullable=True)
+    next_retry_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    webhook = db.relationship(WebhookPayload, backref=db.backref('delivery_status', uselist=False))
+    
+    def __repr__(self):
+        return f'<WebhookStatus {self.webhook_id} {self.state}>'
+    
+    def to_dict(self):
+        return {
+            'webhook_id': self.webhook_id,
+            'subscription_id': self.subscription_id,
+            'state': self.state,
+            'attempt_count': self.attempt_count,
+            'last_status_code': self.last_status_code,
+            'last_attempt_at': self.last_attempt_at.isoformat() if self.last_attempt_at else None,
+            'next_retry_at': self.next_retry_at.isoformat() if self.next_retry_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+
+class OutboxMessage(db.Model):
+    __tablename__ = 'outbox'
+    
+    # Deliveries waiting to be published to the broker. Written in the ingest
+    # transaction, claimed by a relay (app.outbox) and deleted once published.
+    id = Column(db.BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    webhook_id = Column(String(36), ForeignKey('webhook_payloads.id'), nullable=False)
+    traceparent = Column(String(55), nullable=True)
+    priority = Column(db.SmallInteger, nullable=True)  # Broker priority (app.queues); null for the default
+    created_at = Column(DateTime, default=datetime.utcnow)
+    claimed_until = Column(DateTime, nullable=True)  # Set while a relay publishes the row
+    
+    # Relationships
+    webhook = db.relationship(WebhookPayload)
+    
+    def __repr__(self):
+        return f'<OutboxMessage {self.id} {self.webhook_id}>'
+
+
+class DeliveryRollup(db.Model):
+    __tablename__ = 'delivery_rollups'
+    
+    # Per-minute attempt counters, incremented as attempts are recorded
+    subscription_id = Column(Integer, ForeignKey('subscriptions.id'), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    attempt_number = Column(Integer, primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    successes = Column(Integer, nullable=False, default=0)
+    failures = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DeliveryRollup {self.subscription_id} {self.bucket_start} #{self.attempt_number}>'
+
+
+class LatencyRollup(db.Model):
+    __tablename__ = 'latency_rollups'
+    
+    # Per-minute latency histograms; `bucket` is an index from app.histogram
+    subscription_id = Column(Integer, ForeignKey('subscriptions.id'), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    metric = Column(String(16), primary_key=True)  # http, queue, e2e
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<LatencyRollup {self.subscription_id} {self.bucket_start} {self.metric}[{self.bucket}]>'
+
+
+def dialect_insert(model):
+    """
+    INSERT construct for the bound database's dialect, so callers can use
+    on_conflict_do_update() for upserts on both PostgreSQL and SQLite.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(model.__table__)
@@ -0,0 +1,160 @@
+"""
+Transactional outbox for delivery tasks.
+
+Ingest writes an `outbox` row in the same transaction as the webhook, so a
+stored webhook always has a pending publish and the request never waits on the
+broker. The relay (outbox_relay.py) claims a batch of rows with
+FOR UPDATE SKIP LOCKED, so several relays can run side by side, and marks them
+claimed for OUTBOX_CLAIM_TTL seconds in a short transaction of its own. It then
+publishes them over one broker connection, with no transaction or row lock
+open, and deletes them afterwards.
+
+If the relay dies after claiming, its claim expires and another relay
+publishes the rows again; if publishing fails, the claims are released at
+once. Delivery is at-least-once; the per-webhook lease (app.leases) drops the
+duplicate tasks. While ingest uses the outbox, /readyz fails once the oldest
+row has waited longer than OUTBOX_MAX_AGE, so a stopped relay is noticed.
+"""
+from . import db
+from .models import OutboxMessage
+from .tracing import current_traceparent
+from .metrics import OUTBOX_RELAYED, OUTBOX_RELAY_LATENCY, OUTBOX_LAG
+from sqlalchemy import select, update, delete, or_
+from datetime import datetime, timedelta
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 'outbox' publishes through the relay; 'direct' publishes from the request after commit
+INGEST_PUBLISH_MODE = os.getenv('INGEST_PUBLISH_MODE', 'outbox')
+OUTBOX_ENABLED = INGEST_PUBLISH_MODE == 'outbox'
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '500'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '0.2'))  # seconds to wait when the outbox is drained
+OUTBOX_CLAIM_TTL = float(os.getenv('OUTBOX_CLAIM_TTL', '30'))  # seconds before rows claimed by a dead relay are retried
+OUTBOX_MAX_AGE = float(os.getenv('OUTBOX_MAX_AGE', '60'))  # seconds an outbox row may wait before readiness fails
+
+
+def outbox_message(webhook, priority=None):
+    """Outbox row for a webhook that is being added in the current session."""
+    return OutboxMessage(webhook=webhook, traceparent=current_traceparent(), priority=priority)
+
+
+def claim_batch(limit):
+    """
+    Claim up to `limit` of the oldest unclaimed (or expired) outbox rows for
+    OUTBOX_CLAIM_TTL seconds and return them. Rows locked by another relay are
+    skipped; the caller commits before publishing.
+    """
+    now = datetime.utcnow()
+    ids = (
+        select(OutboxMessage.id)
+        .where(or_(OutboxMessage.claimed_until.is_(None), OutboxMessage.claimed_until < now))
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(ids))
+        .values(claimed_until=now + timedelta(seconds=OUTBOX_CLAIM_TTL))
+        .returning(OutboxMessage.id, OutboxMessage.webhook_id, OutboxMessage.traceparent, OutboxMessage.priority,
+                   OutboxMessage.created_at)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(stmt).all()
+
+
+def finish_batch(ids, published):
+    """Delete published rows, or release the claims on rows that were not published."""
+    if published:
+        stmt = delete(OutboxMessage).where(OutboxMessage.id.in_(ids))
+    else:
+        stmt = update(OutboxMessage).where(OutboxMessage.id.in_(ids)).values(claimed_until=None)
+    try:
+        db.session.execute(stmt.execution_options(synchronize_session=False))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def oldest_age():
+    """Seconds the oldest outbox row has been waiting, or 0 when the outbox is empty."""
+    created_at = db.session.execute(
+        select(OutboxMessage.created_at).order_by(OutboxMessage.id).limit(1)
+    ).scalar()
+    if created_at is None:
+        return 0
+    return max((datetime.utcnow() - created_at).total_seconds(), 0)
+
+
+def publish_deliveries(deliveries):
+    """
+    Publish delivery tasks for (webhook_id, traceparent, priority) tuples over one
+    broker connection. A priority of None uses the default.
+    """
+    from .tasks import celery, process_webhook_delivery
+
+    with celery.producer_or_acquire() as producer:
+        for webhook_id, traceparent, priority in deliveries:
+            options = {'priority': priority} if priority is not None else {}
+            process_webhook_delivery.apply_async(
+                (webhook_id,),
+                producer=producer,
+                headers={'traceparent': traceparent} if traceparent else None,
+                **options
+            )
+
+
+def relay_batch(limit=OUTBOX_BATCH_SIZE):
+    """Publish one batch of outbox rows. Returns how many were published."""
+    started = time.perf_counter()
+    try:
+        rows = claim_batch(limit)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if not rows:
+        return 0
+
+    ids = [row[0] for row in rows]
+    try:
+        publish_deliveries((webhook_id, traceparent, priority) for _, webhook_id, traceparent, priority, _ in rows)
+    except Exception:
+        # Let the next batch retry them instead of waiting out the claim
+        finish_batch(ids, published=False)
+        raise
+    finish_batch(ids, published=True)
+
+    now = datetime.utcnow()
+    OUTBOX_RELAYED.inc(len(rows))
+    OUTBOX_RELAY_LATENCY.observe(time.perf_counter() - started)
+    for *_, created_at in rows:
+        if created_at is not None:
+            OUTBOX_LAG.observe(max((now - created_at).total_seconds(), 0))
+    return len(rows)
+
+
+def run_relay(stop):
+    """
+    Relay outbox rows until `stop` (a threading.Event) is set. Full batches are
+    followed immediately by the next one; otherwise the relay polls every
+    OUTBOX_POLL_INTERVAL seconds.
+    """
+    logger.info('Outbox relay started (batch size %s, poll interval %ss)', OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL)
+    while not stop.is_set():
+        try:
+            published = relay_batch()
+        except Exception as e:
+            logger.error('Outbox relay batch failed: %s', e)
+            stop.wait(1)
+            continue
+        if published:
+            logger.debug('Relayed %s outbox rows', published)
+        if published < OUTBOX_BATCH_SIZE:
+            stop.wait(OUTBOX_POLL_INTERVAL)
+    logger.info('Outbox relay stopped')
@@ -0,0 +1,100 @@
+"""
+Content-addressed payload storage.
+
+Bodies are stored once in `payload_blobs`, keyed by the SHA-256 of their
+canonical JSON (sorted keys, no whitespace), so the same event sent to many
+subscriptions or resent by a producer is written once. Webhooks and events
+refer to it by `payload_hash`.
+
+Ingesting a body that is already stored must not write to its row: with a
+reference count, every webhook for a popular body would update, lock and
+WAL-log the same row. store_payload() therefore only inserts missing blobs
+(ON CONFLICT DO NOTHING). A blob is kept while webhooks or events reference it,
+which retention (app.retention) checks with NOT EXISTS when it purges them.
+
+last_seen_at keeps retention from deleting a blob that ingest is about to
+reference in a transaction it has not committed yet. Each process refreshes it
+at most once every PAYLOAD_TOUCH_INTERVAL seconds per blob, and retention only
+deletes blobs not seen for several intervals. A refresh that finds the blob
+already gone inserts it again.
+"""
+from . import db
+from .models import PayloadBlob, WebhookPayload, Event, dialect_insert
+from sqlalchemy import update, delete, exists
+from datetime import datetime, timedelta
+import os
+import json
+import time
+import hashlib
+import threading
+
+PAYLOAD_TOUCH_INTERVAL = float(os.getenv('PAYLOAD_TOUCH_INTERVAL', '3600'))  # seconds between last_seen_at refreshes
+MAX_TOUCHED = 100000  # blobs remembered per process
+
+_touched = {}
+_touched_lock = threading.Lock()
+
+
+def canonical_json(payload):
+    return json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def payload_hash(payload):
+    return hashlib.sha256(canonical_json(payload).encode('utf-8')).hexdigest()
+
+
+def _recently_touched(digest):
+    touched_at = _touched.get(digest)
+    return touched_at is not None and time.monotonic() - touched_at < PAYLOAD_TOUCH_INTERVAL
+
+
+def _touch(digest):
+    with _touched_lock:
+        if len(_touched) >= MAX_TOUCHED:
+            _touched.clear()
+        _touched[digest] = time.monotonic()
+
+
+def store_payload(payload):
+    """
+    Make sure the payload's blob exists in the current session. Returns the
+    hash to store in payload_hash.
+    """
+    encoded = canonical_json(payload).encode('utf-8')
+    digest = hashlib.sha256(encoded).hexdigest()
+    now = datetime.utcnow()
+    table = PayloadBlob.__table__
+    if not _recently_touched(digest):
+        refreshed = db.session.execute(
+            update(table).where(table.c.hash == digest).values(last_seen_at=now)
+        ).rowcount
+        _touch(digest)
+        if refreshed:
+            return digest
+    db.session.execute(
+        dialect_insert(PayloadBlob)
+        .values(hash=digest, body=payload, size=len(encoded), created_at=now, last_seen_at=now)
+        .on_conflict_do_nothing(index_elements=['hash'])
+    )
+    return digest
+
+
+def collect_payloads(hashes):
+    """
+    Delete the blobs among `hashes` that no webhook or event references any
+    more, in the current session. Returns the number of blobs deleted.
+    """
+    if not hashes:
+        return 0
+    table = PayloadBlob.__table__
+    # Long enough that no process can still be using an older refresh
+    seen_before = datetime.utcnow() - timedelta(seconds=PAYLOAD_TOUCH_INTERVAL * 3)
+    result = db.session.execute(
+        delete(table).where(
+            table.c.hash.in_(sorted(hashes)),
+            table.c.last_seen_at < seen_before,
+            ~exists().where(WebhookPayload.payload_hash == table.c.hash),
+            ~exists().where(Event.payload_hash == table.c.hash),
+        ).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
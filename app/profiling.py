@@ -0,0 +1,218 @@
+"""
+Opt-in, sampled per-phase timing for requests and Celery tasks.
+
+A sampled request or task carries a profile; code wraps interesting sections in
+`with phase('db_commit'):` and the elapsed time is added to that phase. Phases are
+also recorded as spans when tracing is on (see app.tracing). Work that is neither
+profiled nor traced pays a couple of context-variable lookups per phase.
+
+Finished profiles go to a bounded Redis list shared by web and worker processes
+(read by GET /debug/profiles) and, if PROFILE_DUMP_DIR is set, are appended to a
+JSON-lines file per process.
+
+The sample rate starts at PROFILE_SAMPLE_RATE and can be changed at runtime via
+POST /debug/profiles/config, which every process picks up within
+PROFILE_CONFIG_REFRESH seconds.
+"""
+from .redis_client import get_redis
+from .tracing import span, PHASE_KINDS, INTERNAL
+from flask import g, request
+from celery.signals import task_prerun, task_postrun
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from collections import deque
+import os
+import json
+import time
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_CONFIG_REFRESH = float(os.getenv('PROFILE_CONFIG_REFRESH', '10'))  # seconds
+PROFILE_DUMP_DIR = os.getenv('PROFILE_DUMP_DIR')
+PROFILE_BUFFER_SIZE = int(os.getenv('PROFILE_BUFFER_SIZE', '1000'))
+
+SAMPLE_RATE_KEY = 'profiling:sample_rate'
+PROFILES_KEY = 'profiling:recent'
+
+_current = ContextVar('wds_profile', default=None)
+_recent = deque(maxlen=PROFILE_BUFFER_SIZE)  # this process's profiles, used if Redis is unavailable
+_rate = {'value': PROFILE_SAMPLE_RATE, 'checked_at': 0.0}
+
+
+class Profile:
+    __slots__ = ('kind', 'name', 'started_at', 'started', 'phases')
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def add(self, phase_name, seconds):
+        self.phases[phase_name] = self.phases.get(phase_name, 0.0) + seconds
+
+    def to_dict(self):
+        total_ms = (time.perf_counter() - self.started) * 1000
+        phases = {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()}
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'pid': os.getpid(),
+            'total_ms': round(total_ms, 3),
+            'phases': phases,
+            'other_ms': round(max(total_ms - sum(phases.values()), 0.0), 3),
+        }
+
+
+def sample_rate():
+    """The current sample rate, refreshed from Redis at most every PROFILE_CONFIG_REFRESH seconds."""
+    now = time.monotonic()
+    if now - _rate['checked_at'] > PROFILE_CONFIG_REFRESH:
+        _rate['checked_at'] = now
+        try:
+            override = get_redis().get(SAMPLE_RATE_KEY)
+            _rate['value'] = float(override) if override is not None else PROFILE_SAMPLE_RATE
+        except Exception as e:
+            logger.warning('Could not read profiling sample rate: %s', e)
+    return _rate['value']
+
+
+def set_sample_rate(rate):
+    """Change the sample rate for every process. None restores PROFILE_SAMPLE_RATE."""
+    client = get_redis()
+    if rate is None:
+        client.delete(SAMPLE_RATE_KEY)
+    else:
+        client.set(SAMPLE_RATE_KEY, rate)
+    _rate['checked_at'] = 0.0
+
+
+def start(kind, name):
+    """Begin a profile for the current request/task if it is sampled; returns a reset token or None."""
+    rate = sample_rate()
+    if rate <= 0 or random.random() >= rate:
+        return None
+    return _current.set(Profile(kind, name))
+
+
+def finish(token):
+    profile = _current.get()
+    _current.reset(token)
+    if profile is None:
+        return
+    record = profile.to_dict()
+    _recent.append(record)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.lpush(PROFILES_KEY, json.dumps(record))
+        pipe.ltrim(PROFILES_KEY, 0, PROFILE_BUFFER_SIZE - 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning('Could not publish profile: %s', e)
+    if PROFILE_DUMP_DIR:
+        try:
+            with open(os.path.join(PROFILE_DUMP_DIR, f'profiles-{os.getpid()}.jsonl'), 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            logger.warning('Could not dump profile: %s', e)
+
+
+@contextmanager
+def phase(name):
+    """
+    Time a section of the current request or task, if it is being profiled, and
+    record it as a span if it is being traced.
+    """
+    with span(name, PHASE_KINDS.get(name, INTERNAL)):
+        profile = _current.get()
+        if profile is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            profile.add(name, time.perf_counter() - started)
+
+
+def recent_profiles(limit=PROFILE_BUFFER_SIZE):
+    """Most recent profiles from all processes, newest first."""
+    try:
+        return [json.loads(item) for item in get_redis().lrange(PROFILES_KEY, 0, limit - 1)]
+    except Exception as e:
+        logger.warning('Could not read profiles from Redis, using this process only: %s', e)
+        return list(reversed(_recent))[:limit]
+
+
+def summarize(profiles):
+    """
+    Per-phase breakdown for each (kind, name): count, mean and max milliseconds,
+    plus each phase's share of the total time.
+    """
+    groups = {}
+    for profile in profiles:
+        group = groups.setdefault((profile['kind'], profile['name']), {'count': 0, 'total_ms': 0.0, 'phases': {}})
+        group['count'] += 1
+        group['total_ms'] += profile['total_ms']
+        for name, ms in list(profile['phases'].items()) + [('other', profile['other_ms'])]:
+            stats = group['phases'].setdefault(name, {'total_ms': 0.0, 'max_ms': 0.0})
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+
+    summary = []
+    for (kind, name), group in groups.items():
+        summary.append({
+            'kind': kind,
+            'name': name,
+            'count': group['count'],
+            'mean_ms': round(group['total_ms'] / group['count'], 3),
+            'phases': {
+                phase_name: {
+                    'mean_ms': round(stats['total_ms'] / group['count'], 3),
+                    'max_ms': round(stats['max_ms'], 3),
+                    'share': round(stats['total_ms'] / group['total_ms'], 4) if group['total_ms'] else None,
+                }
+                for phase_name, stats in sorted(group['phases'].items(), key=lambda item: -item[1]['total_ms'])
+            },
+        })
+    summary.sort(key=lambda item: -item['mean_ms'] * item['count'])
+    return summary
+
+
+def init_profiling(app):
+    """Profile a sample of this app's requests."""
+    if PROFILE_DUMP_DIR:
+        os.makedirs(PROFILE_DUMP_DIR, exist_ok=True)
+
+    @app.before_request
+    def start_request_profile():
+        g.profile_token = start('request', request.endpoint or request.path)
+
+    @app.teardown_request
+    def finish_request_profile(exc=None):
+        token = g.pop('profile_token', None)
+        if token is not None:
+            finish(token)
+
+
+_task_tokens = {}
+
+
+@task_prerun.connect
+def start_task_profile(task_id=None, task=None, **kwargs):
+    token = start('task', task.name)
+    if token is not None:
+        _task_tokens[task_id] = token
+
+
+@task_postrun.connect
+def finish_task_profile(task_id=None, **kwargs):
+    token = _task_tokens.pop(task_id, None)
+    if token is not None:
+        finish(token)
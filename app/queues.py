@@ -0,0 +1,51 @@
+"""
+Delivery lanes and priorities.
+
+First attempts, retries and dead-letter replays each have their own broker
+queue, so retries piling up for a failing endpoint never sit in front of fresh
+webhooks for healthy ones. Workers choose their lanes with `-Q` (see
+docker-compose.yaml). Other tasks use Celery's default queue.
+
+Within a lane, the Redis transport keeps one list per priority step and always
+pops the lowest step first, so `high` deliveries overtake `normal` and `low`
+ones. Retries keep the priority of the delivery they retry.
+
+A message that is not acknowledged within BROKER_VISIBILITY_TIMEOUT is handed
+out again; so is an ETA retry still held by a worker that restarted. With the
+retry delays, this bounds how long after a delivery a copy can still arrive
+(app.leases).
+"""
+import os
+
+DELIVERY_QUEUE = os.getenv('DELIVERY_QUEUE', 'deliveries')  # first attempts
+RETRY_QUEUE = os.getenv('RETRY_QUEUE', 'retries')
+REPLAY_QUEUE = os.getenv('REPLAY_QUEUE', 'replays')
+DEFAULT_QUEUE = 'celery'
+
+RETRY_DELAYS = [10, 30, 60, 300, 900]  # 10s, 30s, 1m, 5m, 15m
+BROKER_VISIBILITY_TIMEOUT = int(os.getenv('BROKER_VISIBILITY_TIMEOUT', '3600'))  # seconds; kombu's Redis default
+
+# Redis priorities: lower numbers are served first
+PRIORITIES = {'high': 0, 'normal': 3, 'low': 6}
+DEFAULT_PRIORITY = PRIORITIES['normal']
+PRIORITY_STEPS = sorted(PRIORITIES.values())
+PRIORITY_SEP = ':'
+
+BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': PRIORITY_STEPS, 'sep': PRIORITY_SEP, 'visibility_timeout': BROKER_VISIBILITY_TIMEOUT
+}
+
+
+def parse_priority(value):
+    """Priority number for a name from PRIORITIES; None for no value. Raises ValueError otherwise."""
+    if value is None or value == '':
+        return None
+    try:
+        return PRIORITIES[value]
+    except KeyError:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}") from None
+
+
+def queue_keys(queue):
+    """Redis lists holding a queue's messages, one per priority step."""
+    return [queue if step == 0 else f'{queue}{PRIORITY_SEP}{step}' for step in PRIORITY_STEPS]
@@ -0,0 +1,160 @@
+"""
+Per-producer ingest rate limits.
+
+Each subscription and each client IP has a token bucket (rate per second,
+burst capacity) shared by all web processes through Redis. Processes do not
+ask Redis per request. Instead they lease tokens in blocks: a leased block is
+spent locally, and only an empty or expired block costs a round trip. One Lua
+script refills the shared bucket, takes back the unused tokens of the previous
+block, and grants the next one. The shared limit is therefore never exceeded.
+
+A block is about RATE_LIMIT_SYNC_INTERVAL seconds of the bucket's rate and
+expires after that interval, so idle processes do not sit on tokens for long.
+When the shared bucket is empty, the script says how long until the next
+token, and the process refuses that key locally until then. If Redis is
+unavailable, each process enforces the limits on its own.
+"""
+from .redis_client import get_redis
+from .metrics import RATE_LIMIT_SYNCS
+import os
+import math
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+INGEST_RATE_PER_SUBSCRIPTION = float(os.getenv('INGEST_RATE_PER_SUBSCRIPTION', '0'))  # requests/s; 0 disables
+INGEST_BURST_PER_SUBSCRIPTION = float(os.getenv('INGEST_BURST_PER_SUBSCRIPTION', str(INGEST_RATE_PER_SUBSCRIPTION)))
+INGEST_RATE_PER_IP = float(os.getenv('INGEST_RATE_PER_IP', '0'))  # requests/s; 0 disables
+INGEST_BURST_PER_IP = float(os.getenv('INGEST_BURST_PER_IP', str(INGEST_RATE_PER_IP)))
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv('RATE_LIMIT_SYNC_INTERVAL', '0.5'))  # seconds a leased block lasts
+RATE_LIMIT_PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', '0'))  # trusted proxies appending X-Forwarded-For
+
+RATE_LIMIT_PREFIX = 'ratelimit:'
+MAX_LOCAL_BUCKETS = 100000
+
+# KEYS[1] bucket; ARGV rate, burst, now (seconds), tokens wanted, unused tokens given back.
+# Returns {tokens granted, seconds until a token is available when none were granted}.
+_LEASE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate + tonumber(ARGV[5]))
+local granted = math.min(tonumber(ARGV[4]), math.floor(tokens))
+tokens = tokens - granted
+redis.call('hset', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('pexpire', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+local wait = 0
+if granted < 1 then
+    wait = (1 - tokens) / rate
+end
+return {granted, tostring(wait)}
+"""
+
+_scripts = {'client': None}
+
+
+def lease_script():
+    client = get_redis()
+    if _scripts['client'] is not client:
+        _scripts.update(client=client, lease=client.register_script(_LEASE))
+    return _scripts['lease']
+
+
+class Bucket:
+    __slots__ = ('tokens', 'expires_at', 'blocked_until', 'local_tokens', 'local_at', 'lock')
+
+    def __init__(self):
+        self.tokens = 0
+        self.expires_at = 0
+        self.blocked_until = 0
+        self.local_tokens = 0  # the bucket this process falls back to without Redis
+        self.local_at = None
+        self.lock = threading.Lock()
+
+
+class RateLimiter:
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.block = max(1, min(int(self.burst), math.ceil(rate * RATE_LIMIT_SYNC_INTERVAL)))
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                if len(self.buckets) >= MAX_LOCAL_BUCKETS:
+                    # Start over rather than scan; the shared buckets in Redis keep the state
+                    self.buckets = {}
+                bucket = self.buckets.setdefault(key, Bucket())
+        return bucket
+
+    def lease_locally(self, bucket, now, unused):
+        """(granted, wait) as the lease script computes them, from this process's own bucket."""
+        tokens = self.burst if bucket.local_at is None else bucket.local_tokens + (now - bucket.local_at) * self.rate
+        tokens = min(self.burst, tokens + unused)
+        granted = min(self.block, math.floor(tokens))
+        bucket.local_tokens = tokens - granted
+        bucket.local_at = now
+        return granted, (1 - bucket.local_tokens) / self.rate if granted < 1 else 0
+
+    def acquire(self, key):
+        """
+        Take one token for `key`. Returns 0 if allowed, otherwise the seconds
+        until the next token is expected.
+        """
+        if not self.enabled:
+            return 0
+        bucket = self.bucket(key)
+        with bucket.lock:
+            now = time.monotonic()
+            if now < bucket.blocked_until:
+                return bucket.blocked_until - now
+            if bucket.tokens >= 1 and now < bucket.expires_at:
+                bucket.tokens -= 1
+                return 0
+
+            unused = bucket.tokens  # left over from an expired block
+            try:
+                granted, wait = lease_script()(
+                    keys=[f'{RATE_LIMIT_PREFIX}{self.name}:{key}'],
+                    args=[self.rate, self.burst, time.time(), self.block, unused]
+                )
+                granted, wait = int(granted), float(wait)
+                RATE_LIMIT_SYNCS.labels(self.name, 'ok').inc()
+            except Exception as e:
+                # Enforce the limit in this process alone until Redis is back
+                logger.warning('Could not sync %s rate limit for %s: %s', self.name, key, e)
+                RATE_LIMIT_SYNCS.labels(self.name, 'error').inc()
+                granted, wait = self.lease_locally(bucket, now, unused)
+
+            bucket.expires_at = now + RATE_LIMIT_SYNC_INTERVAL
+            bucket.tokens = granted
+            if granted < 1:
+                bucket.blocked_until = now + wait
+                return wait
+            bucket.tokens -= 1
+            return 0
+
+
+subscription_limiter = RateLimiter('subscription', INGEST_RATE_PER_SUBSCRIPTION, INGEST_BURST_PER_SUBSCRIPTION)
+ip_limiter = RateLimiter('ip', INGEST_RATE_PER_IP, INGEST_BURST_PER_IP)
+
+
+def client_ip(request):
+    """The producer's address: the peer, or the one added by the outermost trusted proxy."""
+    if RATE_LIMIT_PROXY_HOPS and request.access_route:
+        route = request.access_route
+        return route[max(len(route) - RATE_LIMIT_PROXY_HOPS, 0)]
+    return request.remote_addr
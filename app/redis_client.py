@@ -0,0 +1,23 @@
+import os
+import redis
+
+# Redis used for app-level state (markers, caches, counters). Defaults to the broker.
+REDIS_URL = os.getenv('REDIS_URL', os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '0.5'))
+
+_client = None
+
+
+def get_redis():
+    """
+    Shared Redis client. Created lazily; redis-py resets its connection pool
+    after a fork, so prefork workers each end up with their own connections.
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            REDIS_URL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+    return _client
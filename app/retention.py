@@ -0,0 +1,132 @@
+"""
+Retention for delivered and dead webhooks.
+
+purge_expired() runs from Celery beat (app.tasks.purge_expired_webhooks). It
+deletes delivered webhooks older than WEBHOOK_RETENTION_DAYS, together with
+their attempts, logs, status, dead letter and outbox rows. Dead webhooks are
+waiting in the dead-letter queue to be replayed, so they have their own
+DEAD_LETTER_RETENTION_DAYS, which by default keeps them until they are.
+Events left without webhooks are deleted too. Payload blobs of the purged
+webhooks and events that nothing references any more are deleted in the same
+transaction (app.payloads).
+
+Work is done in batches of RETENTION_BATCH_SIZE webhooks, one transaction each,
+so a large backlog never holds long locks.
+"""
+from . import db
+from .models import WebhookPayload, WebhookStatus, DeliveryAttempt, Logs, DeadLetter, OutboxMessage, Event
+from .payloads import collect_payloads
+from .status import invalidate_statuses
+from .metrics import RETENTION_PURGED
+from sqlalchemy import select, delete, exists, and_, or_, func
+from datetime import datetime, timedelta
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_RETENTION_DAYS = float(os.getenv('WEBHOOK_RETENTION_DAYS', '30'))  # 0 keeps everything
+DEAD_LETTER_RETENTION_DAYS = float(os.getenv('DEAD_LETTER_RETENTION_DAYS', '0'))  # 0 keeps dead webhooks
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '1000'))
+RETENTION_MAX_BATCHES = int(os.getenv('RETENTION_MAX_BATCHES', '100'))  # per run; the next run continues
+
+def expired(cutoffs):
+    """
+    Condition for webhooks past their cutoff: delivered ones received before
+    it, dead ones dead-lettered before it (or received before it, if they have
+    no dead letter row).
+    """
+    conditions = []
+    if 'delivered' in cutoffs:
+        conditions.append(and_(WebhookStatus.state == 'delivered', WebhookPayload.received_at < cutoffs['delivered']))
+    if 'dead' in cutoffs:
+        dead_letter = select(DeadLetter.dead_at).where(DeadLetter.webhook_id == WebhookPayload.id).scalar_subquery()
+        conditions.append(and_(
+            WebhookStatus.state == 'dead',
+            func.coalesce(dead_letter, WebhookPayload.received_at) < cutoffs['dead']
+        ))
+    return or_(*conditions)
+
+
+def purge_batch(cutoffs, limit=RETENTION_BATCH_SIZE):
+    """
+    Delete up to `limit` webhooks past their cutoff in `cutoffs` ({'delivered'
+    or 'dead': datetime}), in the current transaction. Returns (webhooks,
+    events, blobs) deleted.
+    """
+    rows = db.session.execute(
+        select(WebhookPayload.id, WebhookPayload.payload_hash, WebhookPayload.event_id)
+        .join(WebhookStatus, WebhookStatus.webhook_id == WebhookPayload.id)
+        .where(expired(cutoffs))
+        .order_by(WebhookPayload.received_at)
+        .limit(limit)
+    ).all()
+    if not rows:
+        return 0, 0, 0
+
+    webhook_ids = [webhook_id for webhook_id, _, _ in rows]
+    hashes = {digest for _, digest, _ in rows if digest is not None}
+    event_ids = {event_id for _, _, event_id in rows if event_id is not None}
+
+    for model, column in (
+            (DeliveryAttempt, DeliveryAttempt.webhook_id),
+            (Logs, Logs.wp_id),
+            (DeadLetter, DeadLetter.webhook_id),
+            (OutboxMessage, OutboxMessage.webhook_id),
+            (WebhookStatus, WebhookStatus.webhook_id)):
+        db.session.execute(delete(model).where(column.in_(webhook_ids)).execution_options(synchronize_session=False))
+    db.session.execute(
+        delete(WebhookPayload).where(WebhookPayload.id.in_(webhook_ids)).execution_options(synchronize_session=False)
+    )
+
+    events = []
+    if event_ids:
+        # Events whose last webhook was just purged
+        events = db.session.execute(
+            select(Event.id, Event.payload_hash).where(
+                Event.id.in_(event_ids),
+                ~exists().where(WebhookPayload.event_id == Event.id)
+            )
+        ).all()
+        if events:
+            db.session.execute(
+                delete(Event).where(Event.id.in_([event_id for event_id, _ in events]))
+                .execution_options(synchronize_session=False)
+            )
+            hashes.update(digest for _, digest in events if digest is not None)
+
+    blobs = collect_payloads(hashes)
+    db.session.commit()
+    invalidate_statuses(webhook_ids)
+    return len(webhook_ids), len(events), blobs
+
+
+def purge_expired(now=None):
+    """Purge webhooks past retention, batch by batch. Returns the number of webhooks purged."""
+    now = now or datetime.utcnow()
+    cutoffs = {}
+    if WEBHOOK_RETENTION_DAYS > 0:
+        cutoffs['delivered'] = now - timedelta(days=WEBHOOK_RETENTION_DAYS)
+    if DEAD_LETTER_RETENTION_DAYS > 0:
+        cutoffs['dead'] = now - timedelta(days=DEAD_LETTER_RETENTION_DAYS)
+    if not cutoffs:
+        return 0
+    purged = events = blobs = 0
+    for _ in range(RETENTION_MAX_BATCHES):
+        try:
+            batch = purge_batch(cutoffs)
+        except Exception:
+            db.session.rollback()
+            raise
+        purged += batch[0]
+        events += batch[1]
+        blobs += batch[2]
+        RETENTION_PURGED.labels('webhooks').inc(batch[0])
+        RETENTION_PURGED.labels('events').inc(batch[1])
+        RETENTION_PURGED.labels('payload_blobs').inc(batch[2])
+        if batch[0] < RETENTION_BATCH_SIZE:
+            break
+    if purged:
+        logger.info('Retention purged %s webhooks, %s events and %s payload blobs (cutoffs %s)',
+                    purged, events, blobs, {state: cutoff.isoformat() for state, cutoff in cutoffs.items()})
+    return purged
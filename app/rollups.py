@@ -0,0 +1,176 @@
+from . import db
+from .models import DeliveryRollup, LatencyRollup, dialect_insert
+from .histogram import bucket_index, percentiles
+from collections import Counter
+from datetime import datetime, timedelta
+import re
+
+
+def minute(ts):
+    return ts.replace(second=0, microsecond=0)
+
+
+def apply_rollups(attempts):
+    """
+    Add a batch of finished attempts to the minute rollups in the current session.
+
+    Each attempt is a dict with subscription_id, attempt_number, timestamp, status
+    and a `latency` dict of {metric: milliseconds}. Counts are aggregated in memory
+    first so a batch costs one upsert per (subscription, minute) key rather than
+    one per attempt, and keys are written in sorted order so concurrent workers
+    lock rows in the same order.
+    """
+    deliveries = {}
+    latencies = Counter()
+    for attempt in attempts:
+        bucket_start = minute(attempt['timestamp'])
+        key = (attempt['subscription_id'], bucket_start, attempt['attempt_number'])
+        counts = deliveries.setdefault(key, [0, 0, 0])
+        counts[0] += 1
+        counts[1 if attempt['status'] == 'success' else 2] += 1
+        for metric, value in (attempt.get('latency') or {}).items():
+            if value is not None:
+                latencies[(attempt['subscription_id'], bucket_start, metric, bucket_index(value))] += 1
+
+    if deliveries:
+        stmt = dialect_insert(DeliveryRollup)
+        table = DeliveryRollup.__table__
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['subscription_id', 'bucket_start', 'attempt_number'],
+            set_={
+                'attempts': table.c.attempts + stmt.excluded.attempts,
+                'successes': table.c.successes + stmt.excluded.successes,
+                'failures': table.c.failures + stmt.excluded.failures,
+            }
+        )
+        db.session.execute(stmt, [
+            {
+                'subscription_id': subscription_id,
+                'bucket_start': bucket_start,
+                'attempt_number': attempt_number,
+                'attempts': counts[0],
+                'successes': counts[1],
+                'failures': counts[2],
+            }
+            for (subscription_id, bucket_start, attempt_number), counts in sorted(deliveries.items())
+        ])
+
+    if latencies:
+        stmt = dialect_insert(LatencyRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['subscription_id', 'bucket_start', 'metric', 'bucket'],
+            set_={'count': LatencyRollup.__table__.c['count'] + stmt.excluded['count']}
+        )
+        db.session.execute(stmt, [
+            {
+                'subscription_id': subscription_id,
+                'bucket_start': bucket_start,
+                'metric': metric,
+                'bucket': bucket,
+                'count': count,
+            }
+            for (subscription_id, bucket_start, metric, bucket), count in sorted(latencies.items())
+        ])
+
+
+WINDOW_UNITS = {'m': 1, 'h': 60, 'd': 1440}
+MAX_WINDOW_MINUTES = 30 * 1440
+
+
+def parse_window(value):
+    """
+    '15m', '6h', '7d' or a bare number of minutes. Raises ValueError if malformed or too long.
+    """
+    match = re.fullmatch(r'(\d+)([mhd]?)', (value or '').strip())
+    if not match:
+        raise ValueError(f'Invalid window: {value}')
+    minutes = int(match.group(1)) * WINDOW_UNITS[match.group(2) or 'm']
+    if not 0 < minutes <= MAX_WINDOW_MINUTES:
+        raise ValueError(f'Window must be between 1 minute and {MAX_WINDOW_MINUTES // 1440} days')
+    return minutes
+
+
+def subscription_stats(subscription_id, window_minutes, now=None):
+    """
+    Delivery statistics for one subscription over the last `window_minutes`,
+    computed from the minute rollups.
+    """
+    now = now or datetime.utcnow()
+    since = minute(now) - timedelta(minutes=window_minutes - 1)
+
+    by_attempt = (
+        db.session.query(
+            DeliveryRollup.attempt_number,
+            db.func.sum(DeliveryRollup.attempts),
+            db.func.sum(DeliveryRollup.successes),
+            db.func.sum(DeliveryRollup.failures),
+        )
+        .filter(DeliveryRollup.subscription_id == subscription_id, DeliveryRollup.bucket_start >= since)
+        .group_by(DeliveryRollup.attempt_number)
+        .all()
+    )
+    latency_rows = (
+        db.session.query(LatencyRollup.metric, LatencyRollup.bucket, db.func.sum(LatencyRollup.count))
+        .filter(LatencyRollup.subscription_id == subscription_id, LatencyRollup.bucket_start >= since)
+        .group_by(LatencyRollup.metric, LatencyRollup.bucket)
+        .all()
+    )
+
+    attempts = sum(int(row[1]) for row in by_attempt)
+    successes = sum(int(row[2]) for row in by_attempt)
+    failures = sum(int(row[3]) for row in by_attempt)
+    first_attempts = next((row for row in by_attempt if row[0] == 1), None)
+
+    histograms = {}
+    for metric, bucket, count in latency_rows:
+        histograms.setdefault(metric, {})[bucket] = int(count)
+
+    return {
+        'subscription_id': subscription_id,
+        'window_minutes': window_minutes,
+        'from': since.isoformat(),
+        'to': now.isoformat(),
+        'attempts': attempts,
+        'successes': successes,
+        'failures': failures,
+        'success_rate': round(successes / attempts, 4) if attempts else None,
+        'first_attempt_success_rate': (
+            round(int(first_attempts[2]) / int(first_attempts[1]), 4) if first_attempts and first_attempts[1] else None
+        ),
+        'attempts_by_number': {
+            str(row[0]): {'attempts': int(row[1]), 'successes': int(row[2]), 'failures': int(row[3])}
+            for row in sorted(by_attempt)
+        },
+        'latency_ms': {metric: percentiles(counts) for metric, counts in histograms.items()},
+    }
+
+
+LATENCY_METRICS = ('http', 'queue', 'e2e')
+
+
+def slowest_subscriptions(metric, window_minutes, limit=10, quantile=95, now=None):
+    """
+    Subscriptions ranked by a latency percentile over the last `window_minutes`,
+    so slow subscribers (metric 'http') or queueing delays ('queue') stand out.
+    """
+    now = now or datetime.utcnow()
+    since = minute(now) - timedelta(minutes=window_minutes - 1)
+
+    rows = (
+        db.session.query(LatencyRollup.subscription_id, LatencyRollup.bucket, db.func.sum(LatencyRollup.count))
+        .filter(LatencyRollup.metric == metric, LatencyRollup.bucket_start >= since)
+        .group_by(LatencyRollup.subscription_id, LatencyRollup.bucket)
+        .all()
+    )
+
+    histograms = {}
+    for subscription_id, bucket, count in rows:
+        histograms.setdefault(subscription_id, {})[bucket] = int(count)
+
+    ranked = []
+    for subscription_id, counts in histograms.items():
+        summary = percentiles(counts, quantiles=(50, quantile))
+        summary['subscription_id'] = subscription_id
+        ranked.append(summary)
+    ranked.sort(key=lambda summary: summary[f'p{quantile}'], reverse=True)
+    return ranked[:limit]
@@ -2,5 +2,9 @@ from .ping import ping_bp
 from .subscriptions import subscriptions_bp
 from .clients import clients_bp
 from .ingest import ingest_bp
+from .deadletters import deadletters_bp
+from .webhooks import webhooks_bp
+from .metrics import metrics_bp
+from .profiling import profiling_bp
 from ..logs import logs_bp
 from ..swagger import swagger_bp
\ No newline at end of file
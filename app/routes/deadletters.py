@@ -0,0 +1,113 @@
+from flask import Blueprint, jsonify, request
+from .. import db
+from sqlalchemy.exc import SQLAlchemyError
+from ..models import DeadLetter
+from ..serialization import json_response
+from ..tasks import dead_letter_query, replay_dead_letters, REPLAY_DEFAULT_RATE
+from datetime import datetime
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Create a blueprint for the dead-letter routes
+deadletters_bp = Blueprint('deadletters', __name__, url_prefix='/deadletters')
+
+
+def parse_filters(source):
+    """
+    Pull subscription_id / start / end out of a dict of request values.
+    Raises ValueError or TypeError (a JSON value of the wrong type) on malformed input.
+    """
+    subscription_id = source.get('subscription_id')
+    start = source.get('start')
+    end = source.get('end')
+    return (
+        int(subscription_id) if subscription_id is not None else None,
+        datetime.fromisoformat(start) if start else None,
+        datetime.fromisoformat(end) if end else None,
+    )
+
+
+@deadletters_bp.route('', methods=['GET'])
+def get_dead_letters():
+    """
+    List dead letters that are waiting for a replay.
+    Optional query params: subscription_id, start, end (ISO 8601), limit.
+    """
+    try:
+        subscription_id, start, end = parse_filters(request.args)
+        limit = min(int(request.args.get('limit', 100)), 1000)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid filter parameters'}), 400
+
+    if limit <= 0:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    try:
+        query = dead_letter_query(subscription_id, start, end)
+        dead_letters = query.order_by(DeadLetter.dead_at.desc()).limit(limit).all()
+        return json_response({
+            'count': query.count(),
+            'dead_letters': [entry.to_dict() for entry in dead_letters]
+        })
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error('Error fetching dead letters: %s', e)
+        return jsonify({'error': str(e)}), 500
+
+
+@deadletters_bp.route('/replay', methods=['POST'])
+def replay():
+    """
+    Re-enqueue every dead letter matching the filters at a controlled rate.
+
+    Example request:
+    ```
+    {
+        "subscription_id": 1,
+        "start": "2025-04-27T10:00:00",
+        "end": "2025-04-27T12:00:00",
+        "rate": 100,
+        "limit": 10000
+    }
+    ```
+    """
+    data = request.get_json(silent=True) or {}
+
+    try:
+        subscription_id, start, end = parse_filters(data)
+        rate = float(data.get('rate', REPLAY_DEFAULT_RATE))
+        limit = int(data['limit']) if data.get('limit') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid replay parameters'}), 400
+
+    # NaN and infinity parse as floats but cannot pace a replay
+    if not math.isfinite(rate) or rate <= 0 or (limit is not None and limit <= 0):
+        return jsonify({'error': 'rate must be a positive number and limit a positive integer'}), 400
+
+    try:
+        matched = dead_letter_query(subscription_id, start, end).count()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error('Error counting dead letters: %s', e)
+        return jsonify({'error': str(e)}), 500
+
+    if not matched:
+        return jsonify({'message': 'No dead letters match the filters'}), 404
+
+    replay_dead_letters.delay(
+        subscription_id=subscription_id,
+        start=start.isoformat() if start else None,
+        end=end.isoformat() if end else None,
+        rate=rate,
+        limit=limit,
+    )
+
+    logger.info('Replay of %s dead letters queued (subscription=%s, rate=%s/s)', matched, subscription_id, rate)
+
+    return jsonify({
+        'status': 'accepted',
+        'matched': matched if limit is None else min(matched, limit),
+        'rate': rate
+    }), 202
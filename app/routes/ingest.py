@@ -1,74 +1,398 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, g
 from .. import db
 from sqlalchemy import inspect
 from sqlalchemy.exc import SQLAlchemyError
-from ..models import Subscription, WebhookPayload
-from ..tasks import process_webhook_delivery
+from ..models import Subscription, WebhookPayload, WebhookStatus, Event, OutboxMessage
+from ..metrics import (
+    INGEST_REJECTED, INGEST_REJECTED_BYTES, INGEST_REQUESTS, INGEST_LATENCY, SIGNATURE_FAILURES, DB_COMMIT_LATENCY, CELERY_PUBLISH_LATENCY, INGEST_DEDUPLICATED,
+    EVENT_FANOUT, EVENT_BACKLOG_SKIPPED, INGEST_FILTERED
+)
+from ..profiling import phase
+from ..idempotency import reserve
+from ..outbox import OUTBOX_ENABLED, outbox_message, publish_deliveries
+from ..queues import parse_priority
+from ..backpressure import sampler, INGEST_RETRY_AFTER
+from ..ratelimit import subscription_limiter, ip_limiter, client_ip
+from ..limits import body_limit
+from ..routing import get_index, MAX_TOPIC_LENGTH
+from ..filters import matches
+from ..payloads import store_payload
+from ..tracing import current_traceparent
+from sqlalchemy import insert
+from datetime import datetime
 import logging
 import hmac
 import hashlib
 import json
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+import time
+import uuid
+import os
+import math
 logger = logging.getLogger(__name__)
 
+# Producer-wide secret for POST /events/<topic>; when set, events must carry X-Hub-Signature-256
+EVENTS_SIGNING_SECRET = os.getenv('EVENTS_SIGNING_SECRET')  # POST /events/<topic> is refused until this is set
+
 # Create a blueprint for the ingest route
 ingest_bp = Blueprint('ingest', __name__)
 
 
+@ingest_bp.before_request
+def start_timer():
+    g.ingest_started = time.perf_counter()
+
+
+@ingest_bp.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    INGEST_REQUESTS.labels(endpoint, str(response.status_code)).inc()
+    if 'ingest_started' in g:
+        INGEST_LATENCY.labels(endpoint).observe(time.perf_counter() - g.ingest_started)
+    return response
+
+
+@ingest_bp.teardown_request
+def release_idempotency_key(exc=None):
+    # Requests that did not get as far as queueing their webhook give the key back
+    reservation = g.pop('idempotency', None)
+    if reservation is not None:
+        reservation.release()
+
+
+def rate_limit(sub_id=None):
+    """
+    The 429 for a producer over its rate limit (app.ratelimit), otherwise None.
+    Without `sub_id` this charges the client IP's bucket, which every ingest
+    route does first. With it, the subscription's bucket is charged; routes do
+    that only once the request is authenticated, so unsigned requests cannot
+    use up a subscription's rate.
+    """
+    with phase('rate_limit'):
+        if sub_id is None:
+            reason = 'ip_rate'
+            wait = ip_limiter.acquire(client_ip(request))
+        else:
+            reason = 'subscription_rate'
+            wait = subscription_limiter.acquire(str(sub_id))
+    if not wait:
+        return None
+    INGEST_REJECTED.labels(reason).inc()
+    return jsonify({'error': 'Rate limit exceeded, retry later', 'reason': reason}), 429, \
+        {'Retry-After': str(max(1, math.ceil(wait)))}
+
+
+def admit(sub_id=None):
+    """
+    The 429 to send when ingest is over capacity (app.backpressure), otherwise None.
+    """
+    with phase('admission'):
+        reason = sampler.check(sub_id)
+    if reason is None:
+        return None
+    INGEST_REJECTED.labels(reason).inc()
+    if reason == 'queue_depth':
+        message = 'Delivery queue is full, retry later'
+    else:
+        message = 'Too many undelivered webhooks for this subscription, retry later'
+    return jsonify({'error': message, 'reason': reason}), 429, {'Retry-After': str(INGEST_RETRY_AFTER)}
+
+
+def limit_body(sub_id=None):
+    """
+    Apply the body size limit (app.limits) before the body is buffered. A
+    declared Content-Length over the limit is refused without reading. A
+    chunked body is read here, at most one byte past the limit, so an oversized
+    stream is cut off instead of buffered. Returns the 413, otherwise None.
+    """
+    with phase('body_limit'):
+        limit = body_limit(sub_id)
+        if request.content_length is not None:
+            if request.content_length <= limit:
+                return None
+            INGEST_REJECTED_BYTES.labels('content_length').inc(request.content_length)
+        else:
+            # Werkzeug stops reading a stream at max_content_length without an
+            # error, so read one byte more to tell a full body from a cut-off one
+            request.max_content_length = limit + 1
+            received = len(request.get_data())
+            if received <= limit:
+                return None
+            INGEST_REJECTED_BYTES.labels('streamed').inc(received)
+    INGEST_REJECTED.labels('body_too_large').inc()
+    # Connection: close, so the unread rest of the body is not parsed as the next request
+    return jsonify({'error': f'Request body exceeds {limit} bytes', 'reason': 'body_too_large'}), 413, \
+        {'Connection': 'close'}
+
+
+def deduplicate(sub_id, payload_bytes, accepted_body=None):
+    """
+    Check the request against the subscription's dedup window (Idempotency-Key
+    header or payload hash). Returns the response to send instead of ingesting
+    when the request repeats one already seen, otherwise None. `accepted_body`
+    builds that response from the id the original request was accepted as.
+    """
+    with phase('deduplicate'):
+        g.idempotency = reserve(
+            sub_id,
+            request.headers.get('Idempotency-Key'),
+            payload_bytes,
+            request.headers.get('X-Hub-Signature-256')
+        )
+    outcome = g.idempotency.outcome
+    if outcome in ('new', 'skip'):
+        return None
+
+    INGEST_DEDUPLICATED.labels(outcome).inc()
+    if outcome == 'mismatch':
+        return jsonify({'error': 'Idempotency-Key was already used with a different payload'}), 422
+    if outcome == 'in_progress':
+        return jsonify({'error': 'A request with this Idempotency-Key is still being processed'}), 409, {'Retry-After': '1'}
+
+    logger.info("Duplicate request for %s answered with %s", sub_id, g.idempotency.webhook_id)
+    if accepted_body is not None:
+        return jsonify(accepted_body(g.idempotency.webhook_id)), 202, {'Idempotent-Replayed': 'true'}
+    return jsonify({
+        'status': 'accepted',
+        'webhook_id': g.idempotency.webhook_id,
+        'subscription_id': sub_id
+    }), 202, {'Idempotent-Replayed': 'true'}
+
+
+def accept_webhook(sub_id, payload, priority=None):
+    """
+    Store the webhook and queue its delivery. With the outbox (the default) the
+    delivery is queued by an outbox row committed together with the webhook and
+    published by the relay; in 'direct' mode it is published here after commit.
+    `priority` (app.queues) lets urgent webhooks overtake others in the delivery lane.
+    """
+    webhook_payload = WebhookPayload(
+        subscription_id=int(sub_id),
+        payload_hash=store_payload(payload),
+    )
+    db.session.add(webhook_payload)
+    db.session.add(WebhookStatus(webhook=webhook_payload, subscription_id=int(sub_id), state='pending'))
+    if OUTBOX_ENABLED:
+        db.session.add(outbox_message(webhook_payload, priority))
+    with phase('db_commit'), DB_COMMIT_LATENCY.labels('ingest').time():
+        db.session.commit()
+    webhook_id = webhook_payload.id
+    
+    if not OUTBOX_ENABLED:
+        with phase('celery_publish'), CELERY_PUBLISH_LATENCY.labels('process_webhook_delivery').time():
+            publish_deliveries([(webhook_id, None, priority)])
+    g.idempotency.complete(webhook_id)
+    sampler.accepted([sub_id])
+        
+    logger.info("Webhook %s received for subscription %s and queued for delivery", webhook_id, sub_id)
+    
+    return jsonify({
+        'status': 'accepted',
+        'webhook_id': webhook_id,
+        'subscription_id': sub_id
+    }), 202
+
+
+def filtered(sub_id, subscription, payload):
+    """
+    The response for a payload the subscription's filter rejects, or None to
+    ingest it. Rejected payloads never reach the database or the broker.
+    """
+    if subscription.filter is None:
+        return None
+    with phase('filter'):
+        accepted = matches(subscription.filter, payload, sub_id)
+    if accepted:
+        return None
+    INGEST_FILTERED.labels('ingest').inc()
+    logger.debug("Webhook for subscription %s dropped by its filter", sub_id)
+    return jsonify({
+        'status': 'filtered',
+        'webhook_id': None,
+        'subscription_id': sub_id
+    }), 202
+
+
+def accept_event(topic, payload, subscription_ids, priority=None, skipped=0):
+    """
+    Store an event once and fan it out: one webhook, status row and outbox row
+    per subscription, written with multi-row inserts in a single transaction.
+    The event and its webhooks all reference one payload blob. `skipped` is the
+    number of subscriptions left out for being over their backlog.
+    """
+    now = datetime.utcnow()
+    digest = store_payload(payload)
+    event = Event(id=str(uuid.uuid4()), topic=topic, payload_hash=digest, received_at=now)
+    webhook_ids = [str(uuid.uuid4()) for _ in subscription_ids]
+    traceparent = current_traceparent()
+
+    db.session.add(event)
+    db.session.execute(insert(WebhookPayload), [
+        {'id': webhook_id, 'subscription_id': subscription_id, 'payload_hash': digest, 'event_id': event.id,
+         'received_at': now}
+        for webhook_id, subscription_id in zip(webhook_ids, subscription_ids)
+    ])
+    db.session.execute(insert(WebhookStatus), [
+        {'webhook_id': webhook_id, 'subscription_id': subscription_id, 'state': 'pending', 'attempt_count': 0,
+         'updated_at': now}
+        for webhook_id, subscription_id in zip(webhook_ids, subscription_ids)
+    ])
+    if OUTBOX_ENABLED:
+        db.session.execute(insert(OutboxMessage), [
+            {'webhook_id': webhook_id, 'traceparent': traceparent, 'priority': priority, 'created_at': now}
+            for webhook_id in webhook_ids
+        ])
+    with phase('db_commit'), DB_COMMIT_LATENCY.labels('event').time():
+        db.session.commit()
+
+    if not OUTBOX_ENABLED:
+        with phase('celery_publish'), CELERY_PUBLISH_LATENCY.labels('process_webhook_delivery').time():
+            publish_deliveries((webhook_id, None, priority) for webhook_id in webhook_ids)
+    g.idempotency.complete(event.id)
+    sampler.accepted(subscription_ids)
+    EVENT_FANOUT.observe(len(webhook_ids))
+
+    logger.info("Event %s on topic %s queued for %s subscriptions", event.id, topic, len(webhook_ids))
+
+    return jsonify({
+        'status': 'accepted',
+        'event_id': event.id,
+        'topic': topic,
+        'deliveries': len(webhook_ids),
+        'skipped': skipped
+    }), 202
+
+
+@ingest_bp.route('/events/<topic>', methods=['POST'])
+def ingest_event(topic):
+    """
+    Publish an event to every subscription listening to `topic` (or to '*').
+    The payload is stored once; each subscriber gets its own webhook, with its
+    own status, attempts and retries.
+    """
+    if not EVENTS_SIGNING_SECRET:
+        # Events fan out to every listener, so they are never accepted unsigned
+        return jsonify({'error': 'Event ingestion is disabled: EVENTS_SIGNING_SECRET is not set'}), 503
+    rejected = rate_limit() or admit() or limit_body()
+    if rejected:
+        return rejected
+
+    payload_bytes = request.get_data()
+    payload = request.get_json()
+
+    if not payload:
+        return jsonify({'error': 'Invalid JSON payload'}), 400
+    try:
+        priority = parse_priority(request.args.get('priority'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(topic) > MAX_TOPIC_LENGTH:
+        return jsonify({'error': 'Topic too long'}), 400
+
+    signature_header = request.headers.get('X-Hub-Signature-256')
+    if not signature_header:
+        SIGNATURE_FAILURES.labels('missing').inc()
+        return jsonify({'error': 'Missing signature header'}), 401
+    with phase('verify_signature'):
+        valid_signature = verify_event_signature(payload_bytes, signature_header)
+    if not valid_signature:
+        logger.warning("Invalid signature for event on topic %s", topic)
+        SIGNATURE_FAILURES.labels('invalid').inc()
+        return jsonify({'error': 'Invalid signature'}), 401
+
+    duplicate = deduplicate(f'topic:{topic}', payload_bytes, lambda event_id: {
+        'status': 'accepted',
+        'event_id': event_id,
+        'topic': topic
+    })
+    if duplicate:
+        return duplicate
+
+    with phase('route'):
+        index = get_index()
+        matched = index.match(topic)
+        subscription_ids = index.accepting(matched, payload)
+    if len(subscription_ids) < len(matched):
+        INGEST_FILTERED.labels('event').inc(len(matched) - len(subscription_ids))
+    # A slow subscriber loses this event rather than holding it back from the others
+    with phase('admission'):
+        backlogged = sampler.backlogged(subscription_ids)
+    if backlogged:
+        EVENT_BACKLOG_SKIPPED.inc(len(backlogged))
+        subscription_ids = tuple(sub_id for sub_id in subscription_ids if sub_id not in backlogged)
+    if not subscription_ids:
+        EVENT_FANOUT.observe(0)
+        return jsonify({
+            'status': 'accepted', 'event_id': None, 'topic': topic, 'deliveries': 0, 'skipped': len(backlogged)
+        }), 202
+
+    return accept_event(topic, payload, subscription_ids, priority, skipped=len(backlogged))
+
+
 @ingest_bp.route('/ingest/bypass-signature/<sub_id>', methods=['POST'])
 def ingest_bypass_signature(sub_id):
     """
     Ingest route that bypasses signature verification.
     This is for testing purposes only and should not be used in production.
     """
+    rejected = rate_limit() or admit(sub_id) or limit_body(sub_id)
+    if rejected:
+        return rejected
+    
     # Get the request data
     payload = request.get_json()
     
     if not payload:
         return jsonify({'error': 'Invalid JSON payload'}), 400
+    try:
+        priority = parse_priority(request.args.get('priority'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
-        subscription = Subscription.query.get(sub_id)
+        with phase('subscription_lookup'):
+            subscription = Subscription.query.get(sub_id)
     except ValueError:
         return jsonify({'error': 'Invalid subscription ID'}), 400
     
     if not subscription:
         return jsonify({'error': 'Subscription not found'}), 404
     
-    # Create webhook payload record
-    webhook_payload = WebhookPayload(
-        subscription_id=int(sub_id),
-        payload=payload,
-    )
-    db.session.add(webhook_payload)
-    db.session.commit()
-    webhook_id = webhook_payload.id
+    duplicate = deduplicate(sub_id, request.get_data())
+    if duplicate:
+        return duplicate
     
-    # Queue for asynchronous processing
-    process_webhook_delivery.delay(webhook_id)
-        
-    logger.info(f"Webhook {webhook_id} received for subscription {sub_id} and queued for delivery")
+    rejected = rate_limit(sub_id)
+    if rejected:
+        return rejected
     
-    return jsonify({
-        'status': 'accepted',
-        'webhook_id': webhook_id,
-        'subscription_id': sub_id
-    }), 202
+    dropped = filtered(sub_id, subscription, payload)
+    if dropped:
+        return dropped
+    
+    return accept_webhook(sub_id, payload, priority)
 
 
 # Define the ingest route
 @ingest_bp.route('/ingest/<sub_id>', methods=['POST'])
 def ingest(sub_id):
+    rejected = rate_limit() or admit(sub_id) or limit_body(sub_id)
+    if rejected:
+        return rejected
+    
     # Get the request data
     payload_bytes = request.get_data()
     payload = request.get_json()
     
     if not payload:
         return jsonify({'error': 'Invalid JSON payload'}), 400
+    try:
+        priority = parse_priority(request.args.get('priority'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
-        subscription = Subscription.query.get(sub_id)
+        with phase('subscription_lookup'):
+            subscription = Subscription.query.get(sub_id)
     except ValueError:
         return jsonify({'error': 'Invalid subscription ID'}), 400
     
@@ -81,37 +405,36 @@ def ingest(sub_id):
         signature_header = request.headers.get('X-Hub-Signature-256')
         
         if not signature_header:
-            logger.warning(f"Webhook for subscription {sub_id} received without signature")
+            logger.warning("Webhook for subscription %s received without signature", sub_id)
+            SIGNATURE_FAILURES.labels('missing').inc()
             return jsonify({'error': 'Missing signature header for subscription with secret key'}), 401
         
         # Verify the signature
-        valid_signature = verify_signature(payload_bytes, signature_header, subscription)
+        with phase('verify_signature'):
+            valid_signature = verify_signature(payload_bytes, signature_header, subscription)
         
         if not valid_signature:
-            logger.warning(f"Invalid signature for subscription {sub_id}")
+            logger.warning("Invalid signature for subscription %s", sub_id)
+            SIGNATURE_FAILURES.labels('invalid').inc()
             return jsonify({'error': 'Invalid signature'}), 401
         
-        logger.info(f"Signature verified for subscription {sub_id}")
+        logger.info("Signature verified for subscription %s", sub_id)
     
-    # Create webhook payload record
-    webhook_payload = WebhookPayload(
-        subscription_id=int(sub_id),
-        payload=payload,
-    )
-    db.session.add(webhook_payload)
-    db.session.commit()
-    webhook_id = webhook_payload.id
+    # Only once the request is authenticated, as for events: an unsigned request
+    # must not reserve a key, nor learn whether it was used
+    duplicate = deduplicate(sub_id, payload_bytes)
+    if duplicate:
+        return duplicate
     
-    # Queue for asynchronous processing
-    process_webhook_delivery.delay(webhook_id)
-        
-    logger.info(f"Webhook {webhook_id} received for subscription {sub_id} and queued for delivery")
+    rejected = rate_limit(sub_id)
+    if rejected:
+        return rejected
     
-    return jsonify({
-        'status': 'accepted',
-        'webhook_id': webhook_id,
-        'subscription_id': sub_id
-    }), 202
+    dropped = filtered(sub_id, subscription, payload)
+    if dropped:
+        return dropped
+    
+    return accept_webhook(sub_id, payload, priority)
 
 def verify_signature(payload_bytes, signature_header, subscription):
     """
@@ -124,7 +447,7 @@ def verify_signature(payload_bytes, signature_header, subscription):
     
     # Make sure we have a secret to verify with
     if not subscription.secret:  # Use secret, not secret_hash
-        logger.error(f"Missing secret for subscription {subscription.id}")
+        logger.error("Missing secret for subscription %s", subscription.id)
         return False
     
     # Calculate HMAC signature using the raw secret
@@ -138,6 +461,20 @@ def verify_signature(payload_bytes, signature_header, subscription):
     return hmac.compare_digest(expected_signature, provided_signature)
 
 
+def verify_event_signature(payload_bytes, signature_header):
+    """
+    Verify an event's signature against EVENTS_SIGNING_SECRET
+    """
+    if not signature_header.startswith('sha256='):
+        return False
+    expected_signature = hmac.new(
+        key=EVENTS_SIGNING_SECRET.encode('utf-8'),
+        msg=payload_bytes,
+        digestmod=hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected_signature, signature_header[7:])
+
+
 @ingest_bp.route('/ingest/getsignature', methods=['POST'])
 def generate_signature():
     """
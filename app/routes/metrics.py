@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+from ..metrics import render
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = render()
+    return Response(body, status=200, content_type=content_type)
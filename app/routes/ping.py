@@ -1,29 +1,52 @@
 from flask import Blueprint, jsonify
 from .. import db
+from ..health import get_probe
 from sqlalchemy import inspect
 
 ping_bp = Blueprint('ping', __name__)
 
+# The schema only changes on deploy (or /ping/cleardb), so inspect it once per process
+_table_names = None
+
+
 @ping_bp.route('/ping', methods=['GET'])
 def ping():
-    # Get the inspector to query for table names
-    inspector = inspect(db.engine)
-    
-    # Get all table names
-    table_names = inspector.get_table_names()
+    global _table_names
+    if _table_names is None:
+        # Get the inspector to query for table names
+        _table_names = inspect(db.engine).get_table_names()
     
     return jsonify({
         'message': 'pong',
         'database': {
-            'tables': table_names
+            'tables': _table_names
         }
     }), 200
+
+
+@ping_bp.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Liveness: the process is up and serving requests. Touches no dependencies.
+    """
+    return jsonify({'status': 'ok'}), 200
+
+
+@ping_bp.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    Readiness: database, Redis and broker were reachable in the latest background check.
+    """
+    ready, body = get_probe().status()
+    return jsonify(body), 200 if ready else 503
     
     
 @ping_bp.route('/ping/cleardb', methods=['GET'])
 def clear_db():
+    global _table_names
     db.drop_all()
     db.create_all()
+    _table_names = None
     return jsonify({
         'message': 'Database cleared and recreated'
-    }), 200
\ No newline at end of file
+    }), 200
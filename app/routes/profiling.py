@@ -0,0 +1,67 @@
+from flask import Blueprint, jsonify, request
+from ..profiling import recent_profiles, summarize, sample_rate, set_sample_rate, PROFILE_BUFFER_SIZE
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Create a blueprint for the profiling routes
+profiling_bp = Blueprint('profiling', __name__, url_prefix='/debug/profiles')
+
+
+@profiling_bp.route('', methods=['GET'])
+def get_profiles():
+    """
+    Per-phase timing breakdown of recently sampled requests and tasks.
+    Optional query params: limit (number of recent profiles to summarize),
+    raw=1 to also return the individual profiles.
+    """
+    try:
+        limit = min(int(request.args.get('limit', PROFILE_BUFFER_SIZE)), PROFILE_BUFFER_SIZE)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    profiles = recent_profiles(limit)
+    response = {
+        'sample_rate': sample_rate(),
+        'profiles': len(profiles),
+        'summary': summarize(profiles),
+    }
+    if request.args.get('raw') == '1':
+        response['recent'] = profiles
+    return jsonify(response), 200
+
+
+@profiling_bp.route('/config', methods=['POST'])
+def configure_profiling():
+    """
+    Change the profiling sample rate for every web and worker process.
+    A null sample_rate restores the PROFILE_SAMPLE_RATE default.
+
+    Example request:
+    ```
+    {
+        "sample_rate": 0.01
+    }
+    ```
+    """
+    data = request.get_json(silent=True) or {}
+    if 'sample_rate' not in data:
+        return jsonify({'error': 'Missing sample_rate field'}), 400
+
+    rate = data['sample_rate']
+    if rate is not None:
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'sample_rate must be a number'}), 400
+        if not 0 <= rate <= 1:
+            return jsonify({'error': 'sample_rate must be between 0 and 1'}), 400
+
+    try:
+        set_sample_rate(rate)
+    except Exception as e:
+        logger.error('Error updating profiling sample rate: %s', e)
+        return jsonify({'error': str(e)}), 503
+
+    logger.info('Profiling sample rate set to %s', rate)
+    return jsonify({'sample_rate': sample_rate()}), 200
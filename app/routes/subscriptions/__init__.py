@@ -3,4 +3,5 @@ subscriptions_bp = Blueprint('subscriptions', __name__, url_prefix='/subscriptio
 from .createsubscription import *
 from .getSubscriptions import *
 from .updateSubsctiption import *
-from .deleteSubscription import *
\ No newline at end of file
+from .deleteSubscription import *
+from .getSubscriptionStats import *
\ No newline at end of file
@@ -2,6 +2,9 @@ from flask import Blueprint, jsonify, request
 from . import subscriptions_bp
 from ... import db
 from ...models import Subscription
+from ...routing import validate_topics, routes_changed
+from ...filters import validate_filter
+from ...limits import validate_body_limit
 from sqlalchemy.exc import SQLAlchemyError
 import os
 
@@ -20,9 +23,16 @@ def create_subscription():
     url = data.get('url')
     secret = data.get('secret')
     
+    try:
+        topics = validate_topics(data.get('topics'))
+        filter_spec = validate_filter(data.get('filter'))
+        max_body_bytes = validate_body_limit(data.get('max_body_bytes'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     try:
         # Create new subscription
-        subscription = Subscription(url=url)
+        subscription = Subscription(url=url, topics=topics, filter=filter_spec, max_body_bytes=max_body_bytes)
         
         # Handle secret with proper hashing
         if secret:
@@ -34,12 +44,17 @@ def create_subscription():
             
         db.session.add(subscription)
         db.session.commit()
+        if topics:
+            routes_changed()
         
         response_data = {
             'message': 'Subscription created successfully',
             'subscription': {
                 'id': subscription.id,
                 'url': subscription.url,
+                'topics': subscription.topics or [],
+                'filter': subscription.filter,
+                'max_body_bytes': subscription.max_body_bytes,
                 'created_at': subscription.created_at.isoformat()
             }
         }
@@ -1,6 +1,8 @@
 from ... import db
 from flask import Blueprint, jsonify, request
 from ...models import Subscription
+from ...routing import routes_changed
+from ...filters import forget_filter
 from . import subscriptions_bp
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -20,8 +22,12 @@ def delete_subscription():
         if not subscription:
             return jsonify({'error': 'Subscription not found'}), 404
 
+        had_topics = bool(subscription.topics)
         db.session.delete(subscription)
         db.session.commit()
+        if had_topics:
+            routes_changed()
+        forget_filter(data['id'])
         
         return jsonify({'message': 'Subscription deleted successfully'}), 200
     except SQLAlchemyError as e:
@@ -0,0 +1,64 @@
+from ... import db
+from flask import jsonify, request
+from ...models import Subscription
+from ...rollups import parse_window, subscription_stats, slowest_subscriptions, LATENCY_METRICS
+from . import subscriptions_bp
+from sqlalchemy.exc import SQLAlchemyError
+import logging
+
+logger = logging.getLogger(__name__)
+
+@subscriptions_bp.route('/<int:sub_id>/stats', methods=['GET'])
+def get_subscription_stats(sub_id):
+    """
+    Success rate, attempt histogram and latency percentiles for a subscription.
+    `window` accepts minutes or a suffixed value like 15m, 6h, 7d (default 1h);
+    several comma-separated windows can be requested at once.
+    """
+    try:
+        windows = [parse_window(value) for value in request.args.get('window', '1h').split(',')]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        if not db.session.get(Subscription, sub_id):
+            return jsonify({'error': 'Subscription not found'}), 404
+
+        stats = [subscription_stats(sub_id, minutes) for minutes in windows]
+        return jsonify(stats[0] if len(stats) == 1 else {'windows': stats}), 200
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error('Error fetching stats for subscription %s: %s', sub_id, e)
+        return jsonify({'error': str(e)}), 500
+
+
+@subscriptions_bp.route('/stats/latency', methods=['GET'])
+def get_latency_ranking():
+    """
+    Subscriptions ranked by latency percentile, slowest first.
+    `metric` is http (subscriber response time), queue (time waiting for a worker)
+    or e2e (ingest to end of attempt); `quantile` defaults to 95.
+    """
+    metric = request.args.get('metric', 'http')
+    if metric not in LATENCY_METRICS:
+        return jsonify({'error': f"metric must be one of {', '.join(LATENCY_METRICS)}"}), 400
+
+    try:
+        window = parse_window(request.args.get('window', '1h'))
+        limit = min(int(request.args.get('limit', 10)), 100)
+        quantile = int(request.args.get('quantile', 95))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+    if not 0 < quantile < 100:
+        return jsonify({'error': 'quantile must be between 1 and 99'}), 400
+
+    try:
+        ranking = slowest_subscriptions(metric, window, limit=limit, quantile=quantile)
+        return jsonify({'metric': metric, 'window_minutes': window, 'subscriptions': ranking}), 200
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error('Error ranking subscriptions by %s latency: %s', metric, e)
+        return jsonify({'error': str(e)}), 500
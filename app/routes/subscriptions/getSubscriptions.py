@@ -1,28 +1,25 @@
 from ... import db
 from flask import Blueprint, jsonify, request
-from ...models import Subscription
+from ...rows import subscription_rows
+from ...serialization import json_response
 from . import subscriptions_bp
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 @subscriptions_bp.route('/getsubscriptions', methods=['GET'])
 def get_subscriptions():
     try:
         logger.info('Fetching all subscriptions')
-        subscriptions = Subscription.query.all()
-        if not subscriptions:
+        subscription_list = subscription_rows()
+        if not subscription_list:
             logger.warning('No subscriptions found')
             return jsonify({'message': 'No subscriptions found'}), 404
         
-        logger.info(f'Found {len(subscriptions)} subscriptions')
-        subscription_list = [subscription.to_dict() for subscription in subscriptions]
-        logger.info(f'Subscription list: {subscription_list}')
-        return jsonify({'subscriptions': subscription_list}), 200
+        logger.info('Found %s subscriptions', len(subscription_list))
+        return json_response({'subscriptions': subscription_list})
     except SQLAlchemyError as e:
         db.session.rollback()
-        logger.error(f'Error fetching subscriptions: {str(e)}')
+        logger.error('Error fetching subscriptions: %s', e)
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -1,8 +1,12 @@
 from ... import db
 from flask import Blueprint, jsonify, request
 from ...models import Subscription
+from ...routing import validate_topics, routes_changed
+from ...filters import validate_filter, forget_filter
+from ...limits import validate_body_limit, forget_body_limit
 from . import subscriptions_bp
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import flag_modified
 
 @subscriptions_bp.route('/updatesubscription', methods=['PUT'])
 def update_subscription():
@@ -15,6 +19,16 @@ def update_subscription():
     if not all(field in data for field in required_fields):
         return jsonify({'error': 'Missing required fields'}), 400
 
+    try:
+        if 'topics' in data:
+            data['topics'] = validate_topics(data['topics'])
+        if 'filter' in data:
+            data['filter'] = validate_filter(data['filter'])
+        if 'max_body_bytes' in data:
+            data['max_body_bytes'] = validate_body_limit(data['max_body_bytes'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         subscription = Subscription.query.get(data['id'])
         if not subscription:
@@ -23,7 +37,16 @@ def update_subscription():
         for key, value in data.items():
             if key != 'id':
                 setattr(subscription, key, value)        
+        if 'filter' in data:
+            # The ORM compares JSON with ==, which takes {"a": true} for {"a": 1}
+            flag_modified(subscription, 'filter')
         db.session.commit()
+        if 'topics' in data or 'filter' in data:
+            routes_changed()
+        if 'filter' in data:
+            forget_filter(subscription.id)
+        if 'max_body_bytes' in data:
+            forget_body_limit(subscription.id)
         
         return jsonify({'message': 'Subscription updated successfully', 'data': data}), 200
     except SQLAlchemyError as e:
@@ -0,0 +1,28 @@
+from flask import Blueprint, jsonify
+from .. import db
+from sqlalchemy.exc import SQLAlchemyError
+from ..status import get_webhook_status
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Create a blueprint for per-webhook routes
+webhooks_bp = Blueprint('webhooks', __name__, url_prefix='/webhooks')
+
+
+@webhooks_bp.route('/<webhook_id>/status', methods=['GET'])
+def get_status(webhook_id):
+    """
+    Current delivery state of a webhook, answered from the webhook_status summary row.
+    """
+    try:
+        status = get_webhook_status(webhook_id)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error('Error fetching status for webhook %s: %s', webhook_id, e)
+        return jsonify({'error': str(e)}), 500
+
+    if not status:
+        return jsonify({'error': 'Webhook not found'}), 404
+
+    return jsonify(status), 200
@@ -0,0 +1,132 @@
+"""
+Topic routing for POST /events/<topic>.
+
+Each process keeps an in-memory index of topic -> subscription ids, so routing
+an event costs a dictionary lookup. Subscription create/update/delete calls
+routes_changed(), which increments a version counter in Redis. Other processes
+compare their index's version with it at most every ROUTING_REFRESH_INTERVAL
+seconds and rebuild from Postgres when it has moved. Every index is also rebuilt
+after ROUTING_MAX_AGE seconds, as a safety net for missed increments.
+
+The index also holds each routed subscription's compiled filter, so filtering
+a fan-out needs no extra queries.
+"""
+from . import db
+from .models import Subscription
+from .filters import compile_filter
+from .redis_client import get_redis
+from sqlalchemy import select
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+ROUTING_REFRESH_INTERVAL = float(os.getenv('ROUTING_REFRESH_INTERVAL', '1.0'))  # seconds between version checks
+ROUTING_MAX_AGE = float(os.getenv('ROUTING_MAX_AGE', '60'))  # seconds before an index is rebuilt regardless
+ROUTING_VERSION_KEY = 'routing:version'
+
+MAX_TOPIC_LENGTH = 255
+WILDCARD = '*'  # a subscription listening to '*' receives every event
+
+
+class RoutingIndex:
+    __slots__ = ('routes', 'filters', 'version', 'built_at', 'checked_at')
+
+    def __init__(self, routes, filters, version):
+        self.routes = routes
+        self.filters = filters
+        self.version = version
+        self.built_at = self.checked_at = time.monotonic()
+
+    def match(self, topic):
+        """Ids of the subscriptions that receive `topic`, in ascending order."""
+        exact = self.routes.get(topic, ())
+        wildcard = self.routes.get(WILDCARD, ())
+        if not wildcard:
+            return exact
+        return tuple(sorted(set(exact).union(wildcard)))
+
+    def accepting(self, subscription_ids, payload):
+        """The subscriptions among `subscription_ids` whose filter accepts `payload`."""
+        filters = self.filters
+        if not filters:
+            return subscription_ids
+        return tuple(
+            subscription_id for subscription_id in subscription_ids
+            if subscription_id not in filters or filters[subscription_id](payload)
+        )
+
+
+def validate_topics(topics):
+    """A subscription's topics as a de-duplicated list; raises ValueError if malformed."""
+    if topics is None:
+        return None
+    if not isinstance(topics, list) or not all(
+            isinstance(topic, str) and 0 < len(topic) <= MAX_TOPIC_LENGTH for topic in topics):
+        raise ValueError(f'topics must be a list of strings of 1 to {MAX_TOPIC_LENGTH} characters')
+    return list(dict.fromkeys(topics))
+
+
+def build_index(version):
+    routes = {}
+    filters = {}
+    rows = db.session.execute(
+        select(Subscription.id, Subscription.topics, Subscription.filter).where(Subscription.topics.isnot(None))
+    )
+    for subscription_id, topics, spec in rows:
+        for topic in topics or ():
+            routes.setdefault(topic, []).append(subscription_id)
+        if topics and spec is not None:
+            try:
+                filters[subscription_id] = compile_filter(spec)
+            except ValueError as e:
+                logger.error('Ignoring invalid filter on subscription %s: %s', subscription_id, e)
+    return RoutingIndex({topic: tuple(sorted(ids)) for topic, ids in routes.items()}, filters, version)
+
+
+def current_version():
+    version = get_redis().get(ROUTING_VERSION_KEY)
+    return int(version) if version is not None else 0
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """This process's routing index, rebuilt if subscriptions changed since it was built."""
+    global _index
+    index = _index
+    now = time.monotonic()
+    if index is not None and now - index.checked_at < ROUTING_REFRESH_INTERVAL:
+        return index
+
+    with _lock:
+        index = _index
+        if index is not None and now - index.checked_at < ROUTING_REFRESH_INTERVAL:
+            return index
+        try:
+            version = current_version()
+        except Exception as e:
+            logger.warning('Could not read routing version: %s', e)
+            version = index.version if index is not None else None
+        if index is None or version != index.version or now - index.built_at > ROUTING_MAX_AGE:
+            index = build_index(version)
+            _index = index
+            logger.info('Routing index rebuilt: %s topics (version %s)', len(index.routes), version)
+        else:
+            index.checked_at = now
+    return index
+
+
+def routes_changed():
+    """Call after committing a change to subscriptions or their topics."""
+    global _index
+    _index = None
+    try:
+        get_redis().incr(ROUTING_VERSION_KEY)
+    except Exception as e:
+        logger.warning('Could not publish routing change; other processes will pick it up within %ss: %s',
+                       ROUTING_MAX_AGE, e)
@@ -0,0 +1,113 @@
+"""
+Hot read paths on Core column selects.
+
+Loading ORM entities costs an object, instance state and an identity-map entry
+per row, and the listings then copy each one into a dict with to_dict(). The
+reads below select only the columns they need and build the response dicts
+(or a small slotted record for the delivery task) straight from the row
+tuples. The output is the same as to_dict().
+
+Statements are built once at import, with bind parameters where they vary,
+so each call only looks up SQLAlchemy's compiled-statement cache instead of
+constructing and compiling the select again.
+"""
+from . import db
+from .models import Subscription, DeliveryAttempt, WebhookPayload, WebhookStatus, PayloadBlob
+from sqlalchemy import select, bindparam
+
+
+def iso(value):
+    return value.isoformat() if value else None
+
+
+SUBSCRIPTIONS = select(
+    Subscription.id, Subscription.url, Subscription.secret_hash, Subscription.salt, Subscription.topics,
+    Subscription.filter, Subscription.max_body_bytes, Subscription.created_at
+)
+
+DELIVERY_LOGS = select(
+    DeliveryAttempt.id, DeliveryAttempt.webhook_id, DeliveryAttempt.subscription_id, DeliveryAttempt.attempt_number,
+    DeliveryAttempt.status, DeliveryAttempt.timestamp, DeliveryAttempt.status_code, DeliveryAttempt.error_message,
+    DeliveryAttempt.response_body, DeliveryAttempt.duration_ms, DeliveryAttempt.queue_ms, DeliveryAttempt.e2e_ms
+).order_by(DeliveryAttempt.timestamp.desc())
+
+# Everything one delivery needs, in one round trip
+DELIVERY = (
+    select(
+        WebhookPayload.id, WebhookPayload.subscription_id, WebhookPayload.received_at, PayloadBlob.body,
+        Subscription.id, Subscription.url, Subscription.secret, WebhookStatus.state
+    )
+    .join(PayloadBlob, PayloadBlob.hash == WebhookPayload.payload_hash)
+    .outerjoin(Subscription, Subscription.id == WebhookPayload.subscription_id)
+    .outerjoin(WebhookStatus, WebhookStatus.webhook_id == WebhookPayload.id)
+    .where(WebhookPayload.id == bindparam('webhook_id'))
+)
+
+
+def subscription_rows():
+    """Every subscription, as Subscription.to_dict() would give it."""
+    return [
+        {
+            'id': id,
+            'url': url,
+            'secret_hash': secret_hash,
+            'salt': salt,
+            'topics': topics or [],
+            'filter': filter_spec,
+            'max_body_bytes': max_body_bytes,
+            'created_at': iso(created_at),
+        }
+        for id, url, secret_hash, salt, topics, filter_spec, max_body_bytes, created_at
+        in db.session.execute(SUBSCRIPTIONS)
+    ]
+
+
+def delivery_log_rows():
+    """Every delivery attempt, newest first, as DeliveryAttempt.to_dict() would give it."""
+    return [
+        {
+            'id': id,
+            'webhook_id': webhook_id,
+            'subscription_id': subscription_id,
+            'attempt_number': attempt_number,
+            'status': status,
+            'timestamp': iso(timestamp),
+            'status_code': status_code,
+            'error_message': error_message,
+            'response_body': response_body,
+            'duration_ms': duration_ms,
+            'queue_ms': queue_ms,
+            'e2e_ms': e2e_ms,
+        }
+        for (id, webhook_id, subscription_id, attempt_number, status, timestamp, status_code, error_message,
+             response_body, duration_ms, queue_ms, e2e_ms)
+        in db.session.execute(DELIVERY_LOGS)
+    ]
+
+
+class Delivery:
+    """The webhook and subscription columns process_webhook_delivery reads."""
+
+    __slots__ = ('id', 'subscription_id', 'received_at', 'body', 'url', 'secret', 'state')
+
+    def __init__(self, id, subscription_id, received_at, body, url, secret, state):
+        self.id = id
+        self.subscription_id = subscription_id
+        self.received_at = received_at
+        self.body = body
+        self.url = url
+        self.secret = secret
+        self.state = state  # webhook_status state, or None
+
+
+def load_delivery(webhook_id):
+    """
+    (Delivery, subscription found) for a webhook, or (None, False) if it does
+    not exist. The body is read from the webhook's payload blob, the state from
+    its webhook_status row.
+    """
+    row = db.session.execute(DELIVERY, {'webhook_id': webhook_id}).first()
+    if row is None:
+        return None, False
+    id, subscription_id, received_at, body, found_id, url, secret, state = row
+    return Delivery(id, subscription_id, received_at, body, url, secret, state), found_id is not None
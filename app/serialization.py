@@ -0,0 +1,89 @@
+"""
+Serialization for HTTP responses and broker messages.
+
+Responses go through the app's JSON provider. With JSON_PROVIDER=orjson (the
+default), OrjsonProvider encodes straight to UTF-8 bytes; JSON_PROVIDER=json
+keeps Flask's stdlib provider. The output matches Flask's except that keys keep
+their insertion order and non-ASCII text is not escaped. Dates are still sent
+in Flask's HTTP date format.
+
+Request bodies are always parsed with the stdlib json module. orjson turns
+integers beyond 64 bits into floats and rejects NaN and out-of-range numbers
+such as 1e400, which would change or refuse payloads that ingest must store
+as sent. Such payloads are also encoded with the stdlib when orjson refuses
+them.
+
+List endpoints return json_response(), which encodes the body into the
+response in one call and skips jsonify's argument handling and str round
+trip. Their rows are plain dicts, built from Core selects (app.rows) or by
+to_dict(), which orjson encodes natively.
+
+Celery messages use CELERY_SERIALIZER: json (the default) or msgpack, which
+needs the msgpack package. Workers accept both, so the setting can be changed
+one process at a time.
+"""
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+import os
+import json
+import orjson
+
+JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'orjson')  # orjson or json (Flask's default provider)
+CELERY_SERIALIZER = os.getenv('CELERY_SERIALIZER', 'json')  # json or msgpack
+CELERY_ACCEPT_CONTENT = ['json', 'msgpack']
+
+# Datetimes go to the default hook so they keep Flask's format; int keys become strings as with json
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider encoding with orjson. Parsing, and calls with stdlib json options, use json."""
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode()
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits
+            return super().dumps(obj)
+
+    def encode(self, obj):
+        option = ORJSON_OPTIONS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option) + b'\n'
+        except orjson.JSONEncodeError:
+            return super().dumps(obj).encode() + b'\n'
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj), mimetype=self.mimetype)
+
+
+def init_json(app):
+    if JSON_PROVIDER == 'orjson':
+        app.json = OrjsonProvider(app)
+
+
+def dumps(obj):
+    """`obj` as JSON bytes, with the app's provider when there is an app."""
+    provider = current_app.json if current_app else None
+    if isinstance(provider, OrjsonProvider):
+        return provider.encode(obj)
+    if provider is not None:
+        return provider.dumps(obj).encode() + b'\n'
+    return json.dumps(obj, default=DefaultJSONProvider.default).encode() + b'\n'
+
+
+def json_response(obj, status=200, headers=None):
+    """A JSON response built from `obj` in one encode."""
+    return current_app.response_class(dumps(obj), status=status, headers=headers, mimetype='application/json')
+
+
+def configure_celery(celery):
+    celery.conf.task_serializer = CELERY_SERIALIZER
+    celery.conf.accept_content = CELERY_ACCEPT_CONTENT
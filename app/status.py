@@ -0,0 +1,80 @@
+from . import db
+from .models import WebhookStatus, dialect_insert
+from .redis_client import get_redis
+from datetime import datetime
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds to cache status lookups in Redis; 0 disables the cache
+STATUS_CACHE_TTL = int(os.getenv('WEBHOOK_STATUS_CACHE_TTL', '0'))
+STATUS_CACHE_PREFIX = 'webhook_status:'
+
+
+def status_values(webhook_id, subscription_id, state, attempt_count, last_status_code=None,
+                  last_attempt_at=None, next_retry_at=None):
+    return {
+        'webhook_id': webhook_id,
+        'subscription_id': subscription_id,
+        'state': state,
+        'attempt_count': attempt_count,
+        'last_status_code': last_status_code,
+        'last_attempt_at': last_attempt_at,
+        'next_retry_at': next_retry_at,
+        'updated_at': datetime.utcnow(),
+    }
+
+
+def upsert_statuses(rows):
+    """
+    Write status rows in the current session. Upserts so webhooks ingested
+    before the status table existed still get a row on their next attempt.
+    """
+    if not rows:
+        return
+    stmt = dialect_insert(WebhookStatus)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['webhook_id'],
+        set_={
+            column: stmt.excluded[column]
+            for column in ('state', 'attempt_count', 'last_status_code', 'last_attempt_at', 'next_retry_at', 'updated_at')
+        }
+    )
+    db.session.execute(stmt, rows)
+
+
+def invalidate_statuses(webhook_ids):
+    if not STATUS_CACHE_TTL or not webhook_ids:
+        return
+    try:
+        get_redis().delete(*[STATUS_CACHE_PREFIX + webhook_id for webhook_id in webhook_ids])
+    except Exception as e:
+        logger.warning('Could not invalidate cached webhook status: %s', e)
+
+
+def get_webhook_status(webhook_id):
+    """
+    Status for one webhook as a dict, or None if it is unknown.
+    Reads through the Redis cache when WEBHOOK_STATUS_CACHE_TTL is set.
+    """
+    if STATUS_CACHE_TTL:
+        try:
+            cached = get_redis().get(STATUS_CACHE_PREFIX + webhook_id)
+            if cached:
+                return json.loads(cached)
+        except Exception as e:
+            logger.warning('Webhook status cache read failed: %s', e)
+
+    status = db.session.get(WebhookStatus, webhook_id)
+    if not status:
+        return None
+    result = status.to_dict()
+
+    if STATUS_CACHE_TTL:
+        try:
+            get_redis().set(STATUS_CACHE_PREFIX + webhook_id, json.dumps(result), ex=STATUS_CACHE_TTL)
+        except Exception as e:
+            logger.warning('Webhook status cache write failed: %s', e)
+    return result
@@ -1,87 +1,148 @@
 from celery import Celery
 import os
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import time
 import logging
+from app.queues import (
+    DELIVERY_QUEUE, RETRY_QUEUE, REPLAY_QUEUE, DEFAULT_PRIORITY, BROKER_TRANSPORT_OPTIONS, RETRY_DELAYS
+)
+from app.serialization import configure_celery
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Results are only stored with a result backend and CELERY_STORE_RESULTS=1 (debugging, benchmarks/redis_load.py)
+TASK_IGNORE_RESULT = not (os.getenv('CELERY_RESULT_BACKEND') and os.getenv('CELERY_STORE_RESULTS', '0') == '1')
+
 def make_celery(app_name= __name__):
     redis_url = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
-    return Celery(
+    # Nothing reads task results (delivery outcomes live in delivery_attempts), so the
+    # result backend is off unless explicitly configured, e.g. for debugging.
+    celery = Celery(
         app_name,
         broker=redis_url,
-        backend=redis_url,
+        backend=os.getenv('CELERY_RESULT_BACKEND') or None,
     )
+    celery.conf.task_ignore_result = TASK_IGNORE_RESULT
+    # Logging is configured by the app (queued handler); keep Celery from replacing it
+    celery.conf.worker_hijack_root_logger = False
+    # First attempts have their own lane; retries and replays pick theirs when published (app.queues)
+    celery.conf.task_routes = {'app.tasks.process_webhook_delivery': {'queue': DELIVERY_QUEUE}}
+    celery.conf.task_default_priority = DEFAULT_PRIORITY
+    celery.conf.broker_transport_options = BROKER_TRANSPORT_OPTIONS
+    configure_celery(celery)
+    return celery
 
 celery = make_celery()
 
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', '3600'))  # seconds between retention runs (celery beat)
+BACKLOG_RECONCILE_INTERVAL = float(os.getenv('BACKLOG_RECONCILE_INTERVAL', '300'))  # seconds
+celery.conf.beat_schedule = {
+    'purge-expired-webhooks': {
+        'task': 'app.tasks.purge_expired_webhooks',
+        'schedule': RETENTION_INTERVAL,
+    },
+    'reconcile-subscription-backlog': {
+        'task': 'app.tasks.reconcile_subscription_backlog',
+        'schedule': BACKLOG_RECONCILE_INTERVAL,
+    },
+}
+
 
-RETRY_DELAYS = [10, 30, 60, 300, 900]  # 10s, 30s, 1m, 5m, 15m
 MAX_RETRIES = len(RETRY_DELAYS)
+DELIVERY_TIMEOUT = 10  # seconds
+LEASE_TTL = DELIVERY_TIMEOUT + 20  # seconds; renewed while the delivery runs (app.leases), so only a dead worker's lapses
+
+REPLAY_BATCH_SIZE = int(os.getenv('DLQ_REPLAY_BATCH_SIZE', '500'))
+REPLAY_DEFAULT_RATE = float(os.getenv('DLQ_REPLAY_RATE', '50'))  # webhooks per second
 
-@celery.task(bind=True, max_retries=MAX_RETRIES)
+@celery.task(bind=True, max_retries=MAX_RETRIES, ignore_result=TASK_IGNORE_RESULT)
 def process_webhook_delivery(self, webhook_id):
     
-    from app import db
-    from app.models import WebhookPayload, Subscription, DeliveryAttempt
+    from app.rows import load_delivery
+    from app.attempts import start_attempt, finish_attempt
+    from app.profiling import phase
+    from app.tracing import annotate, current_traceparent
+    from app.leases import acquire_lease
+    
+    logger.info('Processing webhook %s, attempt %s', webhook_id, self.request.retries + 1)
     
-    logger.info(f'Processing webhook {webhook_id}, attempt {self.request.retries +1} ')
+    # Another copy of this message may be running, or may already have delivered it
+    with phase('lease'):
+        lease = acquire_lease(webhook_id, LEASE_TTL)
+    if lease.outcome in ('held', 'delivered'):
+        logger.warning('Skipping webhook %s: %s', webhook_id,
+                       'already being delivered' if lease.outcome == 'held' else 'already delivered')
+        return {'status': 'skipped', 'webhook_id': webhook_id, 'reason': lease.outcome}
+    delivered = False
     
     try:
         
-        webhook = WebhookPayload.query.get(webhook_id) 
+        with phase('load'):
+            webhook, subscription_found = load_delivery(webhook_id)
         if not webhook:
-            logger.error(f'Webhook {webhook_id} not found')
-            return {status: 'error', message: f'Webhook {webhook_id} not found'}
-        
-        subscription = Subscription.query.get(webhook.subscription_id)
-        if not subscription:
-            logger.error(f'Subscription {webhook.subscription_id} not found')
-            return {status: 'error', message: f'Subscription {webhook.subscription_id} not found'}
+            logger.error('Webhook %s not found', webhook_id)
+            return {'status': 'error', 'message': f'Webhook {webhook_id} not found'}
         
-        attempt_number = self.request.retries + 1
+        if webhook.state == 'delivered':
+            # Redis was unavailable, or the delivered guard has expired; fall back to the status row
+            logger.warning('Skipping webhook %s: already delivered', webhook_id)
+            return {'status': 'skipped', 'webhook_id': webhook_id, 'reason': 'delivered'}
         
-        delivery_attempt = DeliveryAttempt(
-            webhook_id=webhook.id,
-            subscription_id=subscription.id,
-            attempt_number=attempt_number,
-            status='in_progress'
-        )
+        if not subscription_found:
+            logger.error('Subscription %s not found', webhook.subscription_id)
+            return {'status': 'error', 'message': f'Subscription {webhook.subscription_id} not found'}
         
-        db.session.add(delivery_attempt)
-        db.session.commit()
+        attempt_number = self.request.retries + 1
+        annotate({'webhook.id': webhook.id, 'subscription.id': webhook.subscription_id, 'delivery.attempt': attempt_number})
+        with phase('start_attempt'):
+            attempt = start_attempt(
+                webhook.id, webhook.subscription_id, attempt_number, DELIVERY_TIMEOUT + 5,
+                queued_since=queued_since(self.request, webhook),
+                received_at=webhook.received_at
+            )
+        status_code = None
+        duration_ms = None
+        started = time.perf_counter()
         
         try:
             
-            response = requests.post(
-                subscription.url,
-                json=webhook.payload,
-                headers={'Content-Type': 'application/json', 'X-Hub-Signature': subscription.secret},
-                timeout=10
-            )
+            with phase('http'):
+                headers = {'Content-Type': 'application/json', 'X-Hub-Signature': webhook.secret}
+                traceparent = current_traceparent()
+                if traceparent:
+                    # Lets a traced subscriber continue the trace
+                    headers['traceparent'] = traceparent
+                response = requests.post(
+                    webhook.url,
+                    json=webhook.body,
+                    headers=headers,
+                    timeout=DELIVERY_TIMEOUT
+                )
+                annotate({'http.response.status_code': response.status_code})
             
-            delivery_attempt.status_code = response.status_code
+            duration_ms = int((time.perf_counter() - started) * 1000)
+            status_code = response.status_code
 
             if 200 <= response.status_code < 300:
-                delivery_attempt.status = 'success'
-                delivery_attempt.response_body = response.text
-                db.session.commit()
-                logger.info(f'Webhook {webhook_id} delivered successfully')
+                delivered = True
+                with phase('record'):
+                    finish_attempt(
+                        attempt, 'success', 'delivered',
+                        status_code=status_code,
+                        response_body=response.text,
+                        duration_ms=duration_ms
+                    )
+                logger.info('Webhook %s delivered successfully', webhook_id)
                 return {
                     'status': 'success', 
                     'message': f'Webhook {webhook_id} delivered successfully',
-                    'subscription_id': subscription.id,
+                    'subscription_id': webhook.subscription_id,
                     }
                 
             
             
             error_message = f"Target returned non-success status: HTTP {response.status_code}"
-            delivery_attempt.status = 'failed'
-            delivery_attempt.error_message = error_message
-            db.session.commit()
             
             # Raise exception to trigger retry mechanism
             raise Exception(error_message)
@@ -89,25 +150,40 @@ def process_webhook_delivery(self, webhook_id):
         except (requests.RequestException, Exception) as e:
             # Handle request exceptions (timeouts, connection errors, etc.)
             error_message = str(e)
-            logger.warning(f"Delivery failed for webhook {webhook_id}: {error_message}")
-            
-            # Update delivery attempt with error
-            delivery_attempt.status = 'failed'
-            delivery_attempt.error_message = error_message[:500]  # Limit size
-            db.session.commit()
+            if duration_ms is None:
+                duration_ms = int((time.perf_counter() - started) * 1000)
+            logger.warning("Delivery failed for webhook %s: %s", webhook_id, error_message)
             
             # Check if we should retry
             if attempt_number < MAX_RETRIES:
                 # Calculate retry delay
                 retry_delay = RETRY_DELAYS[attempt_number - 1]
                 
-                logger.info(f"Scheduling retry {attempt_number + 1} in {retry_delay}s for webhook {webhook_id}")
+                # Record the failed attempt and its retrying state in one transaction
+                with phase('record'):
+                    finish_attempt(
+                        attempt, 'failed', 'retrying',
+                        next_retry_at=datetime.utcnow() + timedelta(seconds=retry_delay),
+                        status_code=status_code,
+                        error_message=error_message,
+                        duration_ms=duration_ms
+                    )
+                
+                logger.info("Scheduling retry %s in %ss for webhook %s", attempt_number + 1, retry_delay, webhook_id)
                 
-                # Retry with backoff delay
-                raise self.retry(exc=e, countdown=retry_delay)
+                # Retry with backoff delay, in the retry lane (priority is carried over)
+                raise self.retry(exc=e, countdown=retry_delay, queue=RETRY_QUEUE)
             else:
-                # All retries exhausted - mark as permanent failure
-                logger.error(f"All retry attempts exhausted for webhook {webhook_id}")
+                # All retries exhausted - park it in the dead-letter table so it can be replayed
+                logger.error("All retry attempts exhausted for webhook %s", webhook_id)
+                with phase('record'):
+                    finish_attempt(
+                        attempt, 'failed', 'dead',
+                        status_code=status_code,
+                        error_message=error_message,
+                        duration_ms=duration_ms
+                    )
+                dead_letter(webhook, attempt_number, error_message, status_code)
                 return {
                     "status": "failure",
                     "webhook_id": webhook_id,
@@ -116,5 +192,164 @@ def process_webhook_delivery(self, webhook_id):
                 }
     
     except Exception as e:
-        logger.exception(f"Unexpected error processing webhook {webhook_id}: {str(e)}")
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        logger.exception("Unexpected error processing webhook %s: %s", webhook_id, e)
+        return {"status": "error", "message": str(e)}
+    finally:
+        lease.release(delivered=delivered)
+
+
+def queued_since(request, webhook):
+    """
+    When this task became runnable: its ETA for retries and replays, otherwise
+    the time the webhook was received (it is enqueued right after the insert).
+    """
+    if request.eta:
+        eta = datetime.fromisoformat(request.eta) if isinstance(request.eta, str) else request.eta
+        if eta.tzinfo is not None:
+            eta = eta.astimezone(timezone.utc).replace(tzinfo=None)
+        return eta
+    return webhook.received_at
+
+
+def dead_letter(webhook, attempts, reason, last_status_code=None):
+    """
+    Record a webhook whose retries are exhausted. A webhook that dies again after
+    a replay reuses its existing row so it shows up as pending replay once more.
+    """
+    from app import db
+    from app.models import DeadLetter
+    
+    try:
+        entry = DeadLetter.query.filter_by(webhook_id=webhook.id).first()
+        if not entry:
+            entry = DeadLetter(webhook_id=webhook.id, subscription_id=webhook.subscription_id, replay_count=0)
+            db.session.add(entry)
+        entry.attempts = attempts
+        entry.reason = reason[:500] if reason else None
+        entry.last_status_code = last_status_code
+        entry.dead_at = datetime.utcnow()
+        entry.replayed_at = None
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Failed to dead-letter webhook %s: %s", webhook.id, e)
+
+
+def dead_letter_query(subscription_id=None, start=None, end=None):
+    """
+    Dead letters that have not been replayed yet, optionally filtered by
+    subscription and by the time they were dead-lettered.
+    """
+    from app.models import DeadLetter
+    
+    query = DeadLetter.query.filter(DeadLetter.replayed_at.is_(None))
+    if subscription_id is not None:
+        query = query.filter(DeadLetter.subscription_id == subscription_id)
+    if start is not None:
+        query = query.filter(DeadLetter.dead_at >= start)
+    if end is not None:
+        query = query.filter(DeadLetter.dead_at < end)
+    return query
+
+
+@celery.task(bind=True, ignore_result=TASK_IGNORE_RESULT)
+def replay_dead_letters(self, subscription_id=None, start=None, end=None, rate=REPLAY_DEFAULT_RATE, limit=None, after_id=0):
+    """
+    Re-enqueue dead-lettered webhooks one batch at a time. Deliveries within a batch
+    are spread out with ETAs so the batch drains at `rate` per second, and the next
+    batch is scheduled once this one has drained, so a large replay never floods the
+    broker or holds millions of ETA messages in worker memory.
+    """
+    from app import db
+    from app.models import DeadLetter
+    from app.status import status_values, upsert_statuses, invalidate_statuses
+    from app.backpressure import add_backlog
+    from collections import Counter
+    
+    rate = max(float(rate or REPLAY_DEFAULT_RATE), 0.001)
+    start_dt = datetime.fromisoformat(start) if start else None
+    end_dt = datetime.fromisoformat(end) if end else None
+    batch_size = REPLAY_BATCH_SIZE if limit is None else min(REPLAY_BATCH_SIZE, limit)
+    
+    batch = (
+        dead_letter_query(subscription_id, start_dt, end_dt)
+        .filter(DeadLetter.id > after_id)
+        .order_by(DeadLetter.id)
+        .limit(batch_size)
+        .all()
+    )
+    if not batch:
+        logger.info("Dead-letter replay finished (subscription=%s, start=%s, end=%s)", subscription_id, start, end)
+        return
+    
+    now = datetime.utcnow()
+    etas = [now + timedelta(seconds=i / rate) for i in range(len(batch))]
+    statuses = []
+    for entry, eta in zip(batch, etas):
+        entry.replayed_at = now
+        entry.replay_count = (entry.replay_count or 0) + 1
+        statuses.append(status_values(entry.webhook_id, entry.subscription_id, 'pending', 0, next_retry_at=eta))
+    # Commit before publishing: a delivery that finishes quickly must find its
+    # status already pending, or the upsert would overwrite its 'delivered'
+    upsert_statuses(statuses)
+    db.session.commit()
+    invalidate_statuses([entry.webhook_id for entry in batch])
+    add_backlog(Counter(entry.subscription_id for entry in batch))
+    
+    published = 0
+    try:
+        for entry, eta in zip(batch, etas):
+            process_webhook_delivery.apply_async((entry.webhook_id,), eta=eta, queue=REPLAY_QUEUE)
+            published += 1
+    except Exception:
+        # Put the rest back in the replay set so a later replay picks them up exactly once
+        unpublished = batch[published:]
+        logger.exception("Replay publish failed; returning %s dead letters to the replay set", len(unpublished))
+        for entry in unpublished:
+            entry.replayed_at = None
+            entry.replay_count -= 1
+        upsert_statuses([
+            status_values(entry.webhook_id, entry.subscription_id, 'dead', entry.attempts,
+                          last_status_code=entry.last_status_code)
+            for entry in unpublished
+        ])
+        db.session.commit()
+        invalidate_statuses([entry.webhook_id for entry in unpublished])
+        add_backlog({sub_id: -count for sub_id, count in Counter(e.subscription_id for e in unpublished).items()})
+        raise
+    
+    logger.info("Re-enqueued %s dead-lettered webhooks at %s/s", len(batch), rate)
+    
+    remaining = None if limit is None else limit - len(batch)
+    if remaining is None or remaining > 0:
+        self.apply_async(
+            kwargs={
+                'subscription_id': subscription_id,
+                'start': start,
+                'end': end,
+                'rate': rate,
+                'limit': remaining,
+                'after_id': batch[-1].id,
+            },
+            countdown=len(batch) / rate,
+        )
+
+
+@celery.task(ignore_result=TASK_IGNORE_RESULT)
+def purge_expired_webhooks():
+    """
+    Retention run scheduled by celery beat; see app.retention.
+    """
+    from app.retention import purge_expired
+    
+    purge_expired()
+
+
+@celery.task(ignore_result=TASK_IGNORE_RESULT)
+def reconcile_subscription_backlog():
+    """
+    Correct drift in the ingest backlog counters; see app.backpressure.
+    """
+    from app.backpressure import reconcile_backlog
+    
+    reconcile_backlog()
@@ -0,0 +1,329 @@
+"""
+Lightweight distributed tracing, compatible with OpenTelemetry on the wire.
+
+Trace context uses the W3C `traceparent` header: it is read from incoming HTTP
+requests, carried to the worker in the Celery message headers, and sent on to
+subscribers with each delivery. Requests, tasks and the profiling phases
+(app.profiling.phase: commits, broker publish, outbound HTTP, ...) become spans.
+
+Finished spans are batched by a background thread and exported as OTLP/JSON,
+either appended to TRACE_FILE (one export request per line, the same format as
+the OpenTelemetry Collector's file exporter) or POSTed to an OTLP/HTTP endpoint
+such as a collector on port 4318. Tracing is off unless TRACE_EXPORTER is set.
+"""
+from .metrics import TRACE_SPANS_DROPPED
+from flask import g, request
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_process_shutdown
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import requests
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'none')  # none, file or otlp
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'webhook-delivery-service')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))  # for traces started here
+TRACE_EXPORT_INTERVAL = float(os.getenv('TRACE_EXPORT_INTERVAL', '1.0'))  # seconds
+TRACE_EXPORT_BATCH_SIZE = int(os.getenv('TRACE_EXPORT_BATCH_SIZE', '512'))
+TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', '10000'))
+
+TRACING_ENABLED = TRACE_EXPORTER in ('file', 'otlp')
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT, PRODUCER, CONSUMER = 1, 2, 3, 4, 5
+
+# Kinds for the profiling phases that cross a process boundary
+PHASE_KINDS = {'celery_publish': PRODUCER, 'http': CLIENT}
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current = ContextVar('wds_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'sampled', 'name', 'kind', 'start_ns', 'end_ns',
+                 'attributes', 'error')
+
+    def __init__(self, name, kind=INTERNAL, parent=None, trace_id=None, parent_id=None, sampled=True):
+        self.trace_id = parent.trace_id if parent else (trace_id or '%032x' % random.getrandbits(128))
+        self.parent_id = parent.span_id if parent else parent_id
+        self.sampled = parent.sampled if parent else sampled
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.error = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            get_exporter().submit(self)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 0},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def parse_traceparent(header):
+    """(trace_id, parent span_id, sampled) from a traceparent header, or None if absent or malformed."""
+    match = _TRACEPARENT.match((header or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+
+
+def start_span(name, kind=INTERNAL, traceparent=None):
+    """
+    Start a span as a child of the current one, or of `traceparent`, or as a new
+    root trace sampled at TRACE_SAMPLE_RATE. Returns (span, token) for end_span.
+    """
+    parent = _current.get()
+    if parent is not None:
+        span = Span(name, kind, parent=parent)
+    else:
+        context = parse_traceparent(traceparent)
+        if context:
+            span = Span(name, kind, trace_id=context[0], parent_id=context[1], sampled=context[2])
+        else:
+            span = Span(name, kind, sampled=random.random() < TRACE_SAMPLE_RATE)
+    return span, _current.set(span)
+
+
+def end_span(span, token, error=None):
+    _current.reset(token)
+    if error is not None:
+        span.error = str(error)[:500]
+    span.end()
+
+
+@contextmanager
+def span(name, kind=INTERNAL, **attributes):
+    """A child span of the current request or task; does nothing outside a trace."""
+    if not TRACING_ENABLED or _current.get() is None:
+        yield None
+        return
+    current, token = start_span(name, kind)
+    for key, value in attributes.items():
+        current.set(key, value)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        end_span(current, token, error)
+
+
+def current_traceparent():
+    current = _current.get()
+    return current.traceparent if current is not None else None
+
+
+def annotate(attributes):
+    """Add attributes to the current span, if there is one."""
+    current = _current.get()
+    if current is not None:
+        for key, value in attributes.items():
+            current.set(key, value)
+
+
+class SpanExporter:
+    """Batches finished spans on a background thread and writes them as OTLP/JSON."""
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self.pid = os.getpid()
+        self.session = requests.Session() if TRACE_EXPORTER == 'otlp' else None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+        self.thread.start()
+
+    def submit(self, span):
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            TRACE_SPANS_DROPPED.inc()
+
+    def _collect(self):
+        batch = []
+        deadline = time.monotonic() + TRACE_EXPORT_INTERVAL
+        while len(batch) < TRACE_EXPORT_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self.stopped.is_set():
+            batch = self._collect()
+            if batch:
+                self._export(batch)
+
+    def _export(self, spans):
+        body = json.dumps({
+            'resourceSpans': [{
+                'resource': {'attributes': [
+                    otlp_attribute('service.name', TRACE_SERVICE_NAME),
+                    otlp_attribute('process.pid', os.getpid()),
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': 'app.tracing'},
+                    'spans': [span.to_otlp() for span in spans],
+                }],
+            }]
+        })
+        try:
+            if TRACE_EXPORTER == 'otlp':
+                self.session.post(TRACE_OTLP_ENDPOINT, data=body, headers={'Content-Type': 'application/json'}, timeout=5)
+            else:
+                with open(TRACE_FILE, 'a') as f:
+                    f.write(body + '\n')
+        except Exception as e:
+            TRACE_SPANS_DROPPED.inc(len(spans))
+            logger.warning('Could not export %s spans: %s', len(spans), e)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join(timeout=TRACE_EXPORT_INTERVAL + 1)
+        remaining = []
+        while True:
+            try:
+                remaining.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if remaining:
+            self._export(remaining)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """The exporter for this process; prefork children start their own."""
+    global _exporter
+    if _exporter is None or _exporter.pid != os.getpid():
+        with _exporter_lock:
+            if _exporter is None or _exporter.pid != os.getpid():
+                _exporter = SpanExporter()
+    return _exporter
+
+
+@worker_process_shutdown.connect
+def close_exporter(**kwargs):
+    if _exporter is not None and _exporter.pid == os.getpid():
+        _exporter.close()
+
+
+atexit.register(close_exporter)
+
+
+def init_tracing(app):
+    """Start a server span for each request, continuing the caller's trace if it sent one."""
+    if not TRACING_ENABLED:
+        return
+
+    @app.before_request
+    def start_request_span():
+        current, token = start_span(
+            f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+            SERVER,
+            traceparent=request.headers.get('traceparent'),
+        )
+        current.set('http.request.method', request.method)
+        current.set('url.path', request.path)
+        g.trace_span = (current, token)
+
+    @app.after_request
+    def tag_response(response):
+        if 'trace_span' in g:
+            current = g.trace_span[0]
+            current.set('http.response.status_code', response.status_code)
+            if response.status_code >= 500:
+                current.error = f'HTTP {response.status_code}'
+            response.headers['traceparent'] = current.traceparent
+        return response
+
+    @app.teardown_request
+    def end_request_span(exc=None):
+        trace_span = g.pop('trace_span', None)
+        if trace_span is not None:
+            end_span(*trace_span, error=exc)
+
+
+_task_spans = {}
+
+
+@before_task_publish.connect
+def inject_trace_context(headers=None, **kwargs):
+    if TRACING_ENABLED and headers is not None:
+        traceparent = current_traceparent()
+        if traceparent:
+            headers['traceparent'] = traceparent
+
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs):
+    if not TRACING_ENABLED:
+        return
+    traceparent = getattr(task.request, 'traceparent', None) or (task.request.headers or {}).get('traceparent')
+    current, token = start_span(task.name, CONSUMER, traceparent=traceparent)
+    current.set('messaging.system', 'celery')
+    current.set('messaging.message.id', task_id)
+    current.set('celery.retries', task.request.retries)
+    _task_spans[task_id] = (current, token)
+
+
+@task_postrun.connect
+def end_task_span(task_id=None, state=None, **kwargs):
+    task_span = _task_spans.pop(task_id, None)
+    if task_span is not None:
+        task_span[0].set('celery.state', state)
+        end_span(*task_span, error=f'task {state}' if state == 'FAILURE' else None)
@@ -0,0 +1,62 @@
+"""
+Measure what the per-webhook delivery lease adds to each task: one round trip
+to acquire (delivered check + SET NX PX in a Lua script) and one to release.
+
+Run it against the stack's Redis:
+
+    REDIS_URL=redis://localhost:6380/0 python benchmarks/lease_overhead.py --count 5000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.leases import acquire_lease  # noqa: E402
+from app.redis_client import get_redis  # noqa: E402
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q / 100), len(samples) - 1)]
+
+
+def report(name, samples):
+    ms = [s * 1000 for s in samples]
+    print(f"{name:<22} mean {statistics.mean(ms):.3f} ms   p50 {percentile(ms, 50):.3f} ms   p99 {percentile(ms, 99):.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=2000)
+    args = parser.parse_args()
+
+    client = get_redis()
+    ping, acquire, release = [], [], []
+    for _ in range(args.count):
+        webhook_id = f'bench-{uuid.uuid4()}'
+
+        started = time.perf_counter()
+        client.ping()
+        ping.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        lease = acquire_lease(webhook_id, 30)
+        acquire.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        lease.release(delivered=True)
+        release.append(time.perf_counter() - started)
+
+        client.delete(f'delivered:{webhook_id}')
+
+    report('PING (baseline RTT)', ping)
+    report('acquire', acquire)
+    report('release (delivered)', release)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Cost of hot-path logging on the calling thread: the old style (f-strings, full
+payloads, synchronous StreamHandler) against app.logging_setup (lazy arguments,
+capped payloads, sampling, queued handler).
+
+    python benchmarks/logging_overhead.py --items 1000 --iterations 2000 --sample-rate 0.1
+"""
+import argparse
+import io
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.logging_setup import NonBlockingQueueHandler, SamplingFilter, capped  # noqa: E402
+
+
+class CountingSink(io.TextIOBase):
+    def __init__(self):
+        self.bytes = 0
+        self.writes = 0
+
+    def write(self, text):
+        self.bytes += len(text)
+        self.writes += 1
+        return len(text)
+
+
+def make_payload(items):
+    return [
+        {'id': i, 'url': f'https://example.com/hooks/{i}', 'secret_hash': 'f' * 64, 'salt': 'a' * 64,
+         'created_at': '2025-04-27T10:30:00'}
+        for i in range(items)
+    ]
+
+
+def old_style(payload, iterations):
+    sink = CountingSink()
+    logger = logging.getLogger('bench.old')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(sink))
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        logger.info(f'Found {len(payload)} subscriptions')
+        logger.info(f'Subscription list: {payload}')
+    return time.perf_counter() - started, sink
+
+
+def new_style(payload, iterations, sample_rate):
+    sink = CountingSink()
+    logger = logging.getLogger('bench.new')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=10000))
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, logging.StreamHandler(sink))
+    listener.start()
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        logger.info('Found %s subscriptions', len(payload))
+        logger.debug('Subscription list: %s', capped(payload))
+        logger.info('Subscription sample: %s', capped(payload))
+    elapsed = time.perf_counter() - started
+    listener.stop()
+    return elapsed, sink
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000, help='rows in the logged list')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--sample-rate', type=float, default=1.0)
+    args = parser.parse_args()
+
+    payload = make_payload(args.items)
+    old_elapsed, old_sink = old_style(payload, args.iterations)
+    new_elapsed, new_sink = new_style(payload, args.iterations, args.sample_rate)
+
+    for name, elapsed, sink in (('old', old_elapsed, old_sink), ('new', new_elapsed, new_sink)):
+        print(f'{name}: {elapsed / args.iterations * 1e6:9.1f} us/request on the caller, '
+              f'{sink.bytes / args.iterations:10.0f} bytes/request, {sink.writes} writes')
+
+
+if __name__ == '__main__':
+    main()
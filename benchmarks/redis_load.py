@@ -0,0 +1,77 @@
+"""
+Measure Redis memory and command traffic while the service delivers a burst of webhooks.
+
+Run it against a running stack (docker-compose up), once with task results
+stored and once without, and compare the deltas:
+
+    CELERY_RESULT_BACKEND=redis://redis:6379/0 CELERY_STORE_RESULTS=1 docker-compose up   # before
+    docker-compose up                                                                      # after
+
+    python benchmarks/redis_load.py --url http://localhost:5000 --redis redis://localhost:6380/0 \
+        --subscription 1 --count 2000
+"""
+import argparse
+import time
+
+import redis
+import requests
+
+
+def snapshot(r):
+    memory = r.info('memory')
+    stats = r.info('stats')
+    result_keys = sum(1 for _ in r.scan_iter(match='celery-task-meta-*', count=1000))
+    return {
+        'used_memory': memory['used_memory'],
+        'total_commands_processed': stats['total_commands_processed'],
+        'keys': r.dbsize(),
+        'result_keys': result_keys,
+        'time': time.monotonic(),
+    }
+
+
+def wait_for_drain(r, queue, timeout):
+    """Wait until the broker queue is empty and the reserved-message set is settled."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if r.llen(queue) == 0 and r.zcard('unacked_index') == 0:
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--redis', default='redis://localhost:6380/0')
+    parser.add_argument('--subscription', type=int, default=1)
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--queue', default='deliveries')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    r = redis.Redis.from_url(args.redis)
+    session = requests.Session()
+
+    before = snapshot(r)
+    for i in range(args.count):
+        session.post(
+            f'{args.url}/ingest/bypass-signature/{args.subscription}',
+            json={'event': 'benchmark', 'data': {'seq': i}},
+            timeout=10,
+        )
+    drained = wait_for_drain(r, args.queue, args.timeout)
+    after = snapshot(r)
+
+    elapsed = after['time'] - before['time']
+    commands = after['total_commands_processed'] - before['total_commands_processed']
+    print(f"webhooks sent:         {args.count}{'' if drained else ' (queue did not drain before timeout)'}")
+    print(f"elapsed:               {elapsed:.1f}s")
+    print(f"redis commands:        {commands} ({commands / max(elapsed, 1e-9):.0f} ops/s, {commands / args.count:.1f} per webhook)")
+    print(f"used_memory delta:     {after['used_memory'] - before['used_memory']} bytes")
+    print(f"key count delta:       {after['keys'] - before['keys']}")
+    print(f"result keys in redis:  {after['result_keys']}")
+
+
+if __name__ == '__main__':
+    main()
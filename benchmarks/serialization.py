@@ -0,0 +1,124 @@
+"""
+Encode and decode costs of the serializers in app.serialization, on payloads
+shaped like what the service actually moves:
+
+ - subscriptions / delivery_logs: list endpoint bodies with --rows rows
+ - webhook: a nested ingest payload, decoded on every ingest request
+ - task: a process_webhook_delivery message body (Celery protocol 2)
+
+HTTP bodies compare Flask's stdlib provider with OrjsonProvider (both parse
+with the stdlib, so only encoding differs); task bodies compare kombu's json
+and msgpack serializers (msgpack must be installed).
+
+    python benchmarks/serialization.py --rows 1000 --iterations 200
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from kombu.serialization import dumps as kombu_dumps, loads as kombu_loads  # noqa: E402
+from app.serialization import OrjsonProvider  # noqa: E402
+
+
+def make_subscriptions(rows):
+    return {'subscriptions': [
+        {'id': i, 'url': f'https://example.com/hooks/{i}', 'secret_hash': 'f' * 64, 'salt': 'a' * 64,
+         'topics': ['orders.created', 'orders.paid'], 'filter': {'event': {'in': ['a', 'b']}},
+         'max_body_bytes': None, 'created_at': '2025-04-27T10:30:00'}
+        for i in range(rows)
+    ]}
+
+
+def make_delivery_logs(rows):
+    started = datetime(2025, 4, 27, 10, 30)
+    return {'delivery_logs': [
+        {'id': i, 'webhook_id': str(uuid.UUID(int=i)), 'subscription_id': i % 50, 'attempt_number': 1 + i % 3,
+         'status': 'success' if i % 4 else 'failed', 'timestamp': (started + timedelta(seconds=i)).isoformat(),
+         'status_code': 200 if i % 4 else 503, 'error_message': None if i % 4 else 'HTTP 503',
+         'response_body': 'ok' if i % 4 else 'Service Unavailable', 'duration_ms': 42, 'queue_ms': 3, 'e2e_ms': 47}
+        for i in range(rows)
+    ]}
+
+
+def make_webhook():
+    return {
+        'event': 'order.created',
+        'id': str(uuid.UUID(int=7)),
+        'created_at': '2025-04-27T10:30:00Z',
+        'data': {
+            'order_id': 912345, 'currency': 'EUR', 'total': 129.95, 'paid': True,
+            'customer': {'id': 42, 'name': 'Jürgen Müller', 'email': 'j.mueller@example.com', 'tags': ['vip', 'b2b']},
+            'items': [{'sku': f'SKU-{i:05d}', 'quantity': i % 3 + 1, 'price': 9.99 + i} for i in range(12)],
+            'shipping': {'method': 'express', 'address': {'street': 'Hauptstraße 1', 'city': 'Berlin', 'zip': '10115'}},
+        },
+    }
+
+
+def make_task():
+    return [[str(uuid.UUID(int=7))], {}, {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}]
+
+
+def measure(fn, iterations):
+    fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations
+
+
+def report(name, encoder, encode_s, decode_s, size):
+    print(f'{name:<15} {encoder:<8} encode {encode_s * 1e6:10.1f} us   decode {decode_s * 1e6:10.1f} us   '
+          f'{size:10d} bytes')
+
+
+def bench_http(name, obj, providers, iterations):
+    for label, provider in providers:
+        # Both as the bytes a response carries
+        if isinstance(provider, OrjsonProvider):
+            encode = provider.encode
+        else:
+            def encode(obj):
+                return provider.dumps(obj).encode()
+        body = encode(obj)
+        report(name, label, measure(lambda: encode(obj), iterations), measure(lambda: provider.loads(body), iterations),
+               len(body))
+
+
+def bench_task(obj, iterations):
+    for serializer in ('json', 'msgpack'):
+        try:
+            content_type, encoding, body = kombu_dumps(obj, serializer=serializer)
+        except Exception as e:
+            print(f'{"task":<15} {serializer:<8} unavailable: {e}')
+            continue
+        report('task', serializer,
+               measure(lambda: kombu_dumps(obj, serializer=serializer), iterations),
+               measure(lambda: kombu_loads(body, content_type, encoding, accept=[content_type]), iterations),
+               len(body))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000, help='rows in each list body')
+    parser.add_argument('--iterations', type=int, default=200, help='repetitions for list bodies')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    providers = [('json', DefaultJSONProvider(app)), ('orjson', OrjsonProvider(app))]
+    small = args.iterations * 100
+
+    bench_http('subscriptions', make_subscriptions(args.rows), providers, args.iterations)
+    bench_http('delivery_logs', make_delivery_logs(args.rows), providers, args.iterations)
+    bench_http('webhook', make_webhook(), providers, small)
+    bench_task(make_task(), small)
+
+
+if __name__ == '__main__':
+    main()
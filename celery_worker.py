@@ -1,8 +1,12 @@
 from app import create_app
 from app.tasks import celery
+from app.metrics import MULTIPROC_DIR, exposition_registry, mark_process_dead
+from celery.signals import worker_init, worker_process_shutdown
+from prometheus_client import start_http_server
+import os
 
 # Create Flask application context
-flask_app = create_app()
+flask_app = create_app('worker')
 app_context = flask_app.app_context()
 app_context.push()
 
@@ -12,4 +16,25 @@ class FlaskTask(celery.Task):
         with flask_app.app_context():
             return self.run(*args, **kwargs)
 
-celery.Task = FlaskTask
\ No newline at end of file
+celery.Task = FlaskTask
+
+
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    """
+    Serve worker metrics from the main worker process. Pool children write to
+    PROMETHEUS_MULTIPROC_DIR and are merged on every scrape.
+    """
+    port = os.getenv('WORKER_METRICS_PORT')
+    if not port:
+        return
+    if MULTIPROC_DIR:
+        # Files left by a previous run would be summed into the new one
+        for name in os.listdir(MULTIPROC_DIR):
+            os.remove(os.path.join(MULTIPROC_DIR, name))
+    start_http_server(int(port), registry=exposition_registry())
+
+
+@worker_process_shutdown.connect
+def cleanup_metrics(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
@@ -0,0 +1,230 @@
+"""Delivery pipeline tables and columns
+
+Revision ID: b7e3c1f0a2d4
+Revises: e41d7a0c5b92
+Create Date: 2026-10-19 09:30:00.000000
+
+Adds the tables for dead letters, status, the outbox, rollups, events and
+payload blobs, and the new columns of subscriptions, delivery_attempts and
+webhook_payloads. Webhooks keep their body in payload_blobs from now on: the
+upgrade moves each existing inline payload into a blob and drops the payload
+column, and the downgrade copies the bodies back before dropping the blobs.
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+import hashlib
+import json
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3c1f0a2d4'
+down_revision = 'e41d7a0c5b92'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+webhooks = sa.table(
+    'webhook_payloads',
+    sa.column('id', sa.String),
+    sa.column('payload', sa.JSON),
+    sa.column('payload_hash', sa.String),
+)
+blobs = sa.table(
+    'payload_blobs',
+    sa.column('hash', sa.String),
+    sa.column('body', sa.JSON),
+    sa.column('size', sa.Integer),
+    sa.column('created_at', sa.DateTime),
+    sa.column('last_seen_at', sa.DateTime),
+)
+
+
+def canonical_json(payload):
+    # app.payloads.canonical_json as of this revision
+    return json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def move_payloads_to_blobs():
+    bind = op.get_bind()
+    now = datetime.utcnow()
+    while True:
+        rows = bind.execute(
+            sa.select(webhooks.c.id, webhooks.c.payload).where(webhooks.c.payload_hash.is_(None)).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        new_blobs = {}
+        assigned = []
+        for webhook_id, payload in rows:
+            encoded = canonical_json(payload).encode('utf-8')
+            digest = hashlib.sha256(encoded).hexdigest()
+            new_blobs[digest] = {'hash': digest, 'body': payload, 'size': len(encoded), 'created_at': now,
+                                 'last_seen_at': now}
+            assigned.append({'webhook_id': webhook_id, 'digest': digest})
+        stored = bind.execute(sa.select(blobs.c.hash).where(blobs.c.hash.in_(list(new_blobs)))).scalars()
+        for digest in stored:
+            del new_blobs[digest]
+        if new_blobs:
+            bind.execute(blobs.insert(), list(new_blobs.values()))
+        bind.execute(
+            webhooks.update().where(webhooks.c.id == sa.bindparam('webhook_id'))
+            .values(payload_hash=sa.bindparam('digest')),
+            assigned
+        )
+
+
+def upgrade():
+    with op.batch_alter_table('subscriptions') as batch_op:
+        batch_op.add_column(sa.Column('topics', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('filter', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('max_body_bytes', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('delivery_attempts') as batch_op:
+        batch_op.add_column(sa.Column('duration_ms', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('queue_ms', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('e2e_ms', sa.Integer(), nullable=True))
+
+    op.create_table(
+        'payload_blobs',
+        sa.Column('hash', sa.String(64), nullable=False),
+        sa.Column('body', sa.JSON(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_seen_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('hash'),
+    )
+    op.create_table(
+        'events',
+        sa.Column('id', sa.String(36), nullable=False),
+        sa.Column('topic', sa.String(255), nullable=False),
+        sa.Column('payload_hash', sa.String(64), nullable=False),
+        sa.Column('received_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['payload_hash'], ['payload_blobs.hash']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_events_topic', 'events', ['topic'])
+    op.create_index('ix_events_payload_hash', 'events', ['payload_hash'])
+
+    # Foreign keys added to an existing table are named as Postgres names the ones in CREATE TABLE
+    with op.batch_alter_table('webhook_payloads') as batch_op:
+        batch_op.add_column(sa.Column('payload_hash', sa.String(64), nullable=True))
+        batch_op.add_column(sa.Column('event_id', sa.String(36), nullable=True))
+        batch_op.create_foreign_key('webhook_payloads_payload_hash_fkey', 'payload_blobs', ['payload_hash'], ['hash'])
+        batch_op.create_foreign_key('webhook_payloads_event_id_fkey', 'events', ['event_id'], ['id'])
+    move_payloads_to_blobs()
+    with op.batch_alter_table('webhook_payloads') as batch_op:
+        batch_op.alter_column('payload_hash', existing_type=sa.String(64), nullable=False)
+        batch_op.drop_column('payload')
+    op.create_index('ix_webhook_payloads_payload_hash', 'webhook_payloads', ['payload_hash'])
+    op.create_index('ix_webhook_payloads_event_id', 'webhook_payloads', ['event_id'])
+
+    op.create_table(
+        'dead_letters',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('webhook_id', sa.String(36), nullable=False),
+        sa.Column('subscription_id', sa.Integer(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.String(500), nullable=True),
+        sa.Column('last_status_code', sa.Integer(), nullable=True),
+        sa.Column('dead_at', sa.DateTime(), nullable=True),
+        sa.Column('replayed_at', sa.DateTime(), nullable=True),
+        sa.Column('replay_count', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id']),
+        sa.ForeignKeyConstraint(['webhook_id'], ['webhook_payloads.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('webhook_id'),
+    )
+    op.create_index('idx_dead_letter_subscription_dead_at', 'dead_letters', ['subscription_id', 'dead_at'])
+    op.create_index('idx_dead_letter_dead_at', 'dead_letters', ['dead_at'])
+
+    op.create_table(
+        'webhook_status',
+        sa.Column('webhook_id', sa.String(36), nullable=False),
+        sa.Column('subscription_id', sa.Integer(), nullable=False),
+        sa.Column('state', sa.String(20), nullable=False),
+        sa.Column('attempt_count', sa.Integer(), nullable=False),
+        sa.Column('last_status_code', sa.Integer(), nullable=True),
+        sa.Column('last_attempt_at', sa.DateTime(), nullable=True),
+        sa.Column('next_retry_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id']),
+        sa.ForeignKeyConstraint(['webhook_id'], ['webhook_payloads.id']),
+        sa.PrimaryKeyConstraint('webhook_id'),
+    )
+
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+        sa.Column('webhook_id', sa.String(36), nullable=False),
+        sa.Column('traceparent', sa.String(55), nullable=True),
+        sa.Column('priority', sa.SmallInteger(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('claimed_until', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['webhook_id'], ['webhook_payloads.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+    op.create_table(
+        'delivery_rollups',
+        sa.Column('subscription_id', sa.Integer(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('attempt_number', sa.Integer(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('successes', sa.Integer(), nullable=False),
+        sa.Column('failures', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id']),
+        sa.PrimaryKeyConstraint('subscription_id', 'bucket_start', 'attempt_number'),
+    )
+    op.create_table(
+        'latency_rollups',
+        sa.Column('subscription_id', sa.Integer(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('metric', sa.String(16), nullable=False),
+        sa.Column('bucket', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id']),
+        sa.PrimaryKeyConstraint('subscription_id', 'bucket_start', 'metric', 'bucket'),
+    )
+
+
+def downgrade():
+    op.drop_table('latency_rollups')
+    op.drop_table('delivery_rollups')
+    op.drop_table('outbox')
+    op.drop_table('webhook_status')
+    op.drop_index('idx_dead_letter_dead_at', table_name='dead_letters')
+    op.drop_index('idx_dead_letter_subscription_dead_at', table_name='dead_letters')
+    op.drop_table('dead_letters')
+
+    op.drop_index('ix_webhook_payloads_event_id', table_name='webhook_payloads')
+    op.drop_index('ix_webhook_payloads_payload_hash', table_name='webhook_payloads')
+    with op.batch_alter_table('webhook_payloads') as batch_op:
+        batch_op.add_column(sa.Column('payload', sa.JSON(), nullable=True))
+    op.execute(
+        webhooks.update().values(
+            payload=sa.select(blobs.c.body).where(blobs.c.hash == webhooks.c.payload_hash).scalar_subquery()
+        )
+    )
+    with op.batch_alter_table('webhook_payloads') as batch_op:
+        batch_op.alter_column('payload', existing_type=sa.JSON(), nullable=False)
+        batch_op.drop_constraint('webhook_payloads_event_id_fkey', type_='foreignkey')
+        batch_op.drop_constraint('webhook_payloads_payload_hash_fkey', type_='foreignkey')
+        batch_op.drop_column('event_id')
+        batch_op.drop_column('payload_hash')
+
+    op.drop_index('ix_events_payload_hash', table_name='events')
+    op.drop_index('ix_events_topic', table_name='events')
+    op.drop_table('events')
+    op.drop_table('payload_blobs')
+
+    with op.batch_alter_table('delivery_attempts') as batch_op:
+        batch_op.drop_column('e2e_ms')
+        batch_op.drop_column('queue_ms')
+        batch_op.drop_column('duration_ms')
+
+    with op.batch_alter_table('subscriptions') as batch_op:
+        batch_op.drop_column('max_body_bytes')
+        batch_op.drop_column('filter')
+        batch_op.drop_column('topics')
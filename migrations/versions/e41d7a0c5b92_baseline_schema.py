@@ -0,0 +1,82 @@
+"""Baseline schema
+
+Revision ID: e41d7a0c5b92
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+The tables the service had before it was put under migrations. Databases
+created back then by db.create_all() already have them, so each table is only
+created when it is missing; `flask db upgrade` then records this revision and
+continues from it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41d7a0c5b92'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'subscriptions' not in existing:
+        op.create_table(
+            'subscriptions',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('url', sa.String(255), nullable=False),
+            sa.Column('secret', sa.String(128), nullable=True),
+            sa.Column('secret_hash', sa.String(128), nullable=True),
+            sa.Column('salt', sa.String(64), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if 'webhook_payloads' not in existing:
+        op.create_table(
+            'webhook_payloads',
+            sa.Column('id', sa.String(36), nullable=False),
+            sa.Column('subscription_id', sa.Integer(), nullable=False),
+            sa.Column('payload', sa.JSON(), nullable=False),
+            sa.Column('received_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if 'logs' not in existing:
+        op.create_table(
+            'logs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('wp_id', sa.String(36), nullable=False),
+            sa.Column('log_message', sa.String(255), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['wp_id'], ['webhook_payloads.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if 'delivery_attempts' not in existing:
+        op.create_table(
+            'delivery_attempts',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('webhook_id', sa.String(36), nullable=False),
+            sa.Column('subscription_id', sa.Integer(), nullable=False),
+            sa.Column('attempt_number', sa.Integer(), nullable=False),
+            sa.Column('status', sa.String(20), nullable=False),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.Column('status_code', sa.Integer(), nullable=True),
+            sa.Column('error_message', sa.String(500), nullable=True),
+            sa.Column('response_body', sa.String(500), nullable=True),
+            sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id']),
+            sa.ForeignKeyConstraint(['webhook_id'], ['webhook_payloads.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('idx_delivery_webhook_id', 'delivery_attempts', ['webhook_id'])
+        op.create_index('idx_delivery_subscription_id', 'delivery_attempts', ['subscription_id'])
+
+
+def downgrade():
+    op.drop_index('idx_delivery_subscription_id', table_name='delivery_attempts')
+    op.drop_index('idx_delivery_webhook_id', table_name='delivery_attempts')
+    op.drop_table('delivery_attempts')
+    op.drop_table('logs')
+    op.drop_table('webhook_payloads')
+    op.drop_table('subscriptions')
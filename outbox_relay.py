@@ -0,0 +1,28 @@
+from app import create_app
+from app.outbox import run_relay
+from app.metrics import exposition_registry
+from prometheus_client import start_http_server
+import os
+import signal
+import threading
+
+# Create Flask application context
+flask_app = create_app('worker')
+
+stop = threading.Event()
+
+
+def shutdown(signum, frame):
+    stop.set()
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    port = os.getenv('RELAY_METRICS_PORT')
+    if port:
+        start_http_server(int(port), registry=exposition_registry())
+
+    with flask_app.app_context():
+        run_relay(stop)
@@ -0,0 +1,15 @@
+import pytest
+
+from app import create_app, db
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The app on an sqlite database of its own, inside an app context."""
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path / "wds.db"}')
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,142 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from app import attempts, db
+from app.attempts import WRITER_RETRIES, WRITER_RETRY_BACKOFF, AttemptWriter
+from app.metrics import ATTEMPT_ROWS_LOST
+from app.models import DeliveryAttempt, Subscription, WebhookPayload, WebhookStatus
+from app.payloads import store_payload
+from app.status import status_values
+
+
+class Sleeps:
+    """Stands in for the time module; records the backoff instead of sleeping."""
+
+    def __init__(self):
+        self.delays = []
+
+    def sleep(self, seconds):
+        self.delays.append(seconds)
+
+    def monotonic(self):
+        return 0.0
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = Sleeps()
+    monkeypatch.setattr(attempts, 'time', sleeps)
+    return sleeps
+
+
+@pytest.fixture
+def writer(app):
+    writer = AttemptWriter(app)
+    yield writer
+    writer.stopping.set()
+
+
+def failing_batches(monkeypatch, writer, failures, bad=()):
+    """
+    Make the writer's first `failures` batches fail, and every batch holding a
+    webhook in `bad`. Returns the sizes of the batches tried.
+    """
+    tried = []
+    write_batch = writer._write_batch
+
+    def write(records):
+        tried.append(len(records))
+        if len(tried) <= failures:
+            return RuntimeError('database unavailable')
+        if any(record['status']['webhook_id'] in bad for record in records):
+            return RuntimeError('row rejected')
+        return write_batch(records)
+    monkeypatch.setattr(writer, '_write_batch', write)
+    return tried
+
+
+def records(count):
+    db.session.add(Subscription(id=1, url='http://example.com/hook'))
+    result = []
+    for n in range(count):
+        webhook = WebhookPayload(subscription_id=1, payload_hash=store_payload({'n': n}))
+        db.session.add(webhook)
+        db.session.flush()
+        now = datetime.utcnow()
+        result.append({
+            'attempt': {
+                'webhook_id': webhook.id, 'subscription_id': 1, 'attempt_number': 1, 'timestamp': now,
+                'status': 'success', 'status_code': 200, 'error_message': None, 'response_body': 'ok',
+                'duration_ms': 5, 'queue_ms': 1, 'e2e_ms': 6,
+            },
+            'status': status_values(webhook.id, 1, 'delivered', 1, last_status_code=200, last_attempt_at=now),
+            'latency': {'http': 5, 'queue': 1, 'e2e': 6},
+        })
+    db.session.commit()
+    return result
+
+
+def written():
+    return set(db.session.execute(select(DeliveryAttempt.webhook_id)).scalars())
+
+
+def delivered():
+    return set(db.session.execute(
+        select(WebhookStatus.webhook_id).where(WebhookStatus.state == 'delivered')
+    ).scalars())
+
+
+def lost():
+    return ATTEMPT_ROWS_LOST._value.get()
+
+
+def test_a_batch_is_written_in_one_go(app, writer, sleeps, monkeypatch):
+    batch = records(3)
+    tried = failing_batches(monkeypatch, writer, 0)
+    writer._write(batch)
+    assert tried == [3]
+    assert written() == delivered() == {record['status']['webhook_id'] for record in batch}
+
+
+def test_a_failed_batch_is_retried_with_backoff(app, writer, sleeps, monkeypatch):
+    batch = records(3)
+    tried = failing_batches(monkeypatch, writer, WRITER_RETRIES)
+    before = lost()
+    writer._write(batch)
+    assert tried == [3] * (WRITER_RETRIES + 1)
+    assert sleeps.delays == [WRITER_RETRY_BACKOFF * 2 ** n for n in range(WRITER_RETRIES)]
+    assert len(written()) == 3
+    assert lost() == before
+
+
+def test_a_batch_that_keeps_failing_is_written_row_by_row(app, writer, sleeps, monkeypatch):
+    batch = records(4)
+    bad = batch[1]['status']['webhook_id']
+    tried = failing_batches(monkeypatch, writer, 0, bad={bad})
+    before = lost()
+    writer._write(batch)
+    assert tried == [4] * (WRITER_RETRIES + 1) + [1] * 4
+    assert written() == delivered() == {record['status']['webhook_id'] for record in batch} - {bad}
+    assert lost() == before + 1
+
+
+def test_a_single_row_that_keeps_failing_is_lost(app, writer, sleeps, monkeypatch):
+    batch = records(1)
+    tried = failing_batches(monkeypatch, writer, WRITER_RETRIES + 1)
+    before = lost()
+    writer._write(batch)
+    assert tried == [1] * (WRITER_RETRIES + 1)
+    assert written() == set()
+    assert lost() == before + 1
+
+
+def test_close_flushes_queued_rows(app, writer):
+    batch = records(3)
+    writer.stopping.set()
+    writer.thread.join(1)
+    for record in batch:
+        writer.queue.put(record)
+    writer.close()
+    assert len(written()) == 3
@@ -0,0 +1,185 @@
+import pytest
+
+from app import backpressure, db
+from app.backpressure import BACKLOG_KEY, Sampler, reconcile_backlog, release_backlog
+from app.models import Subscription, WebhookPayload, WebhookStatus
+from app.payloads import store_payload
+from app.queues import DELIVERY_QUEUE, RETRY_QUEUE, queue_keys
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')  # fakeredis runs Lua scripts with lupa
+
+INTERVAL = backpressure.INGEST_BACKPRESSURE_INTERVAL
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(backpressure, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(backpressure, 'get_redis', lambda: client)
+    return client
+
+
+@pytest.fixture
+def watermarks(monkeypatch):
+    monkeypatch.setattr(backpressure, 'INGEST_MAX_QUEUE_DEPTH', 10)
+    monkeypatch.setattr(backpressure, 'INGEST_QUEUE_LOW_WATERMARK', 8)
+
+
+@pytest.fixture
+def backlog_limit(monkeypatch):
+    monkeypatch.setattr(backpressure, 'INGEST_MAX_SUBSCRIPTION_BACKLOG', 3)
+    monkeypatch.setattr(backpressure, 'BACKLOG_TRACKING', True)
+
+
+def set_depth(client, depth):
+    """Spread `depth` messages over the priority lists of two lanes."""
+    keys = queue_keys(DELIVERY_QUEUE) + queue_keys(RETRY_QUEUE)
+    for key in keys:
+        client.delete(key)
+    for n in range(depth):
+        client.rpush(keys[n % len(keys)], n)
+
+
+def backlogs(client):
+    return {key.decode(): int(value) for key, value in client.hgetall(BACKLOG_KEY).items()}
+
+
+def test_disabled_sampler_admits_without_redis(monkeypatch):
+    def unavailable():
+        raise AssertionError('Redis should not be called')
+    monkeypatch.setattr(backpressure, 'get_redis', unavailable)
+    sampler = Sampler()
+    assert not sampler.enabled
+    assert sampler.check(1) is None
+
+
+def test_ingest_is_refused_at_the_max_depth_until_the_low_watermark(clock, redis_client, watermarks):
+    sampler = Sampler()
+    refused = []
+    for depth in (9, 10, 9, 8, 9, 10):
+        set_depth(redis_client, depth)
+        clock.now += INTERVAL
+        refused.append(sampler.check())
+        assert sampler.depth == depth
+    assert refused == [None, 'queue_depth', 'queue_depth', None, None, 'queue_depth']
+
+
+def test_depth_is_sampled_at_most_once_per_interval(clock, redis_client, watermarks):
+    sampler = Sampler()
+    set_depth(redis_client, 0)
+    assert sampler.check() is None
+    set_depth(redis_client, 10)
+    clock.now += INTERVAL / 2
+    assert sampler.check() is None
+    clock.now += INTERVAL / 2
+    assert sampler.check() == 'queue_depth'
+
+
+def test_without_redis_ingest_is_admitted(clock, redis_client, watermarks, monkeypatch):
+    sampler = Sampler()
+    set_depth(redis_client, 10)
+    assert sampler.check() == 'queue_depth'
+
+    def unavailable():
+        raise ConnectionError('down')
+    monkeypatch.setattr(backpressure, 'get_redis', unavailable)
+    clock.now += INTERVAL
+    assert sampler.check() is None
+    monkeypatch.setattr(backpressure, 'get_redis', lambda: redis_client)
+    clock.now += INTERVAL
+    assert sampler.check() == 'queue_depth'
+
+
+def test_accepted_webhooks_count_against_the_backlog_before_they_are_flushed(clock, redis_client, backlog_limit):
+    sampler = Sampler()
+    assert sampler.check(1) is None
+    sampler.accepted([1, 1, 1, 2])
+    assert backlogs(redis_client) == {}
+    assert sampler.check(1) == 'subscription_backlog'
+    assert sampler.check(2) is None
+    clock.now += INTERVAL
+    assert sampler.check(1) == 'subscription_backlog'
+    assert backlogs(redis_client) == {'1': 3, '2': 1}
+
+
+def test_finished_deliveries_release_the_backlog(clock, redis_client, backlog_limit):
+    sampler = Sampler()
+    for _ in range(3):
+        assert sampler.check(1) is None
+        sampler.accepted([1])
+    clock.now += INTERVAL
+    assert sampler.check(1) == 'subscription_backlog'
+    release_backlog(1)
+    clock.now += INTERVAL
+    assert sampler.check(1) is None
+    assert backlogs(redis_client) == {'1': 2}
+
+
+def test_backlogged_events_skip_only_the_full_subscriptions(clock, redis_client, backlog_limit):
+    redis_client.hset(BACKLOG_KEY, mapping={'1': 3, '2': 2})
+    sampler = Sampler()
+    sampler.backlogged([1, 2, 3])
+    clock.now += INTERVAL
+    assert sampler.backlogged([1, 2, 3]) == {1}
+
+
+def test_increments_are_kept_while_redis_is_down(clock, redis_client, backlog_limit, monkeypatch):
+    sampler = Sampler()
+    sampler.accepted([1, 1])
+
+    def unavailable():
+        raise ConnectionError('down')
+    monkeypatch.setattr(backpressure, 'get_redis', unavailable)
+    clock.now += INTERVAL
+    assert sampler.check(1) is None
+    monkeypatch.setattr(backpressure, 'get_redis', lambda: redis_client)
+    clock.now += INTERVAL
+    sampler.check(1)
+    assert backlogs(redis_client) == {'1': 2}
+
+
+def add_statuses(subscription_id, *states):
+    for state in states:
+        webhook = WebhookPayload(subscription_id=subscription_id, payload_hash=store_payload({'state': state}))
+        db.session.add_all([webhook, WebhookStatus(webhook=webhook, subscription_id=subscription_id, state=state)])
+    db.session.commit()
+
+
+def test_reconcile_corrects_the_counters_to_webhook_status(app, redis_client, backlog_limit):
+    db.session.add_all([Subscription(id=n, url=f'http://example.com/{n}') for n in (1, 2, 3)])
+    add_statuses(1, 'pending', 'retrying', 'delivered', 'dead')
+    add_statuses(2, 'pending')
+    add_statuses(3, 'delivered')
+    redis_client.hset(BACKLOG_KEY, mapping={'1': 5, '3': 4, '9': -1})
+    reconcile_backlog()
+    assert backlogs(redis_client) == {'1': 2, '2': 1}
+
+
+def test_reconcile_keeps_concurrent_updates(app, redis_client, backlog_limit, monkeypatch):
+    db.session.add(Subscription(id=1, url='http://example.com/1'))
+    add_statuses(1, 'pending', 'pending')
+    redis_client.hset(BACKLOG_KEY, '1', 7)
+    script = backpressure.reconcile_script()
+
+    def reconcile(keys, args):
+        # A webhook is accepted between the counters being read and the correction
+        redis_client.hincrby(BACKLOG_KEY, '1', 1)
+        return script(keys=keys, args=args)
+    monkeypatch.setattr(backpressure, 'reconcile_script', lambda: reconcile)
+    reconcile_backlog()
+    assert backlogs(redis_client) == {'1': 3}
@@ -0,0 +1,70 @@
+import pytest
+
+from app import db
+from app.models import DeadLetter, Subscription, WebhookPayload
+from app.payloads import store_payload
+from app.routes import deadletters
+
+
+@pytest.fixture
+def client(app):
+    db.session.add(Subscription(id=1, url='http://example.com/hook'))
+    webhook = WebhookPayload(subscription_id=1, payload_hash=store_payload({'n': 1}))
+    db.session.add(webhook)
+    db.session.flush()
+    db.session.add(DeadLetter(webhook_id=webhook.id, subscription_id=1, attempts=5))
+    db.session.commit()
+    return app.test_client()
+
+
+@pytest.fixture
+def replays(monkeypatch):
+    calls = []
+
+    class Task:
+        @staticmethod
+        def delay(**kwargs):
+            calls.append(kwargs)
+    monkeypatch.setattr(deadletters, 'replay_dead_letters', Task)
+    return calls
+
+
+@pytest.mark.parametrize('query', [
+    'limit=0',
+    'limit=-5',
+    'limit=ten',
+    'subscription_id=one',
+    'start=yesterday',
+])
+def test_list_rejects_bad_parameters(client, query):
+    assert client.get(f'/deadletters?{query}').status_code == 400
+
+
+def test_list_caps_the_limit(client):
+    response = client.get('/deadletters?limit=5000')
+    assert response.status_code == 200
+    assert response.get_json()['count'] == 1
+
+
+@pytest.mark.parametrize('body', [
+    {'rate': 0},
+    {'rate': -1},
+    {'rate': 'inf'},
+    {'rate': 'nan'},
+    {'rate': 'fast'},
+    {'rate': [10]},
+    {'limit': 0},
+    {'limit': {'max': 10}},
+    {'subscription_id': [1]},
+    {'start': 20250427},
+])
+def test_replay_rejects_bad_parameters(client, replays, body):
+    assert client.post('/deadletters/replay', json=body).status_code == 400
+    assert replays == []
+
+
+def test_replay_is_queued(client, replays):
+    response = client.post('/deadletters/replay', json={'subscription_id': 1, 'rate': 5, 'limit': 10})
+    assert response.status_code == 202
+    assert response.get_json() == {'status': 'accepted', 'matched': 1, 'rate': 5.0}
+    assert replays == [{'subscription_id': 1, 'start': None, 'end': None, 'rate': 5.0, 'limit': 10}]
@@ -0,0 +1,193 @@
+import re
+
+import pytest
+
+from app import filters
+from app.filters import MAX_FILTER_LENGTH, compile_filter, forget_filter, matches, validate_filter
+
+PAYLOAD = {
+    'event': 'order.paid',
+    'data': {
+        'amount': 150,
+        'currency': 'EUR',
+        'paid': True,
+        'note': None,
+        'items': [{'sku': 'A-1'}, {'sku': 'B-2'}],
+        'tags': ['vip'],
+    },
+}
+
+
+def test_no_filter_matches_everything():
+    assert compile_filter(None) is None
+    assert matches(None, PAYLOAD)
+    assert validate_filter(None) is None
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ({'event': 'order.paid'}, True),
+    ({'event': 'order.created'}, False),
+    ({'$.event': 'order.paid'}, True),
+    ({'data.currency': 'EUR'}, True),
+    ({'data.items.1.sku': 'B-2'}, True),
+    ({'data.items.2.sku': 'B-2'}, False),
+    ({'data.note': None}, True),
+    ({'data.missing': None}, False),
+    ({'event.name': 'order.paid'}, False),
+])
+def test_bare_values_mean_equality(spec, expected):
+    assert matches(spec, PAYLOAD) is expected
+
+
+@pytest.mark.parametrize('condition, expected', [
+    ({'eq': 150}, True),
+    ({'ne': 150}, False),
+    ({'gt': 149}, True),
+    ({'gt': 150}, False),
+    ({'gte': 150}, True),
+    ({'lt': 150}, False),
+    ({'lte': 150}, True),
+    ({'gte': 100, 'lt': 200}, True),
+    ({'gte': 100, 'lt': 150}, False),
+    ({'in': [100, 150]}, True),
+    ({'nin': [100, 150]}, False),
+    ({'exists': True}, True),
+    ({'exists': False}, False),
+])
+def test_operators(condition, expected):
+    assert matches({'data.amount': condition}, PAYLOAD) is expected
+
+
+@pytest.mark.parametrize('condition, expected', [
+    ({'ne': 1}, True),
+    ({'in': [1, None]}, False),
+    ({'nin': [1]}, True),
+    ({'exists': False}, True),
+    ({'exists': True}, False),
+    ({'gt': 0}, False),
+    ({'prefix': ''}, False),
+])
+def test_operators_on_missing_values(condition, expected):
+    assert matches({'data.missing': condition}, PAYLOAD) is expected
+
+
+def test_comparisons_do_not_mix_types():
+    assert not matches({'data.currency': {'gt': 1}}, PAYLOAD)
+    assert not matches({'data.amount': {'gt': 'a'}}, PAYLOAD)
+    assert matches({'data.currency': {'gte': 'EUR', 'lt': 'USD'}}, PAYLOAD)
+    # Booleans are not numbers here, although Python compares them as 0 and 1
+    assert not matches({'data.paid': {'gte': 0}}, PAYLOAD)
+
+
+def test_prefix_only_matches_strings():
+    assert matches({'event': {'prefix': 'order.'}}, PAYLOAD)
+    assert not matches({'event': {'prefix': 'user.'}}, PAYLOAD)
+    assert not matches({'data.amount': {'prefix': '1'}}, PAYLOAD)
+
+
+def test_in_with_unhashable_values():
+    assert not matches({'data.tags': {'in': ['vip']}}, PAYLOAD)
+    assert matches({'data.tags': {'nin': ['vip']}}, PAYLOAD)
+    # Options that cannot go in a set are compared one by one
+    assert matches({'data.tags': {'in': [['vip'], 'x']}}, PAYLOAD)
+
+
+def test_every_path_must_match():
+    assert matches({'event': 'order.paid', 'data.amount': {'gte': 100}}, PAYLOAD)
+    assert not matches({'event': 'order.paid', 'data.amount': {'gte': 200}}, PAYLOAD)
+
+
+def test_any_holds_if_one_option_does():
+    spec = {'$any': [{'event': 'order.created'}, {'data.currency': 'EUR'}]}
+    assert matches(spec, PAYLOAD)
+    assert not matches({'$any': [{'event': 'order.created'}, {'data.currency': 'USD'}]}, PAYLOAD)
+    assert not matches({'event': 'order.created', **spec}, PAYLOAD)
+
+
+def test_filters_are_cached_by_canonical_json():
+    first = compile_filter({'event': 'order.paid', 'data.amount': {'gte': 100, 'lt': 200}})
+    second = compile_filter({'data.amount': {'lt': 200, 'gte': 100}, 'event': 'order.paid'})
+    assert first is second
+
+
+@pytest.mark.parametrize('spec, message', [
+    (['event'], 'must be a JSON object'),
+    ('event', 'must be a JSON object'),
+    ({'event': {'like': 'order.%'}}, "Unknown filter operator 'like'"),
+    ({'event': {}}, "Empty condition for 'event'"),
+    ({'': 'x'}, 'must not be empty'),
+    ({'$.': 'x'}, 'must not be empty'),
+    ({'event': {'in': 'order.paid'}}, "'in' takes a list"),
+    ({'event': {'nin': None}}, "'nin' takes a list"),
+    ({'event': {'prefix': 1}}, "'prefix' takes a string"),
+    ({'data.amount': {'gt': True}}, "'gt' takes a number or a string"),
+    ({'data.amount': {'lte': [1]}}, "'lte' takes a number or a string"),
+    ({'$any': []}, "'$any' takes a non-empty list"),
+    ({'$any': {'event': 'x'}}, "'$any' takes a non-empty list"),
+    ({'$any': [{'event': {'like': 'x'}}]}, "Unknown filter operator 'like'"),
+])
+def test_invalid_filters(spec, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        validate_filter(spec)
+
+
+def test_filter_length_is_limited():
+    spec = {'event': {'in': ['x' * 100] * (MAX_FILTER_LENGTH // 100)}}
+    with pytest.raises(ValueError, match='at most'):
+        validate_filter(spec)
+    small = {'event': {'in': ['order.paid']}}
+    assert validate_filter(small) is small
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ({'data.paid': True}, True),
+    ({'data.paid': 1}, False),
+    ({'data.amount': {'ne': True}}, True),
+    ({'data.paid': {'in': [1, 'yes']}}, False),
+    ({'data.paid': {'in': [True]}}, True),
+    ({'data.paid': {'nin': [1]}}, True),
+    ({'data.amount': {'in': [True, 150.0]}}, True),
+    ({'data.paid': {'in': [[1], 1]}}, False),
+    ({'data.paid': {'in': [[1], True]}}, True),
+])
+def test_booleans_are_not_numbers(spec, expected):
+    assert matches(spec, PAYLOAD) is expected
+
+
+@pytest.mark.parametrize('value', [1, 0, 'yes', None, [True]])
+def test_exists_takes_a_boolean(value):
+    with pytest.raises(ValueError, match="'exists' takes true or false"):
+        validate_filter({'event': {'exists': value}})
+
+
+def test_subscription_filters_are_cached_by_id(monkeypatch):
+    compiled = []
+    monkeypatch.setattr(filters, 'compile_filter', lambda spec: compiled.append(spec) or compile_filter(spec))
+    spec = {'event': 'order.paid'}
+    assert matches(spec, PAYLOAD, 'cached')
+    assert matches(dict(spec), PAYLOAD, 'cached')
+    assert compiled == [spec]
+    forget_filter('cached')
+    assert not matches({'event': 'order.created'}, PAYLOAD, 'cached')
+    assert len(compiled) == 2
+
+
+def test_subscription_filters_expire(monkeypatch):
+    monkeypatch.setattr(filters, 'FILTER_CACHE_TTL', 0)
+    assert matches({'event': 'order.paid'}, PAYLOAD, 'expiring')
+    assert not matches({'event': 'order.created'}, PAYLOAD, 'expiring')
+
+
+def test_invalid_stored_filters_are_ignored():
+    assert matches({'event': {'like': 'x'}}, PAYLOAD, 'invalid')
+
+
+def test_an_updated_filter_applies_at_once(app):
+    client = app.test_client()
+    client.post('/subscriptions/createsubscription', json={'url': 'http://example.com/hook', 'secret': 's',
+                                                         'filter': {'flag': 1}})
+    assert client.post('/ingest/bypass-signature/1', json={'flag': 1}).get_json()['status'] == 'accepted'
+    update = client.put('/subscriptions/updatesubscription', json={'id': 1, 'filter': {'flag': True}})
+    assert update.status_code == 200
+    assert client.post('/ingest/bypass-signature/1', json={'flag': 1}).get_json()['status'] == 'filtered'
+    assert client.post('/ingest/bypass-signature/1', json={'flag': True}).get_json()['status'] == 'accepted'
@@ -0,0 +1,63 @@
+import pytest
+
+from app.histogram import SUB_BUCKETS, bucket_index, bucket_upper_bound, percentiles
+
+
+def test_small_values_get_a_bucket_each():
+    for value in range(SUB_BUCKETS):
+        assert bucket_index(value) == value
+        assert bucket_upper_bound(value) == value
+
+
+@pytest.mark.parametrize('value, index, upper', [
+    (16, 16, 16),
+    (31, 31, 31),
+    (32, 32, 33),
+    (33, 32, 33),
+    (34, 33, 35),
+    (63, 47, 63),
+    (64, 48, 67),
+    (1000, 111, 1023),
+    (1024, 112, 1087),
+])
+def test_bucket_edges(value, index, upper):
+    assert bucket_index(value) == index
+    assert bucket_upper_bound(index) == upper
+
+
+def test_buckets_are_contiguous_and_within_a_sixteenth():
+    previous = -1
+    for index in range(bucket_index(3_600_000) + 1):
+        lower, upper = previous + 1, bucket_upper_bound(index)
+        assert lower <= upper
+        assert bucket_index(lower) == index
+        assert bucket_index(upper) == index
+        assert upper - lower <= lower / SUB_BUCKETS
+        previous = upper
+
+
+def test_an_hour_fits_in_about_300_buckets():
+    assert bucket_index(3_600_000) < 320
+
+
+def test_negative_and_fractional_values():
+    assert bucket_index(-5) == 0
+    assert bucket_index(15.9) == 15
+    assert bucket_index(32.5) == bucket_index(32)
+
+
+def test_percentiles_report_bucket_upper_bounds():
+    counts = {bucket_index(10): 50, bucket_index(100): 40, bucket_index(1000): 10}
+    assert percentiles(counts) == {
+        'count': 100,
+        'p50': 10,
+        'p90': bucket_upper_bound(bucket_index(100)),
+        'p95': 1023,
+        'p99': 1023,
+        'max': 1023,
+    }
+
+
+def test_percentiles_of_nothing():
+    assert percentiles({}) == {'count': 0}
+    assert percentiles({3: 0}) == {'count': 0}
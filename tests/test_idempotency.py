@@ -0,0 +1,154 @@
+import hashlib
+import hmac
+import json
+
+import pytest
+
+from app import db, idempotency, redis_client
+from app.idempotency import INGEST_IDEMPOTENCY_PENDING_TTL, INGEST_IDEMPOTENCY_TTL, reserve
+from app.models import Subscription
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')  # fakeredis runs Lua scripts with lupa
+
+BODY = b'{"order": 1}'
+KEY = 'idempotency:1:key:order-1'
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_client, '_client', client)
+    return client
+
+
+def stored(client, key=KEY):
+    return json.loads(client.get(key))
+
+
+def test_requests_without_a_key_are_not_deduplicated(redis):
+    assert reserve(1, None, BODY).outcome == 'skip'
+    assert redis.keys() == []
+
+
+def test_a_new_key_is_reserved_while_the_request_runs(redis):
+    reservation = reserve(1, 'order-1', BODY, 'sha256=abc')
+    assert reservation.outcome == 'new'
+    assert stored(redis)['state'] == 'pending'
+    assert 0 < redis.ttl(KEY) <= INGEST_IDEMPOTENCY_PENDING_TTL
+    assert reserve(1, 'order-1', BODY, 'sha256=abc').outcome == 'in_progress'
+
+
+def test_completed_keys_answer_retries_with_the_webhook(redis):
+    reserve(1, 'order-1', BODY, 'sha256=abc').complete('webhook-1')
+    entry = stored(redis)
+    assert entry == {'state': 'done', 'hash': hashlib.sha256(BODY).hexdigest(), 'signature': 'sha256=abc',
+                     'webhook_id': 'webhook-1'}
+    assert redis.ttl(KEY) == INGEST_IDEMPOTENCY_TTL
+    retry = reserve(1, 'order-1', BODY, 'sha256=abc')
+    assert (retry.outcome, retry.webhook_id) == ('duplicate', 'webhook-1')
+
+
+def test_a_key_reused_with_another_body_is_a_mismatch(redis):
+    reserve(1, 'order-1', BODY).complete('webhook-1')
+    assert reserve(1, 'order-1', b'{"order": 2}').outcome == 'mismatch'
+
+
+def test_a_retry_with_another_signature_is_left_to_verification(redis):
+    reserve(1, 'order-1', BODY, 'sha256=abc').complete('webhook-1')
+    assert reserve(1, 'order-1', BODY, 'sha256=def').outcome == 'skip'
+    assert reserve(1, 'order-1', BODY).outcome == 'skip'
+
+
+def test_keys_are_scoped_to_the_subscription(redis):
+    reserve(1, 'order-1', BODY).complete('webhook-1')
+    assert reserve(2, 'order-1', BODY).outcome == 'new'
+
+
+def test_long_keys_are_truncated(redis):
+    reserve(1, 'k' * 1000, BODY)
+    assert redis.keys() == [f'idempotency:1:key:{"k" * 255}'.encode()]
+
+
+def test_release_gives_the_key_back(redis):
+    reservation = reserve(1, 'order-1', BODY)
+    reservation.release()
+    assert reservation.outcome == 'released'
+    assert not redis.exists(KEY)
+    assert reserve(1, 'order-1', BODY).outcome == 'new'
+
+
+def test_release_leaves_a_reservation_taken_over(redis):
+    lapsed = reserve(1, 'order-1', BODY)
+    # The reservation expired and another request reserved the key
+    redis.delete(KEY)
+    current = reserve(1, 'order-1', BODY)
+    lapsed.release()
+    assert redis.get(KEY).decode() == current.value
+    assert reserve(1, 'order-1', BODY).outcome == 'in_progress'
+
+
+def test_only_new_reservations_complete_or_release(redis):
+    reserve(1, 'order-1', BODY)
+    pending = reserve(1, 'order-1', BODY)
+    pending.release()
+    pending.complete('webhook-2')
+    assert pending.outcome == 'in_progress'
+    assert stored(redis)['state'] == 'pending'
+
+
+def test_payload_hash_dedup(redis, monkeypatch):
+    monkeypatch.setattr(idempotency, 'INGEST_DEDUP_PAYLOAD_HASH', True)
+    reserve(1, None, BODY).complete('webhook-1')
+    assert reserve(1, None, BODY).webhook_id == 'webhook-1'
+    assert reserve(1, None, b'{"order": 2}').outcome == 'new'
+
+
+def test_without_redis_requests_are_ingested(monkeypatch):
+    def unavailable():
+        raise ConnectionError('down')
+    monkeypatch.setattr(idempotency, 'get_redis', unavailable)
+    reservation = reserve(1, 'order-1', BODY)
+    assert reservation.outcome == 'skip'
+    reservation.complete('webhook-1')
+    reservation.release()
+
+
+@pytest.fixture
+def client(app, redis):
+    db.session.add(Subscription(id=1, url='http://example.com/hook', secret='s', secret_hash='h'))
+    db.session.commit()
+    return app.test_client()
+
+
+def ingest(client, body, key='order-1', secret='s', sub_id=1):
+    headers = {'Idempotency-Key': key}
+    if secret:
+        headers['X-Hub-Signature-256'] = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return client.post(f'/ingest/{sub_id}', data=body, content_type='application/json', headers=headers)
+
+
+def test_ingest_replays_a_signed_retry(client):
+    first = ingest(client, BODY)
+    assert first.status_code == 202
+    retry = ingest(client, BODY)
+    assert retry.status_code == 202
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json()['webhook_id'] == first.get_json()['webhook_id']
+
+
+def test_ingest_checks_the_signature_before_the_key(client, redis):
+    assert ingest(client, BODY, secret=None).status_code == 401
+    assert ingest(client, BODY, secret='wrong').status_code == 401
+    assert redis.keys('idempotency:*') == []
+    ingest(client, BODY)
+    # Not told that the key was used with another body
+    assert ingest(client, b'{"order": 2}', secret=None).status_code == 401
+    assert ingest(client, b'{"order": 2}').status_code == 422
+
+
+def test_ingest_looks_up_the_subscription_before_the_key(client, redis):
+    assert ingest(client, BODY, sub_id=2).status_code == 404
+    assert client.post('/ingest/bypass-signature/2', data=BODY, content_type='application/json',
+                       headers={'Idempotency-Key': 'order-1'}).status_code == 404
+    assert redis.keys('idempotency:*') == []
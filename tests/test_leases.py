@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from app import leases
+from app.leases import DELIVERED_PREFIX, LEASE_PREFIX, Lease, LeaseKeeper, acquire_lease
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')  # fakeredis runs Lua scripts with lupa
+
+WEBHOOK = 'webhook-1'
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(leases, 'get_redis', lambda: client)
+    return client
+
+
+@pytest.fixture
+def keeper(monkeypatch):
+    """A keeper of its own that renews every 50ms."""
+    monkeypatch.setattr(leases, 'LEASE_RENEW_INTERVAL', 0.05)
+    keeper = LeaseKeeper()
+    monkeypatch.setattr(leases, 'get_keeper', lambda: keeper)
+    yield keeper
+    with keeper.lock:
+        keeper.leases.clear()
+
+
+def test_a_second_copy_finds_the_lease_held(redis_client, keeper):
+    first = acquire_lease(WEBHOOK, 30)
+    assert first.outcome == 'acquired'
+    assert acquire_lease(WEBHOOK, 30).outcome == 'held'
+    assert 29000 < redis_client.pttl(LEASE_PREFIX + WEBHOOK) <= 30000
+    assert keeper.leases == {first}
+
+
+def test_release_frees_the_lease(redis_client, keeper):
+    lease = acquire_lease(WEBHOOK, 30)
+    lease.release()
+    assert lease.outcome == 'released'
+    assert keeper.leases == set()
+    assert not redis_client.exists(LEASE_PREFIX + WEBHOOK)
+    assert not redis_client.exists(DELIVERED_PREFIX + WEBHOOK)
+    assert acquire_lease(WEBHOOK, 30).outcome == 'acquired'
+
+
+def test_release_after_delivery_sets_the_delivered_guard(redis_client, keeper):
+    acquire_lease(WEBHOOK, 30).release(delivered=True)
+    assert redis_client.ttl(DELIVERED_PREFIX + WEBHOOK) == leases.DELIVERED_TTL
+    assert acquire_lease(WEBHOOK, 30).outcome == 'delivered'
+    assert not redis_client.exists(LEASE_PREFIX + WEBHOOK)
+
+
+def test_release_by_another_token_leaves_the_lease(redis_client, keeper):
+    held = acquire_lease(WEBHOOK, 30)
+    Lease(WEBHOOK, 'not-the-owner', 'acquired', 30000).release()
+    assert redis_client.get(LEASE_PREFIX + WEBHOOK).decode() == held.token
+    assert acquire_lease(WEBHOOK, 30).outcome == 'held'
+
+
+def test_only_acquired_leases_are_released(redis_client, keeper):
+    acquire_lease(WEBHOOK, 30)
+    copy = acquire_lease(WEBHOOK, 30)
+    copy.release(delivered=True)
+    assert copy.outcome == 'held'
+    assert redis_client.exists(LEASE_PREFIX + WEBHOOK)
+    assert not redis_client.exists(DELIVERED_PREFIX + WEBHOOK)
+
+
+def test_the_keeper_renews_a_lease_past_its_ttl(redis_client, keeper):
+    lease = acquire_lease(WEBHOOK, 0.2)
+    time.sleep(0.5)
+    assert acquire_lease(WEBHOOK, 0.2).outcome == 'held'
+    lease.release()
+    assert acquire_lease(WEBHOOK, 0.2).outcome == 'acquired'
+
+
+def test_a_lease_nobody_renews_lapses(redis_client, keeper):
+    lease = acquire_lease(WEBHOOK, 0.1)
+    keeper.discard(lease)
+    time.sleep(0.2)
+    assert acquire_lease(WEBHOOK, 30).outcome == 'acquired'
+
+
+def test_renew_skips_leases_taken_over(redis_client, keeper, caplog):
+    mine = Lease(WEBHOOK, 'lapsed', 'acquired', 30000)
+    other = acquire_lease(WEBHOOK, 5)
+    keeper.renew([mine, other])
+    assert 'delivery leases had expired before renewal' in caplog.text
+    # Only the current holder's lease was renewed, and with its own TTL
+    assert redis_client.get(LEASE_PREFIX + WEBHOOK).decode() == other.token
+    assert redis_client.pttl(LEASE_PREFIX + WEBHOOK) <= 5000
+
+
+def test_without_redis_the_task_delivers_anyway(monkeypatch, keeper):
+    def unavailable():
+        raise ConnectionError('down')
+    monkeypatch.setattr(leases, 'get_redis', unavailable)
+    lease = acquire_lease(WEBHOOK, 30)
+    assert lease.outcome == 'unavailable'
+    assert keeper.leases == set()
+    lease.release(delivered=True)
+    assert lease.outcome == 'unavailable'
+
+
+def test_disabled_leases(monkeypatch, redis_client, keeper):
+    monkeypatch.setattr(leases, 'DELIVERY_LEASES_ENABLED', False)
+    assert acquire_lease(WEBHOOK, 30).outcome == 'unavailable'
+    assert redis_client.keys() == []
+
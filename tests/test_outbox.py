@@ -0,0 +1,136 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+
+from app import db, outbox
+from app.models import OutboxMessage, Subscription, WebhookPayload
+from app.outbox import claim_batch, finish_batch, outbox_message, relay_batch, run_relay
+from app.payloads import store_payload
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Deliveries passed to publish_deliveries, instead of the broker."""
+    calls = []
+    monkeypatch.setattr(outbox, 'publish_deliveries', lambda deliveries: calls.extend(deliveries))
+    return calls
+
+
+def add_webhooks(count, priority=None):
+    subscription = Subscription(url='http://example.com/hook')
+    db.session.add(subscription)
+    db.session.flush()
+    ids = []
+    for n in range(count):
+        webhook = WebhookPayload(subscription_id=subscription.id, payload_hash=store_payload({'n': n}))
+        db.session.add_all([webhook, outbox_message(webhook, priority)])
+        db.session.flush()
+        ids.append(webhook.id)
+    db.session.commit()
+    return ids
+
+
+def outbox_rows():
+    return db.session.execute(select(func.count()).select_from(OutboxMessage)).scalar()
+
+
+def expire_claims():
+    db.session.execute(update(OutboxMessage).values(claimed_until=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+
+
+def test_claim_takes_the_oldest_rows(app):
+    ids = add_webhooks(5, priority=0)
+    rows = claim_batch(3)
+    db.session.commit()
+    assert [row.webhook_id for row in rows] == ids[:3]
+    assert {row.priority for row in rows} == {0}
+    assert [row.webhook_id for row in claim_batch(10)] == ids[3:]
+
+
+def test_claimed_rows_are_not_claimed_again(app):
+    add_webhooks(2)
+    claim_batch(10)
+    db.session.commit()
+    assert claim_batch(10) == []
+
+
+def test_expired_claims_are_claimed_again(app):
+    ids = add_webhooks(2)
+    claim_batch(10)
+    db.session.commit()
+    expire_claims()
+    assert [row.webhook_id for row in claim_batch(10)] == ids
+
+
+def test_claims_last_the_claim_ttl(app, monkeypatch):
+    monkeypatch.setattr(outbox, 'OUTBOX_CLAIM_TTL', 30)
+    add_webhooks(1)
+    before = datetime.utcnow()
+    claim_batch(10)
+    db.session.commit()
+    claimed_until = db.session.execute(select(OutboxMessage.claimed_until)).scalar()
+    assert before + timedelta(seconds=30) <= claimed_until <= datetime.utcnow() + timedelta(seconds=30)
+
+
+def test_finish_deletes_published_rows(app):
+    add_webhooks(3)
+    rows = claim_batch(10)
+    db.session.commit()
+    finish_batch([row.id for row in rows[:2]], published=True)
+    assert outbox_rows() == 1
+
+
+def test_finish_releases_unpublished_rows(app):
+    ids = add_webhooks(3)
+    rows = claim_batch(10)
+    db.session.commit()
+    finish_batch([row.id for row in rows], published=False)
+    assert outbox_rows() == 3
+    assert [row.webhook_id for row in claim_batch(10)] == ids
+
+
+def test_relay_publishes_and_deletes(app, published):
+    ids = add_webhooks(3, priority=6)
+    assert relay_batch(2) == 2
+    assert relay_batch(2) == 1
+    assert relay_batch(2) == 0
+    assert published == [(webhook_id, None, 6) for webhook_id in ids]
+    assert outbox_rows() == 0
+
+
+def test_failed_publish_releases_the_claims(app, monkeypatch):
+    def unavailable(deliveries):
+        raise ConnectionError('broker down')
+    ids = add_webhooks(2)
+    monkeypatch.setattr(outbox, 'publish_deliveries', unavailable)
+    with pytest.raises(ConnectionError):
+        relay_batch()
+    # Claimed again at once, without waiting for the claim to expire
+    assert [row.webhook_id for row in claim_batch(10)] == ids
+
+
+def test_run_relay_drains_the_outbox_until_stopped(app, published, monkeypatch):
+    monkeypatch.setattr(outbox, 'OUTBOX_BATCH_SIZE', 2)
+    monkeypatch.setattr(outbox, 'OUTBOX_POLL_INTERVAL', 0.01)
+    ids = add_webhooks(5)
+    stop = threading.Event()
+
+    def relay():
+        with app.app_context():
+            run_relay(stop)
+    thread = threading.Thread(target=relay)
+    thread.start()
+    try:
+        for _ in range(500):
+            if len(published) == len(ids):
+                break
+            stop.wait(0.01)
+    finally:
+        stop.set()
+        thread.join(5)
+    assert not thread.is_alive()
+    assert sorted(webhook_id for webhook_id, _, _ in published) == sorted(ids)
+    assert outbox_rows() == 0
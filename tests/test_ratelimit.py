@@ -0,0 +1,159 @@
+import math
+
+import pytest
+
+from app import ratelimit
+from app.ratelimit import RATE_LIMIT_SYNC_INTERVAL, RateLimiter
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')  # fakeredis runs Lua scripts with lupa
+
+RATE = 10
+BURST = 20
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(ratelimit, 'get_redis', lambda: client)
+    return client
+
+
+@pytest.fixture
+def leases(redis_client, monkeypatch):
+    """Arguments of every lease script call."""
+    calls = []
+    script = ratelimit.lease_script()
+
+    def lease(keys, args):
+        calls.append(args)
+        return script(keys=keys, args=args)
+    monkeypatch.setattr(ratelimit, 'lease_script', lambda: lease)
+    return calls
+
+
+def lease(client, now, wanted, unused=0, key='ratelimit:test:1'):
+    granted, wait = client.register_script(ratelimit._LEASE)(keys=[key], args=[RATE, BURST, now, wanted, unused])
+    return int(granted), float(wait)
+
+
+def tokens(client, key='ratelimit:test:1'):
+    return float(client.hget(key, 'tokens'))
+
+
+def test_script_grants_from_a_full_bucket(redis_client):
+    assert lease(redis_client, 1000, 5) == (5, 0)
+    assert tokens(redis_client) == BURST - 5
+    # Kept for the time a refill to the burst takes, plus a second
+    assert 2000 < redis_client.pttl('ratelimit:test:1') <= BURST // RATE * 1000 + 1000
+
+
+def test_script_refills_at_the_rate_up_to_the_burst(redis_client):
+    lease(redis_client, 1000, 20)
+    assert lease(redis_client, 1000.5, 20) == (5, 0)
+    assert lease(redis_client, 1100, 30) == (BURST, 0)
+
+
+def test_script_takes_back_unused_tokens(redis_client):
+    lease(redis_client, 1000, 20)
+    assert lease(redis_client, 1000, 5, unused=3) == (3, 0)
+    lease(redis_client, 1000, 5)
+    # Returned tokens do not raise the bucket above its burst
+    assert lease(redis_client, 1100, 1, unused=5) == (1, 0)
+    assert tokens(redis_client) == BURST - 1
+
+
+def test_script_says_when_the_next_token_is_due(redis_client):
+    lease(redis_client, 1000, 20)
+    assert lease(redis_client, 1000, 5) == (0, pytest.approx(1 / RATE))
+    assert lease(redis_client, 1000.05, 5) == (0, pytest.approx(0.5 / RATE))
+
+
+def test_block_size():
+    assert RateLimiter('test', RATE, BURST).block == min(BURST, math.ceil(RATE * RATE_LIMIT_SYNC_INTERVAL))
+    assert RateLimiter('test', 1000, 5).block == 5
+    assert RateLimiter('test', 0.1, 0).block == 1
+
+
+def test_tokens_are_leased_in_blocks(clock, leases):
+    limiter = RateLimiter('test', RATE, BURST)
+    assert [limiter.acquire(1) for _ in range(BURST)] == [0] * BURST
+    assert len(leases) == BURST // limiter.block
+    assert limiter.acquire(1) == pytest.approx(1 / RATE)
+    calls = len(leases)
+
+    # Refused locally until the next token is due
+    clock.now += 0.05
+    assert limiter.acquire(1) == pytest.approx(0.05)
+    assert len(leases) == calls
+    clock.now += 0.15
+    assert limiter.acquire(1) == 0
+    assert len(leases) == calls + 1
+
+
+def test_processes_share_the_limit(clock, leases):
+    processes = [RateLimiter('test', RATE, BURST) for _ in range(3)]
+    allowed = sum(processes[i % 3].acquire(1) == 0 for i in range(100))
+    assert allowed == BURST
+
+
+def test_expired_blocks_are_handed_back(clock, leases, redis_client):
+    limiter = RateLimiter('test', RATE, BURST)
+    limiter.acquire(1)
+    assert tokens(redis_client) == BURST - limiter.block
+    clock.now += RATE_LIMIT_SYNC_INTERVAL
+    limiter.acquire(1)
+    assert leases[1][4] == limiter.block - 1
+    # Refilled to the burst with the returned tokens, then the next block taken
+    assert tokens(redis_client) == BURST - limiter.block
+
+
+def test_keys_have_separate_buckets(clock, leases):
+    limiter = RateLimiter('test', 1, 1)
+    assert limiter.acquire('a') == 0
+    assert limiter.acquire('a') > 0
+    assert limiter.acquire('b') == 0
+
+
+def test_without_redis_each_process_enforces_the_limit(clock, monkeypatch):
+    def unavailable():
+        raise ConnectionError('down')
+    monkeypatch.setattr(ratelimit, 'lease_script', unavailable)
+    limiter = RateLimiter('test', RATE, BURST)
+    assert sum(limiter.acquire(1) == 0 for _ in range(100)) == BURST
+    assert limiter.acquire(1) == pytest.approx(1 / RATE)
+    clock.now += 1
+    assert sum(limiter.acquire(1) == 0 for _ in range(100)) == RATE
+
+
+def test_disabled_limiter_allows_everything(leases):
+    limiter = RateLimiter('test', 0, 0)
+    assert not limiter.enabled
+    assert all(limiter.acquire(1) == 0 for _ in range(100))
+    assert leases == []
+
+
+def test_local_buckets_are_capped(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'MAX_LOCAL_BUCKETS', 3)
+    limiter = RateLimiter('test', RATE, BURST)
+    for key in range(10):
+        limiter.bucket(key)
+        assert len(limiter.buckets) <= 3
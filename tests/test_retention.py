@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from app import db, retention
+from app.models import DeadLetter, Event, PayloadBlob, Subscription, WebhookPayload, WebhookStatus
+from app.payloads import PAYLOAD_TOUCH_INTERVAL, payload_hash, store_payload
+from app.retention import purge_expired
+
+NOW = datetime.utcnow()  # blobs are kept by last_seen_at against the clock
+OLD = NOW - timedelta(days=retention.WEBHOOK_RETENTION_DAYS + 1)
+RECENT = NOW - timedelta(days=1)
+
+
+@pytest.fixture
+def subscription(app):
+    db.session.add(Subscription(id=1, url='http://example.com/hook'))
+    db.session.commit()
+    return 1
+
+
+def add_webhook(body, state='delivered', received_at=OLD, event_id=None, dead_at=None):
+    webhook = WebhookPayload(subscription_id=1, payload_hash=store_payload(body), received_at=received_at,
+                             event_id=event_id)
+    db.session.add_all([webhook, WebhookStatus(webhook=webhook, subscription_id=1, state=state)])
+    db.session.flush()
+    if dead_at is not None:
+        db.session.add(DeadLetter(webhook_id=webhook.id, subscription_id=1, attempts=5, dead_at=dead_at))
+    db.session.commit()
+    return webhook.id
+
+
+def age_blobs(last_seen_at=OLD):
+    db.session.execute(update(PayloadBlob).values(last_seen_at=last_seen_at))
+    db.session.commit()
+
+
+def webhooks():
+    return set(db.session.execute(select(WebhookPayload.id)).scalars())
+
+
+def blobs():
+    return set(db.session.execute(select(PayloadBlob.hash)).scalars())
+
+
+def test_expired_webhooks_and_their_blobs_are_purged(subscription):
+    add_webhook({'n': 1})
+    kept = add_webhook({'n': 2}, received_at=RECENT)
+    age_blobs()
+    assert purge_expired(NOW) == 1
+    assert webhooks() == {kept}
+    assert blobs() == {payload_hash({'n': 2})}
+
+
+def test_a_blob_still_referenced_survives(subscription):
+    add_webhook({'shared': True})
+    kept = add_webhook({'shared': True}, received_at=RECENT)
+    age_blobs()
+    assert purge_expired(NOW) == 1
+    assert webhooks() == {kept}
+    assert blobs() == {payload_hash({'shared': True})}
+
+
+def test_a_blob_referenced_by_an_event_survives(subscription):
+    digest = store_payload({'event': 1})
+    db.session.add(Event(id='event-1', topic='orders', payload_hash=digest))
+    db.session.commit()
+    add_webhook({'event': 1}, event_id='event-1', received_at=RECENT)
+    add_webhook({'event': 1})
+    age_blobs()
+    assert purge_expired(NOW) == 1
+    assert blobs() == {digest}
+
+
+def test_a_recently_seen_blob_survives(subscription):
+    add_webhook({'n': 1})
+    # Ingest refreshed it for a webhook it has not committed yet
+    age_blobs(NOW - timedelta(seconds=PAYLOAD_TOUCH_INTERVAL))
+    assert purge_expired(NOW) == 1
+    assert webhooks() == set()
+    assert blobs() == {payload_hash({'n': 1})}
+
+
+def test_events_without_webhooks_are_purged(subscription):
+    db.session.add(Event(id='event-1', topic='orders', payload_hash=store_payload({'event': 1})))
+    db.session.commit()
+    add_webhook({'event': 1}, event_id='event-1')
+    age_blobs()
+    purge_expired(NOW)
+    assert db.session.execute(select(Event.id)).all() == []
+    assert blobs() == set()
+
+
+def test_dead_letters_are_kept_by_default(subscription, monkeypatch):
+    monkeypatch.setattr(retention, 'DEAD_LETTER_RETENTION_DAYS', 0)
+    dead = add_webhook({'n': 1}, state='dead', dead_at=OLD)
+    add_webhook({'n': 2})
+    age_blobs()
+    assert purge_expired(NOW) == 1
+    assert webhooks() == {dead}
+    assert blobs() == {payload_hash({'n': 1})}
+    assert db.session.execute(select(DeadLetter.webhook_id)).scalar() == dead
+
+
+def test_dead_letters_have_their_own_retention(subscription, monkeypatch):
+    monkeypatch.setattr(retention, 'DEAD_LETTER_RETENTION_DAYS', 7)
+    add_webhook({'n': 1}, state='dead', dead_at=NOW - timedelta(days=8))
+    # Received long ago but dead-lettered recently
+    kept = add_webhook({'n': 2}, state='dead', dead_at=NOW - timedelta(days=6))
+    assert purge_expired(NOW) == 1
+    assert webhooks() == {kept}
+    assert db.session.execute(select(DeadLetter.webhook_id)).scalars().all() == [kept]
+
+
+def test_undelivered_webhooks_are_kept(subscription):
+    pending = add_webhook({'n': 1}, state='pending')
+    retrying = add_webhook({'n': 2}, state='retrying')
+    assert purge_expired(NOW) == 0
+    assert webhooks() == {pending, retrying}
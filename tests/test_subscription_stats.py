@@ -0,0 +1,14 @@
+import pytest
+
+
+@pytest.mark.parametrize('query, status', [
+    ('limit=1', 200),
+    ('limit=500', 200),
+    ('limit=0', 400),
+    ('limit=-1', 400),
+    ('limit=many', 400),
+    ('quantile=100', 400),
+    ('metric=dns', 400),
+])
+def test_latency_ranking_parameters(app, query, status):
+    assert app.test_client().get(f'/subscriptions/stats/latency?{query}').status_code == status